@@ -3,52 +3,24 @@ from config import Config
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_login import LoginManager
-import logging
-from logging.handlers import SMTPHandler, RotatingFileHandler
-import os
 from flask_mail import Mail
+from app.database import configura_sqlite
+from app.log import configura_log
 
 app = Flask(__name__)
 app.config.from_object(Config)
 db = SQLAlchemy(app)
+with app.app_context():
+    configura_sqlite(db.engine, app.config['DB_PROFILO'], app.config['DB_SERIALIZZA_SCRITTURE'])
 migrate = Migrate(app, db)
 login = LoginManager(app)
 login.login_view = 'login'
 login.login_message = 'Devi effettuare il login per accedere a questa pagina.'
 mail = Mail(app)
 
-# Configurazione logging
+# Configurazione logging: coda non bloccante verso file JSON ed email di errore
 if not app.debug:
-    # Email per errori
-    if app.config['MAIL_SERVER']:
-        auth = None
-        secure = None
-        if app.config['MAIL_USERNAME'] or app.config['MAIL_PASSWORD']:
-            auth = (app.config['MAIL_USERNAME'], app.config['MAIL_PASSWORD'])
-        if app.config['MAIL_USE_TLS']:
-            secure = ()
-        mail_handler = SMTPHandler(
-            mailhost=(app.config['MAIL_SERVER'], app.config['MAIL_PORT']),
-            fromaddr='dorus0100@gmail.com',
-            toaddrs=app.config['ADMINS'],
-            subject='Errore Gestione Mensa',
-            credentials=auth,
-            secure=secure
-        )
-        mail_handler.setLevel(logging.ERROR)
-        app.logger.addHandler(mail_handler)
-
-    # File logging
-    if not os.path.exists('logs'):
-        os.mkdir('logs')
-    file_handler = RotatingFileHandler('logs/mensa.log', maxBytes=10240, backupCount=10)
-    file_handler.setFormatter(logging.Formatter(
-        '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'
-    ))
-    file_handler.setLevel(logging.INFO)
-    app.logger.addHandler(file_handler)
-    
-    app.logger.setLevel(logging.INFO)
+    configura_log(app)
     app.logger.info('Gestione Speed Mensa')
 
-from app import routes, models, errors
\ No newline at end of file
+from app import routes, models, errors, cli, metriche
\ No newline at end of file
@@ -0,0 +1,227 @@
+import os
+import pickle
+import threading
+from collections import OrderedDict, namedtuple
+from time import monotonic, time
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+from flask_login import UserMixin
+from app import app, db, login
+from app import queries
+from app.models import User
+
+MenuSnapshot = namedtuple('MenuSnapshot', [
+    'id', 'data', 'primo', 'secondo', 'contorno', 'frutta', 'dolce', 'prezzo', 'disponibile'
+])
+
+_CampiUtente = namedtuple('_CampiUtente', [
+    'id', 'username', 'email', 'nome', 'cognome', 'matricola', 'is_gestore'
+])
+
+_MANCANTE = object()
+
+
+class CacheMemoria:
+    """Cache locale al processo con scadenza (TTL) ed eliminazione LRU"""
+
+    def __init__(self, ttl, maxsize):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._dati = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, chiave):
+        with self._lock:
+            elemento = self._dati.get(chiave)
+            if elemento is None:
+                return _MANCANTE
+            scadenza, valore = elemento
+            if monotonic() >= scadenza:
+                del self._dati[chiave]
+                return _MANCANTE
+            self._dati.move_to_end(chiave)
+            return valore
+
+    def set(self, chiave, valore):
+        with self._lock:
+            self._dati[chiave] = (monotonic() + self.ttl, valore)
+            self._dati.move_to_end(chiave)
+            while len(self._dati) > self.maxsize:
+                self._dati.popitem(last=False)
+
+    def delete(self, chiave):
+        with self._lock:
+            self._dati.pop(chiave, None)
+
+    def clear(self):
+        with self._lock:
+            self._dati.clear()
+
+
+class CacheFile:
+    """Cache condivisa tra processi sulla stessa macchina, un file pickle per chiave"""
+
+    def __init__(self, ttl, cartella):
+        self.ttl = ttl
+        self.cartella = cartella
+        os.makedirs(cartella, exist_ok=True)
+
+    def _percorso(self, chiave):
+        return os.path.join(self.cartella, chiave.replace(':', '_') + '.cache')
+
+    def get(self, chiave):
+        try:
+            with open(self._percorso(chiave), 'rb') as f:
+                scadenza, valore = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return _MANCANTE
+        return valore if time() < scadenza else _MANCANTE
+
+    def set(self, chiave, valore):
+        # Scrittura su file temporaneo e rename atomico: i lettori non vedono file a metà
+        temporaneo = f'{self._percorso(chiave)}.{os.getpid()}.{threading.get_ident()}'
+        with open(temporaneo, 'wb') as f:
+            pickle.dump((time() + self.ttl, valore), f)
+        os.replace(temporaneo, self._percorso(chiave))
+
+    def delete(self, chiave):
+        try:
+            os.remove(self._percorso(chiave))
+        except FileNotFoundError:
+            pass
+
+    def clear(self):
+        for nome in os.listdir(self.cartella):
+            if nome.endswith('.cache'):
+                try:
+                    os.remove(os.path.join(self.cartella, nome))
+                except FileNotFoundError:
+                    pass
+
+
+class CacheRedis:
+    """Cache condivisa su un server compatibile Redis (richiede il pacchetto redis)"""
+
+    def __init__(self, ttl, url, prefisso='speedmensa:'):
+        import redis
+        self.ttl = ttl
+        self.prefisso = prefisso
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, chiave):
+        dati = self.client.get(self.prefisso + chiave)
+        return _MANCANTE if dati is None else pickle.loads(dati)
+
+    def set(self, chiave, valore):
+        self.client.set(self.prefisso + chiave, pickle.dumps(valore), ex=max(int(self.ttl), 1))
+
+    def delete(self, chiave):
+        self.client.delete(self.prefisso + chiave)
+
+    def clear(self):
+        chiavi = list(self.client.scan_iter(self.prefisso + '*'))
+        if chiavi:
+            self.client.delete(*chiavi)
+
+
+class ReadThroughCache:
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_config(cls, config, prefisso='MENU_CACHE'):
+        tipo = config[f'{prefisso}_BACKEND']
+        ttl = config[f'{prefisso}_TTL']
+        if tipo == 'nessuna':
+            return cls(None)
+        if tipo == 'file':
+            return cls(CacheFile(ttl, config[f'{prefisso}_DIR']))
+        if tipo == 'redis':
+            return cls(CacheRedis(ttl, config[f'{prefisso}_URL'], prefisso=f'speedmensa:{prefisso.lower()}:'))
+        return cls(CacheMemoria(ttl, config[f'{prefisso}_SIZE']))
+
+    def get_or_load(self, chiave, carica):
+        """Restituisce il valore in cache o lo calcola con `carica()` e lo memorizza"""
+        if self.backend is None:
+            return carica()
+        valore = self.backend.get(chiave)
+        if valore is not _MANCANTE:
+            self.hits += 1
+            return valore
+        self.misses += 1
+        valore = carica()
+        self.backend.set(chiave, valore)
+        return valore
+
+    def invalida(self, chiave=None):
+        """Elimina una chiave, o tutto il contenuto se non è indicata"""
+        if self.backend is None:
+            return
+        if chiave is None:
+            self.backend.clear()
+        else:
+            self.backend.delete(chiave)
+
+    def statistiche(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+menu_cache = ReadThroughCache.from_config(app.config)
+
+
+def menu_disponibili(dal):
+    """Menu prenotabili dalla data indicata, letti dalla cache quando possibile"""
+    def carica():
+        return [
+            MenuSnapshot(m.id, m.data, m.primo, m.secondo, m.contorno, m.frutta,
+                         m.dolce, m.prezzo, m.disponibile)
+            for m in db.session.scalars(queries.menu_disponibili(dal))
+        ]
+    return menu_cache.get_or_load(f'menu_disponibili:{dal.isoformat()}', carica)
+
+
+class UtenteSnapshot(UserMixin, _CampiUtente):
+    """Copia immutabile dei campi dell'utente letti da viste e template.
+
+    È il `current_user` delle richieste autenticate: per modificare l'utente
+    va caricato il modello con `db.session.get(User, current_user.id)`.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def da_utente(cls, user):
+        return cls(user.id, user.username, user.email, user.nome, user.cognome,
+                   user.matricola, user.is_gestore)
+
+
+utenti_cache = ReadThroughCache.from_config(app.config, 'UTENTI_CACHE')
+
+
+@login.user_loader
+def load_user(id):
+    """Utente della sessione dalla cache, senza SELECT sulla chiave primaria a ogni richiesta"""
+    def carica():
+        user = db.session.get(User, int(id))
+        return UtenteSnapshot.da_utente(user) if user else None
+    return utenti_cache.get_or_load(f'utente:{id}', carica)
+
+
+# Gli utenti modificati tramite ORM escono dalla cache dopo il commit, così nessuna
+# richiesta concorrente rimette in cache i valori precedenti. Gli UPDATE in blocco
+# non passano da qui e vanno invalidati a mano.
+@sa.event.listens_for(so.Session, 'after_flush')
+def _raccogli_utenti(session, flush_context):
+    modificati = {obj.id for obj in session.dirty | session.deleted if isinstance(obj, User)}
+    if modificati:
+        session.info.setdefault('utenti_modificati', set()).update(modificati)
+
+@sa.event.listens_for(so.Session, 'after_commit')
+def _invalida_utenti(session):
+    for id in session.info.pop('utenti_modificati', ()):
+        utenti_cache.invalida(f'utente:{id}')
+
+@sa.event.listens_for(so.Session, 'after_soft_rollback')
+def _scarta_utenti(session, previous_transaction):
+    session.info.pop('utenti_modificati', None)
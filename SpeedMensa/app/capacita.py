@@ -0,0 +1,138 @@
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql, sqlite
+from app import app, db
+from app.models import MenuGiornaliero, PostiSlot, Prenotazione, ChiaveIdempotenza
+from app.statistiche import applica_transizioni
+
+# Stati che occupano un posto nello slot di ritiro
+STATI_OCCUPANTI = ['in_attesa', 'pagata', 'confermata', 'ritirata']
+
+
+def capienza_slot():
+    return app.config['POSTI_DISPONIBILI_PER_SLOT']
+
+def _crea_contatore(menu_id, orario_ritiro):
+    """Crea la riga contatore dello slot ignorando i conflitti con inserimenti concorrenti"""
+    valori = {'menu_id': menu_id, 'orario_ritiro': orario_ritiro, 'occupati': 0}
+    dialetto = db.session.get_bind().dialect.name
+    if dialetto == 'sqlite':
+        stmt = sqlite.insert(PostiSlot).values(**valori).on_conflict_do_nothing()
+    elif dialetto == 'postgresql':
+        stmt = postgresql.insert(PostiSlot).values(**valori).on_conflict_do_nothing()
+    else:
+        stmt = sa.insert(PostiSlot).values(**valori).prefix_with('IGNORE')
+    db.session.execute(stmt)
+
+def occupa_posto(menu_id, orario_ritiro):
+    """Occupa un posto con un UPDATE condizionato; restituisce False se lo slot è pieno.
+
+    Il controllo sulla capienza e l'incremento avvengono nello stesso statement,
+    quindi due richieste concorrenti non possono superare il limite. Il commit
+    è lasciato al chiamante, insieme alla prenotazione.
+    """
+    stmt = (
+        sa.update(PostiSlot)
+        .where(
+            PostiSlot.menu_id == menu_id,
+            PostiSlot.orario_ritiro == orario_ritiro,
+            PostiSlot.occupati < capienza_slot()
+        )
+        .values(occupati=PostiSlot.occupati + 1)
+        .execution_options(synchronize_session=False)
+    )
+    if db.session.execute(stmt).rowcount == 1:
+        return True
+    if db.session.get(PostiSlot, (menu_id, orario_ritiro)) is not None:
+        return False
+    # Primo posto richiesto per lo slot: si crea il contatore e si riprova
+    _crea_contatore(menu_id, orario_ritiro)
+    return db.session.execute(stmt).rowcount == 1
+
+def libera_posto(menu_id, orario_ritiro):
+    """Restituisce un posto allo slot (es. dopo una cancellazione)"""
+    db.session.execute(
+        sa.update(PostiSlot)
+        .where(
+            PostiSlot.menu_id == menu_id,
+            PostiSlot.orario_ritiro == orario_ritiro,
+            PostiSlot.occupati > 0
+        )
+        .values(occupati=PostiSlot.occupati - 1)
+        .execution_options(synchronize_session=False)
+    )
+
+def scadi_prenotazioni(ttl=None):
+    """Porta a scaduta le prenotazioni in attesa più vecchie di `ttl` e ne libera i posti.
+
+    Un solo UPDATE sull'indice parziale delle prenotazioni in attesa, con
+    RETURNING degli slot coinvolti, poi un UPDATE per slot sui contatori: i
+    posti tornano liberi nella stessa transazione. Sono escluse le prenotazioni
+    con una cattura PayPal già avviata. Restituisce il numero di prenotazioni
+    scadute; il commit è lasciato al chiamante.
+    """
+    ttl = ttl or timedelta(minutes=app.config['PRENOTAZIONE_TTL'])
+    adesso = datetime.now(timezone.utc)
+    righe = db.session.execute(
+        sa.update(Prenotazione)
+        .where(
+            Prenotazione.stato == 'in_attesa',
+            Prenotazione.created_at < adesso - ttl,
+            ~sa.exists().where(ChiaveIdempotenza.prenotazione_id == Prenotazione.id)
+        )
+        .values(stato='scaduta', updated_at=adesso)
+        .returning(Prenotazione.menu_id, Prenotazione.orario_ritiro)
+        .execution_options(synchronize_session=False)
+    ).all()
+    if not righe:
+        return 0
+    applica_transizioni(db.session, [(menu_id, orario, 'in_attesa', 'scaduta')
+                                     for menu_id, orario in righe])
+    for (menu_id, orario), numero in Counter(map(tuple, righe)).items():
+        db.session.execute(
+            sa.update(PostiSlot)
+            .where(PostiSlot.menu_id == menu_id, PostiSlot.orario_ritiro == orario)
+            .values(occupati=sa.case((PostiSlot.occupati > numero, PostiSlot.occupati - numero), else_=0))
+            .execution_options(synchronize_session=False)
+        )
+    return len(righe)
+
+def posti_rimanenti(menu_id, orario_ritiro):
+    """Posti ancora liberi in uno slot (lookup per chiave primaria)"""
+    occupati = db.session.scalar(
+        sa.select(PostiSlot.occupati).where(
+            PostiSlot.menu_id == menu_id,
+            PostiSlot.orario_ritiro == orario_ritiro
+        )
+    )
+    return max(capienza_slot() - (occupati or 0), 0)
+
+def posti_per_slot(menu_id, orari):
+    """Posti liberi per ciascuno degli orari indicati"""
+    occupati = dict(db.session.execute(
+        sa.select(PostiSlot.orario_ritiro, PostiSlot.occupati)
+        .where(PostiSlot.menu_id == menu_id)
+    ).all())
+    capienza = capienza_slot()
+    return {orario: max(capienza - occupati.get(orario, 0), 0) for orario in orari}
+
+_QUERY_DISPONIBILITA = (
+    sa.select(MenuGiornaliero.disponibile, PostiSlot.orario_ritiro, PostiSlot.occupati)
+    .outerjoin(PostiSlot, PostiSlot.menu_id == MenuGiornaliero.id)
+    .where(MenuGiornaliero.id == sa.bindparam('menu_id'))
+)
+
+def disponibilita_menu(menu_id, orari):
+    """Posti liberi per orario di un menu prenotabile, None se il menu non lo è.
+
+    Una sola query sui contatori su una connessione del pool, senza sessione
+    ORM: è la lettura più frequente durante l'ora di punta.
+    """
+    with db.engine.connect() as conn:
+        righe = conn.execute(_QUERY_DISPONIBILITA, {'menu_id': menu_id}).all()
+    if not righe or not righe[0].disponibile:
+        return None
+    occupati = {riga.orario_ritiro: riga.occupati for riga in righe if riga.orario_ritiro}
+    capienza = capienza_slot()
+    return {orario: max(capienza - occupati.get(orario, 0), 0) for orario in orari}
@@ -0,0 +1,323 @@
+from datetime import date, datetime, timezone, timedelta
+from time import perf_counter, sleep
+import threading
+import click
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+from flask_mail import Message
+from app import app, db
+from app.models import MenuGiornaliero, Prenotazione, User
+from app.email import EmailWorkerPool
+from app import statistiche as aggregati
+from app.pagamenti import riconcilia
+from app.capacita import scadi_prenotazioni
+from app.importazione import importa_utenti
+from app.pianificazione import pianifica, clona, leggi_menu, PianificazioneNonValida
+from app.cache import menu_cache
+
+
+def _blocchi(sequenza, dimensione):
+    for i in range(0, len(sequenza), dimensione):
+        yield sequenza[i:i + dimensione]
+
+
+@app.cli.command('promemoria')
+@click.option('--data', 'giorno', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+              help='Giorno del ritiro (default: oggi).')
+@click.option('--orario', required=True, help='Orario di ritiro, es. 12:30.')
+@click.option('--blocco', default=200, show_default=True, help='Prenotazioni elaborate per blocco.')
+@click.option('--workers', default=None, type=int, help='Connessioni SMTP parallele (default: MAIL_WORKERS).')
+def promemoria(giorno, orario, blocco, workers):
+    """Invia il promemoria di ritiro alle prenotazioni pagate di uno slot.
+
+    Ogni prenotazione viene marcata prima dell'invio: rilanciare il comando
+    dopo un'interruzione non invia due volte lo stesso promemoria.
+    """
+    giorno = giorno.date() if giorno else date.today()
+    prenotazioni = db.session.scalars(
+        sa.select(Prenotazione)
+        .join(Prenotazione.menu)
+        .join(Prenotazione.utente)
+        .options(so.contains_eager(Prenotazione.menu), so.contains_eager(Prenotazione.utente))
+        .where(
+            MenuGiornaliero.data == giorno,
+            Prenotazione.orario_ritiro == orario,
+            Prenotazione.stato.in_(['pagata', 'confermata']),
+            Prenotazione.promemoria_inviato_at.is_(None)
+        )
+        .order_by(Prenotazione.id)
+    ).all()
+    if not prenotazioni:
+        click.echo('Nessun promemoria da inviare.')
+        return
+    # Staccate dalla sessione, le prenotazioni non vengono ricaricate dopo ogni commit
+    db.session.expunge_all()
+
+    template_txt = app.jinja_env.get_template('email/promemoria_ritiro.txt')
+    template_html = app.jinja_env.get_template('email/promemoria_ritiro.html')
+    pool = EmailWorkerPool.from_config(app)
+    if workers:
+        pool.workers = workers
+    non_inviati = []
+    lock = threading.Lock()
+
+    def al_termine(msg, inviato):
+        if not inviato:
+            with lock:
+                non_inviati.append(msg.prenotazione_id)
+
+    inizio = perf_counter()
+    accodati = 0
+    for gruppo in _blocchi(prenotazioni, blocco):
+        messaggi = {}
+        for prenotazione in gruppo:
+            contesto = {'user': prenotazione.utente, 'prenotazione': prenotazione,
+                        'menu': prenotazione.menu}
+            msg = Message('[Speed Mensa] Promemoria Ritiro Pasto',
+                          sender=app.config['ADMINS'][0],
+                          recipients=[prenotazione.utente.email])
+            msg.body = template_txt.render(**contesto)
+            msg.html = template_html.render(**contesto)
+            msg.prenotazione_id = prenotazione.id
+            messaggi[prenotazione.id] = msg
+        # Marca il blocco prima di inviarlo; RETURNING esclude le prenotazioni
+        # già prese da un'altra esecuzione concorrente
+        prese = db.session.scalars(
+            sa.update(Prenotazione)
+            .where(
+                Prenotazione.id.in_(list(messaggi)),
+                Prenotazione.promemoria_inviato_at.is_(None)
+            )
+            .values(promemoria_inviato_at=datetime.now(timezone.utc))
+            .returning(Prenotazione.id)
+            .execution_options(synchronize_session=False)
+        ).all()
+        db.session.commit()
+        for id in prese:
+            pool.submit(messaggi[id], timeout=None, al_termine=al_termine)
+            accodati += 1
+    pool.shutdown(timeout=None)
+    durata = perf_counter() - inizio
+
+    if non_inviati:
+        # Gli invii falliti tornano disponibili per una nuova esecuzione
+        db.session.execute(
+            sa.update(Prenotazione)
+            .where(Prenotazione.id.in_(non_inviati))
+            .values(promemoria_inviato_at=None)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+    inviati = accodati - len(non_inviati)
+    click.echo(f'Promemoria inviati: {inviati}, falliti: {len(non_inviati)} '
+               f'in {durata:.2f}s ({inviati / durata if durata else 0:.1f} msg/s)')
+
+
+@app.cli.group()
+def statistiche():
+    """Statistiche giornaliere di prenotazioni e incassi."""
+
+
+@statistiche.command()
+def ricostruisci():
+    """Ricalcola tutti gli aggregati dalle prenotazioni."""
+    inizio = perf_counter()
+    aggregati.ricostruisci()
+    db.session.commit()
+    click.echo(f'Statistiche ricostruite in {perf_counter() - inizio:.2f}s')
+
+
+@statistiche.command()
+def verifica():
+    """Confronta gli aggregati con un riconteggio completo; esce con codice 1 se differiscono."""
+    differenze = aggregati.verifica()
+    for (menu_id, orario, stato), attesi, trovati in differenze:
+        click.echo(f'menu {menu_id} {orario} {stato}: attesi {attesi}, trovati {trovati}')
+    if differenze:
+        raise click.exceptions.Exit(1)
+    click.echo('Statistiche coerenti.')
+
+
+@app.cli.group()
+def pagamenti():
+    """Pagamenti PayPal."""
+
+
+@pagamenti.command('riconcilia')
+@click.option('--attesa', default=15, show_default=True,
+              help='Minuti dopo i quali una transazione in attesa viene verificata.')
+@click.option('--abbandono', default=180, show_default=True,
+              help='Minuti dopo i quali un ordine non pagato viene chiuso come fallito.')
+@click.option('--concorrenza', default=8, show_default=True, help='Richieste parallele a PayPal.')
+@click.option('--blocco', default=100, show_default=True, help='Transazioni per blocco e per commit.')
+def riconcilia_pagamenti(attesa, abbandono, concorrenza, blocco):
+    """Allinea le transazioni in attesa con lo stato degli ordini su PayPal.
+
+    Pensato per essere eseguito periodicamente (es. da cron): è sicuro
+    rilanciarlo e non tocca i pagamenti più recenti di --attesa.
+    """
+    inizio = perf_counter()
+    esiti = riconcilia(timedelta(minutes=attesa), timedelta(minutes=abbandono), concorrenza, blocco)
+    durata = perf_counter() - inizio
+    verificate = esiti['verificate']
+    click.echo(f'Transazioni verificate: {verificate} in {durata:.2f}s '
+               f'({verificate / durata if durata else 0:.1f}/s) - '
+               f'completate {esiti["completate"]}, fallite {esiti["fallite"]}, '
+               f'ancora in attesa {esiti["in_attesa"]}, da rimborsare {esiti["da_rimborsare"]}, '
+               f'errori {esiti["errori"]}')
+
+
+@app.cli.group()
+def prenotazioni():
+    """Manutenzione delle prenotazioni."""
+
+
+@prenotazioni.command()
+@click.option('--ttl', type=int, default=None, help='Minuti di validità di una prenotazione non pagata '
+                                                    '(default: PRENOTAZIONE_TTL).')
+@click.option('--ogni', type=int, default=0, help='Ripete la pulizia ogni N secondi invece di uscire.')
+def scadi(ttl, ogni):
+    """Fa scadere le prenotazioni non pagate e ne libera i posti."""
+    ttl = timedelta(minutes=ttl) if ttl else None
+    while True:
+        inizio = perf_counter()
+        scadute = scadi_prenotazioni(ttl)
+        db.session.commit()
+        click.echo(f'Prenotazioni scadute: {scadute} in {(perf_counter() - inizio) * 1000:.1f} ms')
+        if not ogni:
+            break
+        sleep(ogni)
+
+
+@app.cli.group()
+def utenti():
+    """Account degli studenti."""
+
+
+@utenti.command('importa')
+@click.argument('file', type=click.File('r', encoding='utf-8-sig'))
+@click.option('--blocco', default=1000, show_default=True, help='Righe inserite per blocco e per commit.')
+@click.option('--delimitatore', default=',', show_default=True, help='Separatore di colonna del CSV.')
+@click.option('--inviti', is_flag=True,
+              help='Invia il link per scegliere la password ai nuovi utenti e a quelli ancora senza password.')
+@click.option('--validita', default=72, show_default=True, help='Ore di validità del link di invito.')
+@click.option('--url', default=None, help='Indirizzo pubblico dell\'app per i link (default: SERVER_NAME).')
+@click.option('--credenziali', type=click.File('w', encoding='utf-8'), default=None,
+              help='Genera password casuali e le scrive in questo CSV, invece degli inviti.')
+@click.option('--processi', default=None, type=int, help='Processi per il calcolo degli hash (default: CPU).')
+def importa(file, blocco, delimitatore, inviti, validita, url, credenziali, processi):
+    """Crea gli account da un CSV delle immatricolazioni (matricola, nome, cognome, email).
+
+    Lo username è la matricola. Le righe già presenti per matricola, email o
+    username vengono saltate, quindi il comando si può rilanciare sullo stesso
+    file dopo un'interruzione. Va scelto come gli utenti avranno la password:
+    con --inviti ricevono il link, e lo ricevono di nuovo anche gli account
+    già presenti che non hanno ancora una password; con --credenziali la
+    password è generata e scritta nel CSV indicato.
+    """
+    if inviti == (credenziali is not None):
+        raise click.UsageError('Indicare --inviti oppure --credenziali.')
+    if inviti and not (url or app.config['SERVER_NAME']):
+        raise click.UsageError('Per i link di invito serve --url o SERVER_NAME.')
+    pool = None
+    if inviti:
+        pool = EmailWorkerPool.from_config(app)
+        template_txt = app.jinja_env.get_template('email/invito.txt')
+        template_html = app.jinja_env.get_template('email/invito.html')
+
+    def invia_inviti(matricole):
+        destinatari = db.session.scalars(
+            sa.select(User).where(User.matricola.in_(matricole), User.password_hash.is_(None))
+        ).all()
+        with app.test_request_context(base_url=url):
+            for user in destinatari:
+                contesto = {'user': user, 'token': user.get_reset_password_token(validita * 3600),
+                            'ore': validita}
+                msg = Message('[Speed Mensa] Attivazione account', sender=app.config['ADMINS'][0],
+                              recipients=[user.email])
+                msg.body = template_txt.render(**contesto)
+                msg.html = template_html.render(**contesto)
+                pool.submit(msg, timeout=None)
+        db.session.expunge_all()
+
+    inizio = perf_counter()
+
+    def al_blocco(righe, esiti):
+        if pool is not None:
+            invia_inviti([riga['matricola'] for riga in righe])
+        durata = perf_counter() - inizio
+        click.echo(f'{esiti["lette"]} righe lette, {esiti["inserite"]} utenti creati '
+                   f'({esiti["lette"] / durata if durata else 0:.0f} righe/s)')
+
+    def allo_scarto(numero, motivo):
+        click.echo(f'riga {numero}: {motivo}', err=True)
+
+    try:
+        esiti = importa_utenti(file, blocco, delimitatore, credenziali, processi, al_blocco, allo_scarto,
+                               ai_non_attivati=invia_inviti if pool is not None else None)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    finally:
+        if pool is not None:
+            pool.shutdown(timeout=None)
+    durata = perf_counter() - inizio
+    click.echo(f'Utenti creati: {esiti["inserite"]} su {esiti["lette"]} righe in {durata:.2f}s '
+               f'({esiti["lette"] / durata if durata else 0:.0f} righe/s) - '
+               f'già presenti {esiti["duplicate"]}, non valide {esiti["non_valide"]}'
+               + (f', inviti inviati {pool.inviate}, falliti {pool.fallite}' if pool is not None else ''))
+
+
+@app.cli.group()
+def menu():
+    """Pianificazione dei menu."""
+
+
+def _gestore(username):
+    gestore = db.session.scalar(sa.select(User).where(User.username == username, User.is_gestore))
+    if gestore is None:
+        raise click.BadParameter(f'nessun gestore con username {username}', param_hint='--gestore')
+    return gestore
+
+
+def _salva_menu(operazione):
+    """Esegue la pianificazione in una transazione; gli errori di validazione terminano con codice 1"""
+    try:
+        creati = operazione()
+        db.session.commit()
+    except PianificazioneNonValida as e:
+        db.session.rollback()
+        for errore in e.errori:
+            click.echo(errore, err=True)
+        raise click.exceptions.Exit(1)
+    menu_cache.invalida()
+    return creati
+
+
+@menu.command('pianifica')
+@click.argument('file', type=click.File('r', encoding='utf-8-sig'))
+@click.option('--gestore', required=True, help='Username del gestore a cui intestare i menu.')
+@click.option('--formato', type=click.Choice(['csv', 'json']), default=None,
+              help='Formato del file (default: dall\'estensione).')
+def pianifica_menu(file, gestore, formato):
+    """Crea i menu elencati in un file CSV o JSON, tutti o nessuno."""
+    formato = formato or ('json' if file.name.endswith('.json') else 'csv')
+    gestore_id = _gestore(gestore).id
+    try:
+        elenco = leggi_menu(file, formato)
+    except ValueError as e:
+        raise click.UsageError(f'file non leggibile: {e}')
+    creati = _salva_menu(lambda: pianifica(elenco, gestore_id))
+    click.echo(f'Menu creati: {creati}')
+
+
+@menu.command('clona')
+@click.option('--gestore', required=True, help='Username del gestore di cui copiare i menu.')
+@click.option('--dal', type=click.DateTime(formats=['%Y-%m-%d']), required=True, help='Primo giorno da copiare.')
+@click.option('--al', type=click.DateTime(formats=['%Y-%m-%d']), required=True, help='Ultimo giorno da copiare.')
+@click.option('--inizio', type=click.DateTime(formats=['%Y-%m-%d']), required=True,
+              help='Giorno in cui copiare il menu di --dal.')
+def clona_menu(gestore, dal, al, inizio):
+    """Copia i menu di un periodo in un altro con un solo INSERT ... SELECT."""
+    gestore_id = _gestore(gestore).id
+    creati = _salva_menu(lambda: clona(gestore_id, dal.date(), al.date(), inizio.date()))
+    click.echo(f'Menu copiati: {creati}')
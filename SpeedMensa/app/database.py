@@ -0,0 +1,78 @@
+import sqlite3
+import threading
+import sqlalchemy as sa
+
+# Pragma applicati a ogni nuova connessione SQLite, per profilo
+PROFILI_SQLITE = {
+    # Impostazioni di default di SQLite: journal a rollback, fsync a ogni commit
+    'predefinito': {},
+    'produzione': {
+        # I lettori non attendono lo scrittore e viceversa
+        'journal_mode': 'wal',
+        # Con WAL resta consistente anche dopo un crash; si perdono al più gli ultimi commit
+        'synchronous': 'normal',
+        # Millisecondi di attesa su un lock prima di "database is locked"
+        'busy_timeout': 5000,
+        'mmap_size': 128 * 1024 * 1024,
+        # Valore negativo: KiB di cache per connessione
+        'cache_size': -32000,
+        'temp_store': 'memory',
+    },
+}
+
+_SCRITTURE = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+
+class SerializzatoreScritture:
+    """Una sola transazione di scrittura alla volta per processo.
+
+    Il lock si prende al primo INSERT/UPDATE/DELETE della transazione e si
+    rilascia al commit o al rollback: con più thread (o greenlet) la contesa
+    diventa una coda breve in Python invece di errori "database is locked" e
+    attese attive nel busy handler di SQLite.
+    """
+
+    def __init__(self, timeout=30.0):
+        self.timeout = timeout
+        self._lock = threading.Lock()
+
+    def registra(self, engine):
+        sa.event.listen(engine, 'before_cursor_execute', self._prima_di_eseguire)
+        sa.event.listen(engine, 'commit', self._rilascia)
+        sa.event.listen(engine, 'rollback', self._rilascia)
+        # Connessione restituita al pool senza commit né rollback espliciti
+        sa.event.listen(engine.pool, 'reset', self._reset)
+
+    def _prima_di_eseguire(self, conn, cursor, statement, parameters, context, executemany):
+        if conn.info.get('scrittura') or not statement.lstrip()[:7].upper().startswith(_SCRITTURE):
+            return
+        if not self._lock.acquire(timeout=self.timeout):
+            raise sqlite3.OperationalError('timeout in attesa del lock di scrittura')
+        conn.info['scrittura'] = True
+
+    def _rilascia(self, conn):
+        self._libera(conn.info)
+
+    def _reset(self, dbapi_conn, record, reset_state):
+        self._libera(record.info)
+
+    def _libera(self, info):
+        if info.pop('scrittura', False):
+            self._lock.release()
+
+
+def configura_sqlite(engine, profilo='produzione', serializza_scritture=False):
+    """Applica il profilo a ogni connessione dell'engine; non fa nulla con altri database"""
+    if engine.dialect.name != 'sqlite':
+        return
+    pragma = PROFILI_SQLITE[profilo]
+
+    @sa.event.listens_for(engine, 'connect')
+    def _applica_pragma(dbapi_conn, record):
+        cursor = dbapi_conn.cursor()
+        for nome, valore in pragma.items():
+            cursor.execute(f'PRAGMA {nome}={valore}')
+        cursor.close()
+
+    if serializza_scritture:
+        SerializzatoreScritture(timeout=pragma.get('busy_timeout', 5000) / 1000).registra(engine)
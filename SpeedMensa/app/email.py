@@ -1,19 +1,173 @@
 from flask_mail import Message
 from app import mail, app
 from flask import render_template
-from threading import Thread
+from threading import Thread, Lock
+from time import monotonic, sleep
+import atexit
+import queue
+
+
+class EmailWorkerPool:
+    """Coda limitata di email servita da un numero fisso di worker.
+
+    Ogni worker tiene aperta una connessione SMTP finché la coda ha messaggi
+    e la chiude dopo MAIL_IDLE_TIMEOUT secondi di inattività.
+    """
+
+    def __init__(self, app, workers=2, maxsize=1000, tentativi=3, backoff=1.0, idle_timeout=5.0):
+        self.app = app
+        self.workers = workers
+        self.tentativi = tentativi
+        self.backoff = backoff
+        self.idle_timeout = idle_timeout
+        self.coda = queue.Queue(maxsize=maxsize)
+        self._threads = []
+        self._lock = Lock()
+        self.inviate = 0
+        self.fallite = 0
+        self.ritentativi = 0
+        self.connessioni = 0
+        self._latenza_totale = 0.0
+        self.latenza_max = 0.0
+
+    @classmethod
+    def from_config(cls, app):
+        return cls(
+            app,
+            workers=app.config['MAIL_WORKERS'],
+            maxsize=app.config['MAIL_QUEUE_SIZE'],
+            tentativi=app.config['MAIL_RETRY'],
+            backoff=app.config['MAIL_RETRY_BACKOFF'],
+            idle_timeout=app.config['MAIL_IDLE_TIMEOUT']
+        )
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = Thread(target=self._worker, name=f'email-worker-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, msg, timeout=1.0, al_termine=None):
+        """Accoda un messaggio; se la coda resta piena per `timeout` secondi il messaggio è scartato.
+
+        `al_termine(msg, inviato)` viene chiamata dal worker dopo l'ultimo tentativo.
+        """
+        self.start()
+        try:
+            self.coda.put((monotonic(), msg, al_termine), timeout=timeout)
+        except queue.Full:
+            with self._lock:
+                self.fallite += 1
+            self.app.logger.error(f'Coda email piena, messaggio scartato: {msg.subject}')
+            if al_termine:
+                al_termine(msg, False)
+
+    def shutdown(self, timeout=30.0):
+        """Attende lo svuotamento della coda e ferma i worker, entro `timeout` secondi in tutto.
+
+        Anche i segnali di arresto rispettano la scadenza: con l'SMTP
+        irraggiungibile e la coda piena l'uscita del processo non resta bloccata.
+        """
+        with self._lock:
+            threads, self._threads = self._threads, []
+        fine = monotonic() + timeout if timeout is not None else None
+
+        def residuo():
+            return max(fine - monotonic(), 0) if fine is not None else None
+
+        for _ in threads:
+            try:
+                self.coda.put(None, timeout=residuo())
+            except queue.Full:
+                self.app.logger.error(f'Arresto dei worker email scaduto: {self.coda.qsize()} messaggi in coda')
+                return
+        for thread in threads:
+            thread.join(residuo())
+
+    def metriche(self):
+        with self._lock:
+            return {
+                'in_coda': self.coda.qsize(),
+                'inviate': self.inviate,
+                'fallite': self.fallite,
+                'ritentativi': self.ritentativi,
+                'connessioni': self.connessioni,
+                'latenza_media': self._latenza_totale / self.inviate if self.inviate else 0.0,
+                'latenza_max': self.latenza_max
+            }
+
+    def _worker(self):
+        with self.app.app_context():
+            conn = None
+            while True:
+                try:
+                    elemento = self.coda.get(timeout=self.idle_timeout if conn else None)
+                except queue.Empty:
+                    conn = self._chiudi(conn)
+                    continue
+                if elemento is None:
+                    self._chiudi(conn)
+                    return
+                accodato, msg, al_termine = elemento
+                conn, inviato = self._invia(conn, msg)
+                if al_termine:
+                    try:
+                        al_termine(msg, inviato)
+                    except Exception as e:
+                        # Un errore della callback non deve fermare il worker
+                        self.app.logger.error(f'Errore dopo l\'invio email ({msg.subject}): {e}')
+                if inviato:
+                    with self._lock:
+                        latenza = monotonic() - accodato
+                        self.inviate += 1
+                        self._latenza_totale += latenza
+                        self.latenza_max = max(self.latenza_max, latenza)
+
+    def _invia(self, conn, msg):
+        """Invia il messaggio riusando la connessione, ritentando con backoff esponenziale"""
+        for tentativo in range(self.tentativi):
+            try:
+                if conn is None:
+                    conn = mail.connect()
+                    conn.__enter__()
+                    with self._lock:
+                        self.connessioni += 1
+                conn.send(msg)
+                return conn, True
+            except Exception as e:
+                conn = self._chiudi(conn)
+                if tentativo + 1 == self.tentativi:
+                    with self._lock:
+                        self.fallite += 1
+                    self.app.logger.error(f'Invio email fallito ({msg.subject}): {e}')
+                    return None, False
+                with self._lock:
+                    self.ritentativi += 1
+                sleep(self.backoff * 2 ** tentativo)
+
+    @staticmethod
+    def _chiudi(conn):
+        if conn is not None:
+            try:
+                conn.__exit__(None, None, None)
+            except Exception:
+                pass
+        return None
+
+
+email_pool = EmailWorkerPool.from_config(app)
+atexit.register(email_pool.shutdown)
 
-def send_async_email(app, msg):
-    """Invia email in modo asincrono"""
-    with app.app_context():
-        mail.send(msg)
 
 def send_email(subject, sender, recipients, text_body, html_body):
     """Funzione helper per inviare email"""
     msg = Message(subject, sender=sender, recipients=recipients)
     msg.body = text_body
     msg.html = html_body
-    Thread(target=send_async_email, args=(app, msg)).start()
+    email_pool.submit(msg)
 
 def send_password_reset_email(user):
     """Invia email per reset password"""
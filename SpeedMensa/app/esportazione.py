@@ -0,0 +1,59 @@
+import csv
+import io
+from flask import Response, stream_with_context
+from app import db
+
+INTESTAZIONE_PRENOTAZIONI = ['data', 'orario_ritiro', 'stato', 'matricola', 'cognome', 'nome', 'email',
+                             'prezzo', 'note', 'prenotata_il', 'prenotazione_id', 'menu_id']
+INTESTAZIONE_TRANSAZIONI = ['data_ora', 'transazione_id', 'tipo', 'importo', 'metodo_pagamento', 'stato',
+                            'paypal_order_id', 'matricola', 'cognome', 'nome', 'prenotazione_id', 'data_menu']
+
+# Caratteri con cui Excel interpreta una cella come formula
+_INIZIO_FORMULA = ('=', '+', '-', '@', '\t', '\r')
+
+
+def _cella(valore):
+    """Valore per il CSV: testi che sembrano formule resi innocui, date in formato ISO"""
+    if valore is None:
+        return ''
+    if isinstance(valore, str):
+        return "'" + valore if valore.startswith(_INIZIO_FORMULA) else valore
+    if hasattr(valore, 'isoformat'):
+        return valore.isoformat(sep=' ', timespec='seconds') if hasattr(valore, 'hour') else valore.isoformat()
+    return valore
+
+
+def csv_a_blocchi(intestazione, righe, blocco=1000):
+    """Il CSV di `righe` in pezzi di `blocco` righe codificati in UTF-8.
+
+    Il buffer viene svuotato dopo ogni pezzo: la memoria usata dipende da
+    `blocco`, non dal numero di righe. Il BOM iniziale fa riconoscere a Excel
+    la codifica.
+    """
+    buffer = io.StringIO()
+    scrittore = csv.writer(buffer)
+    buffer.write('\ufeff')
+    scrittore.writerow(intestazione)
+    for i, riga in enumerate(righe, 1):
+        scrittore.writerow([_cella(valore) for valore in riga])
+        if i % blocco == 0:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+def risposta_csv(nome_file, intestazione, query, blocco=1000):
+    """Response che esegue `query` mentre invia il file, leggendo `blocco` righe alla volta.
+
+    Con yield_per SQLAlchemy usa un cursore lato server dove il driver lo
+    supporta (PostgreSQL) e non accumula i risultati; stream_with_context
+    tiene attivo il contesto, e quindi la sessione, fino all'ultima riga.
+    """
+    def genera():
+        righe = db.session.execute(query.execution_options(yield_per=blocco))
+        yield from csv_a_blocchi(intestazione, righe, blocco)
+
+    return Response(stream_with_context(genera()), mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename="{nome_file}"',
+                             'X-Accel-Buffering': 'no'})
@@ -0,0 +1,93 @@
+import json
+import queue
+import threading
+from collections import defaultdict
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+from app.models import Prenotazione
+
+# Un messaggio None nella coda di un iscritto significa "eventi persi, rileggi lo stato"
+RISINCRONIZZA = None
+
+
+class Broker:
+    """Pub/sub in memoria: ogni iscritto ha una coda limitata per canale.
+
+    Chi pubblica non attende mai: se un iscritto è troppo lento la sua coda
+    viene svuotata e riceve RISINCRONIZZA.
+    """
+
+    def __init__(self, maxsize=100):
+        self.maxsize = maxsize
+        self._iscritti = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def iscrivi(self, canale):
+        coda = queue.Queue(maxsize=self.maxsize)
+        with self._lock:
+            self._iscritti[canale].add(coda)
+        return coda
+
+    def disiscrivi(self, canale, coda):
+        with self._lock:
+            self._iscritti[canale].discard(coda)
+            if not self._iscritti[canale]:
+                del self._iscritti[canale]
+
+    def pubblica(self, canale, evento):
+        with self._lock:
+            code = list(self._iscritti.get(canale, ()))
+        for coda in code:
+            try:
+                coda.put_nowait(evento)
+            except queue.Full:
+                with coda.mutex:
+                    coda.queue.clear()
+                coda.put_nowait(RISINCRONIZZA)
+
+    def iscritti(self, canale):
+        with self._lock:
+            return len(self._iscritti.get(canale, ()))
+
+
+broker = Broker()
+
+
+def transizioni_flush(session):
+    """Cambi di stato delle prenotazioni nel flush corrente: (menu_id, orario, da, a)"""
+    transizioni = []
+    for obj in session.new:
+        if isinstance(obj, Prenotazione):
+            transizioni.append((obj.menu_id, obj.orario_ritiro, None, obj.stato))
+    for obj in session.dirty:
+        if isinstance(obj, Prenotazione):
+            storia = sa.inspect(obj).attrs.stato.history
+            if storia.has_changes() and storia.deleted:
+                transizioni.append((obj.menu_id, obj.orario_ritiro, storia.deleted[0], obj.stato))
+    for obj in session.deleted:
+        if isinstance(obj, Prenotazione):
+            transizioni.append((obj.menu_id, obj.orario_ritiro, obj.stato, None))
+    return transizioni
+
+def accoda_transizioni(session, transizioni):
+    """Transizioni da pubblicare al commit della sessione, con versione del menu e prezzo.
+
+    Le accoda app.statistiche, che assegna la versione aggiornando gli aggregati.
+    """
+    session.info.setdefault('transizioni_prenotazioni', []).extend(transizioni)
+
+def pubblica_transizioni(transizioni):
+    for menu_id, orario, da, a, versione, prezzo in transizioni:
+        broker.pubblica(menu_id, {'orario': orario, 'da': da, 'a': a, 'versione': versione, 'prezzo': prezzo})
+
+@sa.event.listens_for(so.Session, 'after_commit')
+def _pubblica_dopo_commit(session):
+    pubblica_transizioni(session.info.pop('transizioni_prenotazioni', []))
+
+@sa.event.listens_for(so.Session, 'after_soft_rollback')
+def _scarta_dopo_rollback(session, previous_transaction):
+    session.info.pop('transizioni_prenotazioni', None)
+
+
+def evento_sse(tipo, dati):
+    return f'event: {tipo}\ndata: {json.dumps(dati)}\n\n'
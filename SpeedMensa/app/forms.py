@@ -1,18 +1,71 @@
 from flask_wtf import FlaskForm
-from wtforms import StringField, PasswordField, BooleanField, SubmitField, TextAreaField, DateField, FloatField, SelectField
+from flask_wtf.file import FileField, FileAllowed
+from wtforms import Form, StringField, PasswordField, BooleanField, SubmitField, TextAreaField, DateField, FloatField, SelectField, FieldList, FormField
 from wtforms.validators import DataRequired, ValidationError, Email, EqualTo, Length, NumberRange, Optional
 from app.models import User
 from app import db
 import sqlalchemy as sa
 from datetime import date
 
+ORARI_PRENOTABILI = ['12:00', '12:30', '13:00', '13:30']
+
+# Campi di User con vincolo unique verificati nei form di registrazione e profilo
+CAMPI_UNIVOCI = ('username', 'email', 'matricola')
+
+
+class UnicitaMixin:
+    """Verifica di unicità di username, email e matricola con una sola query.
+
+    I validatori dei tre campi chiamano controlla_unicita: la prima chiamata
+    cerca con un'unica SELECT gli utenti che hanno uno qualsiasi dei valori
+    inseriti, le successive riusano il risultato. Le sottoclassi definiscono
+    `messaggi_occupati` con il messaggio di errore per campo.
+    """
+
+    messaggi_occupati = {}
+
+    def valori_da_controllare(self):
+        return {campo: self[campo].data for campo in CAMPI_UNIVOCI if self[campo].data}
+
+    def campi_occupati(self, ricarica=False):
+        """Nomi dei campi il cui valore appartiene già a un utente"""
+        occupati = getattr(self, '_campi_occupati', None)
+        if occupati is None or ricarica:
+            valori = self.valori_da_controllare()
+            occupati = set()
+            if valori:
+                colonne = [getattr(User, campo) for campo in valori]
+                righe = db.session.execute(sa.select(*colonne).where(
+                    sa.or_(*(colonna == valori[colonna.key] for colonna in colonne))))
+                for riga in righe:
+                    occupati.update(campo for campo, valore in zip(valori, riga) if valore == valori[campo])
+            self._campi_occupati = occupati
+        return occupati
+
+    def controlla_unicita(self, field):
+        if field.name in self.campi_occupati():
+            raise ValidationError(self.messaggi_occupati[field.name])
+
+    def segnala_duplicati(self):
+        """Dopo un IntegrityError: rilegge i valori occupati e li riporta come errori dei campi.
+
+        Serve quando un'altra richiesta ha inserito gli stessi valori tra la
+        validazione e il commit. Restituisce False se il conflitto non riguarda
+        questi campi.
+        """
+        occupati = self.campi_occupati(ricarica=True)
+        for campo in occupati:
+            self[campo].errors = list(self[campo].errors) + [self.messaggi_occupati[campo]]
+        return bool(occupati)
+
+
 class LoginForm(FlaskForm):
     username = StringField('Username', validators=[DataRequired()])
     password = PasswordField('Password', validators=[DataRequired()])
     remember_me = BooleanField('Ricordami')
     submit = SubmitField('Accedi')
 
-class RegistrationForm(FlaskForm):
+class RegistrationForm(UnicitaMixin, FlaskForm):
     username = StringField('Username', validators=[DataRequired()])
     email = StringField('Email', validators=[DataRequired(), Email()])
     nome = StringField('Nome', validators=[DataRequired(), Length(max=100)])
@@ -22,20 +75,20 @@ class RegistrationForm(FlaskForm):
     password2 = PasswordField('Ripeti Password', validators=[DataRequired(), EqualTo('password')])
     submit = SubmitField('Registrati')
 
+    messaggi_occupati = {
+        'username': 'Username utilizzato da altro utente. Scegline un altro.',
+        'email': 'Email associata ad un utente',
+        'matricola': 'Matricola associata ad un utente.',
+    }
+
     def validate_username(self, username):
-        user = db.session.scalar(sa.select(User).where(User.username == username.data))
-        if user is not None:
-            raise ValidationError('Username utilizzato da altro utente. Scegline un altro.')
+        self.controlla_unicita(username)
 
     def validate_email(self, email):
-        user = db.session.scalar(sa.select(User).where(User.email == email.data))
-        if user is not None:
-            raise ValidationError('Email associata ad un utente')
+        self.controlla_unicita(email)
 
     def validate_matricola(self, matricola):
-        user = db.session.scalar(sa.select(User).where(User.matricola == matricola.data))
-        if user is not None:
-            raise ValidationError('Matricola associata ad un utente.')
+        self.controlla_unicita(matricola)
 
 class MenuForm(FlaskForm):
     data = DateField('Data', validators=[DataRequired()], format='%Y-%m-%d')
@@ -52,6 +105,29 @@ class MenuForm(FlaskForm):
         if data.data < date.today():
             raise ValidationError('Non puoi creare menu per date passate.')
 
+class RigaMenuForm(Form):
+    """Un giorno della griglia di pianificazione: le righe senza primo vengono ignorate"""
+    # Non 'data': FormField.data restituisce i valori della riga come dizionario
+    giorno = DateField('Data', validators=[Optional()], format='%Y-%m-%d')
+    primo = StringField('Primo', validators=[Optional(), Length(max=200)])
+    secondo = StringField('Secondo', validators=[Optional(), Length(max=200)])
+    contorno = StringField('Contorno', validators=[Optional(), Length(max=200)])
+    frutta = StringField('Frutta', validators=[Optional(), Length(max=200)])
+    dolce = StringField('Dolce', validators=[Optional(), Length(max=200)])
+    prezzo = FloatField('Prezzo (€)', default=5.0, validators=[Optional(), NumberRange(min=0.0, max=50.0)])
+    disponibile = BooleanField('Disponibile', default=True)
+
+class PianificaMenuForm(FlaskForm):
+    righe = FieldList(FormField(RigaMenuForm), min_entries=7, max_entries=31)
+    file = FileField('Oppure carica un CSV', validators=[FileAllowed(['csv'], 'Solo file CSV.')])
+    submit = SubmitField('Crea Menu')
+
+class ClonaMenuForm(FlaskForm):
+    dal = DateField('Dal', validators=[DataRequired()], format='%Y-%m-%d')
+    al = DateField('Al', validators=[DataRequired()], format='%Y-%m-%d')
+    inizio = DateField('Copia a partire dal', validators=[DataRequired()], format='%Y-%m-%d')
+    submit = SubmitField('Clona Periodo')
+
 class PrenotazioneForm(FlaskForm):
     orario_ritiro = SelectField('Orario di Ritiro', validators=[DataRequired()])
     note = TextAreaField('Note (allergie, intolleranze, ecc.)', validators=[Optional(), Length(max=500)], render_kw={"rows": 4, "cols": 50, "style": "resize:none;"})
@@ -59,14 +135,9 @@ class PrenotazioneForm(FlaskForm):
     
     def __init__(self, *args, **kwargs):
         super(PrenotazioneForm, self).__init__(*args, **kwargs)
-        self.orario_ritiro.choices = [
-            ("12:00","12:00"),
-            ("12:30","12:30"),
-            ("13:00","13:00"),
-            ("13:30","13:30"),
-        ]
-
-class EditProfileForm(FlaskForm):
+        self.orario_ritiro.choices = [(orario, orario) for orario in ORARI_PRENOTABILI]
+
+class EditProfileForm(UnicitaMixin, FlaskForm):
     username = StringField('Username', validators=[DataRequired()])
     email = StringField('Email', validators=[DataRequired(), Email()])
     nome = StringField('Nome', validators=[DataRequired(), Length(max=100)])
@@ -80,23 +151,26 @@ class EditProfileForm(FlaskForm):
         self.original_email = original_email
         self.original_matricola = original_matricola
 
+    messaggi_occupati = {
+        'username': 'Username in utilizzo da un utente.',
+        'email': 'Email non disponibile.',
+        'matricola': 'Impossibile assocoiare Matricola.',
+    }
+
+    def valori_da_controllare(self):
+        originali = {'username': self.original_username, 'email': self.original_email,
+                     'matricola': self.original_matricola}
+        return {campo: valore for campo, valore in super().valori_da_controllare().items()
+                if valore != originali[campo]}
+
     def validate_username(self, username):
-        if username.data != self.original_username:
-            user = db.session.scalar(sa.select(User).where(User.username == username.data))
-            if user is not None:
-                raise ValidationError('Username in utilizzo da un utente.')
-    
+        self.controlla_unicita(username)
+
     def validate_email(self, email):
-        if email.data != self.original_email:
-            user = db.session.scalar(sa.select(User).where(User.email == email.data))
-            if user is not None:
-                raise ValidationError('Email non disponibile.')
-    
+        self.controlla_unicita(email)
+
     def validate_matricola(self, matricola):
-        if matricola.data != self.original_matricola:
-            user = db.session.scalar(sa.select(User).where(User.matricola == matricola.data))
-            if user is not None:
-                raise ValidationError('Impossibile assocoiare Matricola.')
+        self.controlla_unicita(matricola)
 
 
 class CancellaPrenotazioneForm(FlaskForm):
@@ -0,0 +1,134 @@
+import csv
+import os
+import secrets
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+import sqlalchemy as sa
+from werkzeug.security import generate_password_hash
+from app import db
+from app.models import User
+from app.password import metodo_hash
+
+# Colonne attese nel CSV delle immatricolazioni
+COLONNE = ('matricola', 'nome', 'cognome', 'email')
+# Lunghezze massime delle colonne di User; lo username di un utente importato è la matricola
+_LUNGHEZZE = {'matricola': 20, 'nome': 100, 'cognome': 100, 'email': 120}
+
+
+def leggi_csv(file, delimitatore=','):
+    """Righe del CSV una alla volta, come (numero di riga, dati normalizzati, motivo di scarto)"""
+    lettore = csv.DictReader(file, delimiter=delimitatore, skipinitialspace=True)
+    intestazione = {(nome or '').strip().lower(): nome for nome in lettore.fieldnames or ()}
+    mancanti = [colonna for colonna in COLONNE if colonna not in intestazione]
+    if mancanti:
+        raise ValueError(f'Colonne mancanti nel CSV: {", ".join(mancanti)}')
+    for riga in lettore:
+        dati = {colonna: (riga[intestazione[colonna]] or '').strip() for colonna in COLONNE}
+        dati['email'] = dati['email'].lower()
+        motivo = None
+        vuote = [colonna for colonna in COLONNE if not dati[colonna]]
+        lunghe = [colonna for colonna in COLONNE if len(dati[colonna]) > _LUNGHEZZE[colonna]]
+        if vuote:
+            motivo = f'campi vuoti: {", ".join(vuote)}'
+        elif lunghe:
+            motivo = f'campi troppo lunghi: {", ".join(lunghe)}'
+        elif '@' not in dati['email']:
+            motivo = 'email non valida'
+        yield lettore.line_num, dati, motivo
+
+
+def importa_utenti(file, blocco=1000, delimitatore=',', credenziali=None, processi=None,
+                   al_blocco=None, allo_scarto=None, ai_non_attivati=None):
+    """Crea gli utenti elencati nel CSV `file` (matricola, nome, cognome, email).
+
+    Il file è letto in streaming e inserito a blocchi di `blocco` righe, ognuno
+    con un executemany e un commit. Matricole, email e username già presenti
+    (nel database o in righe precedenti del file) sono caricati una volta in
+    insiemi e le righe che li ripetono vengono saltate.
+
+    Senza `credenziali` gli utenti sono creati senza password e la impostano
+    dal link di invito. Con `credenziali` (file aperto in scrittura) si genera
+    una password casuale per utente: gli hash sono calcolati in un pool di
+    `processi` processi e le password in chiaro scritte nel CSV `credenziali`.
+
+    `al_blocco(righe, esiti)` viene chiamata dopo ogni commit con le righe
+    inserite; `allo_scarto(numero_riga, motivo)` per ogni riga saltata.
+    `ai_non_attivati(matricole)` riceve, a blocchi, le matricole del file che
+    nel database avevano già un account senza password: utenti creati da
+    un'importazione interrotta prima dell'invio degli inviti, o che non
+    hanno ancora scelto la password.
+    """
+    esistenti = {
+        campo: set(db.session.scalars(sa.select(colonna).where(colonna.is_not(None))))
+        for campo, colonna in (('username', User.username), ('email', User.email), ('matricola', User.matricola))
+    }
+    esistenti['email'] = {email.lower() for email in esistenti['email']}
+    non_attivati = set()
+    if ai_non_attivati is not None:
+        non_attivati = set(db.session.scalars(
+            sa.select(User.matricola).where(User.matricola.is_not(None), User.password_hash.is_(None))
+        ))
+    da_avvisare = []
+    esiti = {'lette': 0, 'inserite': 0, 'duplicate': 0, 'non_valide': 0}
+    pool = None
+    scrittore = None
+    if credenziali is not None:
+        processi = processi or os.cpu_count()
+        pool = ProcessPoolExecutor(max_workers=processi)
+        scrittore = csv.writer(credenziali)
+        scrittore.writerow(['matricola', 'email', 'password'])
+
+    def scarta(numero, motivo, chiave):
+        esiti[chiave] += 1
+        if allo_scarto:
+            allo_scarto(numero, motivo)
+
+    def inserisci(righe):
+        if pool is not None:
+            password = [secrets.token_urlsafe(9) for _ in righe]
+            hash_ = pool.map(generate_password_hash, password, repeat(metodo_hash()),
+                             chunksize=max(len(righe) // (4 * processi), 1))
+            for riga, password_hash in zip(righe, hash_):
+                riga['password_hash'] = password_hash
+        db.session.execute(sa.insert(User), righe)
+        db.session.commit()
+        if scrittore is not None:
+            scrittore.writerows([riga['matricola'], riga['email'], chiaro] for riga, chiaro in zip(righe, password))
+        esiti['inserite'] += len(righe)
+        if al_blocco:
+            al_blocco(righe, esiti)
+
+    try:
+        righe = []
+        for numero, dati, motivo in leggi_csv(file, delimitatore):
+            esiti['lette'] += 1
+            if motivo:
+                scarta(numero, motivo, 'non_valide')
+                continue
+            ripetuti = [campo for campo, valore in (('matricola', dati['matricola']), ('email', dati['email']),
+                                                    ('username', dati['matricola']))
+                        if valore in esistenti[campo]]
+            if ripetuti:
+                scarta(numero, f'già presente: {", ".join(ripetuti)}', 'duplicate')
+                if dati['matricola'] in non_attivati:
+                    non_attivati.discard(dati['matricola'])
+                    da_avvisare.append(dati['matricola'])
+                    if len(da_avvisare) >= blocco:
+                        ai_non_attivati(da_avvisare)
+                        da_avvisare = []
+                continue
+            esistenti['matricola'].add(dati['matricola'])
+            esistenti['email'].add(dati['email'])
+            esistenti['username'].add(dati['matricola'])
+            righe.append(dict(dati, username=dati['matricola']))
+            if len(righe) >= blocco:
+                inserisci(righe)
+                righe = []
+        if righe:
+            inserisci(righe)
+        if da_avvisare:
+            ai_non_attivati(da_avvisare)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return esiti
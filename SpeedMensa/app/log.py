@@ -0,0 +1,238 @@
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import smtplib
+import threading
+from datetime import datetime, timezone
+from email.message import EmailMessage
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from time import monotonic
+from flask import g, request, has_request_context
+
+
+class FormatterJSON(logging.Formatter):
+    """Un oggetto JSON per riga, con i dati della richiesta se il record ne ha"""
+
+    def format(self, record):
+        dati = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'livello': record.levelname,
+            'logger': record.name,
+            'messaggio': record.getMessage(),
+            'modulo': record.module,
+            'riga': record.lineno,
+            'processo': record.process,
+            'thread': record.threadName,
+        }
+        richiesta = getattr(record, 'richiesta', None)
+        if richiesta:
+            dati['richiesta'] = richiesta
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            dati['eccezione'] = record.exc_text
+        return json.dumps(dati, ensure_ascii=False, default=str)
+
+
+class CodaLog(QueueHandler):
+    """Mette i record in una coda limitata: il thread della richiesta non fa I/O.
+
+    Il record viene preparato qui, finché la richiesta è ancora attiva: messaggio
+    e traceback diventano stringhe e si aggiungono metodo, percorso e utente.
+    A coda piena i record vengono scartati e contati, invece di bloccare.
+    """
+
+    def __init__(self, coda):
+        super().__init__(coda)
+        self.scartati = 0
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        if has_request_context():
+            utente = g.get('_login_user')
+            record.richiesta = {
+                'metodo': request.method,
+                'percorso': request.path,
+                'ip': request.remote_addr,
+                'utente': getattr(utente, 'id', None),
+            }
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.scartati += 1
+
+
+class FileBufferizzato(RotatingFileHandler):
+    """File ruotato scritto a blocchi: flush al più ogni `intervallo` secondi, subito per gli errori"""
+
+    def __init__(self, filename, max_bytes, backup_count, intervallo=1.0):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+        self.intervallo = intervallo
+        self._ultimo_flush = monotonic()
+        self._timer = None
+
+    def emit(self, record):
+        super().emit(record)
+        if record.levelno >= logging.ERROR:
+            self._scarica()
+
+    def flush(self):
+        # Chiamato da StreamHandler dopo ogni record: si rimanda, ma non oltre `intervallo`
+        if monotonic() - self._ultimo_flush >= self.intervallo:
+            self._scarica()
+        elif self._timer is None:
+            self._timer = threading.Timer(self.intervallo, self._scarica_differito)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _scarica_differito(self):
+        with self.lock:
+            self._timer = None
+            self._scarica()
+
+    def _scarica(self):
+        if self.stream and not self.stream.closed:
+            self.stream.flush()
+        self._ultimo_flush = monotonic()
+
+
+class EmailDigest(logging.Handler):
+    """Errori via email, al più un messaggio ogni `intervallo` secondi.
+
+    Il primo errore dopo un periodo tranquillo parte subito; quelli successivi
+    si accumulano e vengono inviati insieme allo scadere dell'intervallo,
+    raggruppati per punto di origine (file e riga) con il numero di occorrenze.
+    """
+
+    def __init__(self, mailhost, fromaddr, toaddrs, subject, credentials=None, secure=None,
+                 intervallo=300, timeout=10.0):
+        super().__init__(logging.ERROR)
+        self.mailhost, self.mailport = mailhost
+        self.fromaddr = fromaddr
+        self.toaddrs = toaddrs
+        self.subject = subject
+        self.credentials = credentials
+        self.secure = secure
+        self.intervallo = intervallo
+        self.timeout = timeout
+        self._errori = {}
+        self._ultimo_invio = None
+        self._timer = None
+
+    def emit(self, record):
+        chiave = (record.pathname, record.lineno)
+        voce = self._errori.get(chiave)
+        if voce is None:
+            self._errori[chiave] = [1, record, record]
+        else:
+            voce[0] += 1
+            voce[2] = record
+        attesa = 0 if self._ultimo_invio is None else self._ultimo_invio + self.intervallo - monotonic()
+        if attesa <= 0:
+            self._invia_digest()
+        elif self._timer is None:
+            self._timer = threading.Timer(attesa, self._invia_differito)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _invia_differito(self):
+        with self.lock:
+            self._timer = None
+            if self._errori:
+                self._invia_digest()
+
+    def _invia_digest(self):
+        errori, self._errori = self._errori, {}
+        self._ultimo_invio = monotonic()
+        totale = sum(conteggio for conteggio, _, _ in errori.values())
+        oggetto = self.subject if totale == 1 else f'{self.subject}: {totale} errori ({len(errori)} distinti)'
+        sezioni = []
+        for conteggio, primo, ultimo in errori.values():
+            sezioni.append(
+                f'{conteggio} × {ultimo.levelname} in {ultimo.pathname}:{ultimo.lineno}\n'
+                f'primo {datetime.fromtimestamp(primo.created):%H:%M:%S}, '
+                f'ultimo {datetime.fromtimestamp(ultimo.created):%H:%M:%S}\n\n{self.format(ultimo)}'
+            )
+        try:
+            self._smtp(oggetto, ('\n\n' + '-' * 70 + '\n\n').join(sezioni))
+        except Exception:
+            self.handleError(ultimo)
+
+    def _smtp(self, oggetto, corpo):
+        msg = EmailMessage()
+        msg['From'] = self.fromaddr
+        msg['To'] = ','.join(self.toaddrs)
+        msg['Subject'] = oggetto
+        msg.set_content(corpo)
+        with smtplib.SMTP(self.mailhost, self.mailport or smtplib.SMTP_PORT, timeout=self.timeout) as smtp:
+            if self.credentials:
+                if self.secure is not None:
+                    smtp.ehlo()
+                    smtp.starttls(*self.secure)
+                    smtp.ehlo()
+                smtp.login(*self.credentials)
+            smtp.send_message(msg)
+
+    def close(self):
+        with self.lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if self._errori:
+                self._invia_digest()
+        super().close()
+
+
+class ListenerLog(QueueListener):
+    def enqueue_sentinel(self):
+        # Con la coda piena si attende che il thread di scrittura faccia spazio
+        self.queue.put(self._sentinel)
+
+
+def configura_log(app):
+    """Collega il logger dell'app a una coda servita da un thread: file JSON ed email di errore"""
+    handlers = []
+    if app.config['MAIL_SERVER']:
+        auth = None
+        secure = None
+        if app.config['MAIL_USERNAME'] or app.config['MAIL_PASSWORD']:
+            auth = (app.config['MAIL_USERNAME'], app.config['MAIL_PASSWORD'])
+        if app.config['MAIL_USE_TLS']:
+            secure = ()
+        handlers.append(EmailDigest(
+            mailhost=(app.config['MAIL_SERVER'], app.config['MAIL_PORT']),
+            fromaddr='dorus0100@gmail.com',
+            toaddrs=app.config['ADMINS'],
+            subject='Errore Gestione Mensa',
+            credentials=auth,
+            secure=secure,
+            intervallo=app.config['LOG_EMAIL_INTERVALLO']
+        ))
+
+    if not os.path.exists('logs'):
+        os.mkdir('logs')
+    file_handler = FileBufferizzato('logs/mensa.log', app.config['LOG_FILE_MAX_BYTES'],
+                                    app.config['LOG_FILE_BACKUP'])
+    file_handler.setFormatter(FormatterJSON())
+    file_handler.setLevel(logging.INFO)
+    handlers.append(file_handler)
+
+    coda = CodaLog(queue.Queue(app.config['LOG_CODA']))
+    listener = ListenerLog(coda.queue, *handlers, respect_handler_level=True)
+    listener.start()
+    # Alla chiusura si svuota la coda, poi logging.shutdown chiude i file handler
+    atexit.register(listener.stop)
+    app.logger.addHandler(coda)
+    app.logger.setLevel(logging.INFO)
+    return listener
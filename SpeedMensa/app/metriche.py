@@ -0,0 +1,184 @@
+import cProfile
+import os
+import random
+import threading
+from collections import defaultdict
+from datetime import datetime
+from time import perf_counter
+import sqlalchemy as sa
+from flask import g, request, has_request_context, before_render_template, template_rendered
+from app import app, db
+
+# Limiti superiori dei bucket: secondi per le durate, numero di statement per le query
+BUCKET_DURATA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BUCKET_QUERY = (1, 2, 5, 10, 20, 50, 100)
+
+
+class Istogramma:
+    """Istogramma cumulativo per combinazione di etichette, come quelli Prometheus"""
+
+    def __init__(self, nome, descrizione, bucket=BUCKET_DURATA):
+        self.nome = nome
+        self.descrizione = descrizione
+        self.bucket = bucket
+        self._serie = {}
+
+    def osserva(self, etichette, valore):
+        serie = self._serie.get(etichette)
+        if serie is None:
+            serie = self._serie.setdefault(etichette, [[0] * len(self.bucket), 0.0, 0])
+        conteggi = serie[0]
+        for i, limite in enumerate(self.bucket):
+            if valore <= limite:
+                conteggi[i] += 1
+        serie[1] += valore
+        serie[2] += 1
+
+    def azzera(self):
+        self._serie.clear()
+
+    def esporta(self):
+        righe = [f'# HELP {self.nome} {self.descrizione}', f'# TYPE {self.nome} histogram']
+        for etichette, (conteggi, somma, totale) in sorted(self._serie.items()):
+            for limite, conteggio in zip(self.bucket, conteggi):
+                righe.append(f'{self.nome}_bucket{_etichette(etichette, le=limite)} {conteggio}')
+            righe.append(f'{self.nome}_bucket{_etichette(etichette, le="+Inf")} {totale}')
+            righe.append(f'{self.nome}_sum{_etichette(etichette)} {somma:.6f}')
+            righe.append(f'{self.nome}_count{_etichette(etichette)} {totale}')
+        return righe
+
+
+def _etichette(coppie, **extra):
+    coppie = list(coppie) + list(extra.items())
+    return '{' + ','.join(f'{nome}="{valore}"' for nome, valore in coppie) + '}'
+
+
+class RegistroMetriche:
+    """Metriche aggregate del processo, esposte in formato testo Prometheus.
+
+    Con più worker ogni processo ha il proprio registro: Prometheus li somma
+    se ciascuno viene interrogato separatamente.
+    """
+
+    def __init__(self):
+        self.richieste = defaultdict(int)
+        self.durata = Istogramma('speedmensa_request_duration_seconds', 'Durata delle richieste per endpoint')
+        self.query = Istogramma('speedmensa_sql_statements', 'Statement SQL per richiesta', BUCKET_QUERY)
+        self.sql = Istogramma('speedmensa_sql_duration_seconds', 'Tempo SQL per richiesta')
+        self.template = Istogramma('speedmensa_template_duration_seconds', 'Tempo di rendering dei template per richiesta')
+        self.http = Istogramma('speedmensa_http_duration_seconds', 'Tempo delle chiamate HTTP esterne per richiesta')
+        self.istogrammi = (self.durata, self.query, self.sql, self.template, self.http)
+        self._lock = threading.Lock()
+
+    def registra(self, endpoint, metodo, stato, durata, misure):
+        etichette = (('endpoint', endpoint),)
+        with self._lock:
+            self.richieste[(('endpoint', endpoint), ('method', metodo), ('status', stato))] += 1
+            self.durata.osserva(etichette, durata)
+            self.query.osserva(etichette, misure['sql'])
+            self.sql.osserva(etichette, misure['sql_tempo'])
+            self.template.osserva(etichette, misure['template'])
+            self.http.osserva(etichette, misure['http'])
+
+    def esporta(self):
+        with self._lock:
+            righe = ['# HELP speedmensa_requests_total Richieste servite',
+                     '# TYPE speedmensa_requests_total counter']
+            righe += [f'speedmensa_requests_total{_etichette(etichette)} {conteggio}'
+                      for etichette, conteggio in sorted(self.richieste.items())]
+            for istogramma in self.istogrammi:
+                righe += istogramma.esporta()
+        return '\n'.join(righe) + '\n'
+
+    def azzera(self):
+        with self._lock:
+            self.richieste.clear()
+            for istogramma in self.istogrammi:
+                istogramma.azzera()
+
+
+registro = RegistroMetriche()
+
+
+def _misure():
+    """Contatori della richiesta corrente, None fuori da una richiesta o con le metriche spente"""
+    return g.get('metriche') if has_request_context() else None
+
+
+@app.before_request
+def _inizio_richiesta():
+    if not app.config['METRICHE_ABILITATE']:
+        return
+    g.metriche = {'inizio': perf_counter(), 'sql': 0, 'sql_tempo': 0.0, 'template': 0.0, 'http': 0.0}
+    campione = app.config['METRICHE_PROFILO_CAMPIONE']
+    if campione and random.random() < campione:
+        profilo = cProfile.Profile()
+        try:
+            profilo.enable()
+        except ValueError:
+            # Un altro profiler è già attivo in questo processo
+            return
+        g.profilo = profilo
+
+
+@app.after_request
+def _fine_richiesta(response):
+    misure = g.pop('metriche', None)
+    if misure is None:
+        return response
+    durata = perf_counter() - misure['inizio']
+    endpoint = request.endpoint or 'sconosciuto'
+    registro.registra(endpoint, request.method, response.status_code, durata, misure)
+    profilo = g.pop('profilo', None)
+    if profilo is not None:
+        profilo.disable()
+        if durata * 1000 >= app.config['METRICHE_PROFILO_SOGLIA']:
+            _salva_profilo(profilo, endpoint, durata)
+    return response
+
+
+def _salva_profilo(profilo, endpoint, durata):
+    """Scrive il profilo di una richiesta lenta, leggibile con pstats o snakeviz"""
+    cartella = app.config['METRICHE_PROFILO_DIR']
+    os.makedirs(cartella, exist_ok=True)
+    nome = f"{endpoint}-{datetime.now():%Y%m%d-%H%M%S-%f}-{durata * 1000:.0f}ms.prof"
+    profilo.dump_stats(os.path.join(cartella, nome))
+    app.logger.info(f'Richiesta lenta {request.method} {request.path} ({durata * 1000:.0f} ms): profilo {nome}')
+
+
+def _inizio_query(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and _misure() is not None:
+        context._metriche_inizio = perf_counter()
+
+
+def _fine_query(conn, cursor, statement, parameters, context, executemany):
+    inizio = getattr(context, '_metriche_inizio', None)
+    misure = _misure()
+    if inizio is not None and misure is not None:
+        misure['sql'] += 1
+        misure['sql_tempo'] += perf_counter() - inizio
+
+
+with app.app_context():
+    sa.event.listen(db.engine, 'before_cursor_execute', _inizio_query)
+    sa.event.listen(db.engine, 'after_cursor_execute', _fine_query)
+
+
+@before_render_template.connect_via(app)
+def _inizio_template(sender, template, context, **extra):
+    if _misure() is not None:
+        g.metriche_template = perf_counter()
+
+
+@template_rendered.connect_via(app)
+def _fine_template(sender, template, context, **extra):
+    misure = _misure()
+    if misure is not None and 'metriche_template' in g:
+        misure['template'] += perf_counter() - g.pop('metriche_template')
+
+
+def registra_http(response, *args, **kwargs):
+    """Hook `response` di requests: somma il tempo delle chiamate esterne alla richiesta corrente"""
+    misure = _misure()
+    if misure is not None:
+        misure['http'] += response.elapsed.total_seconds()
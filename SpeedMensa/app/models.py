@@ -1,9 +1,9 @@
 from typing import Optional
 import sqlalchemy as sa
 import sqlalchemy.orm as so
-from app import db, login, app
+from app import db, app
 from datetime import datetime, timezone, date
-from werkzeug.security import generate_password_hash, check_password_hash
+from app.password import genera_hash, verifica, da_aggiornare
 from flask_login import UserMixin
 from hashlib import md5
 from time import time
@@ -30,10 +30,14 @@ class User(UserMixin, db.Model):
         return f'<User {self.username}>'
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = genera_hash(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return verifica(self.password_hash, password)
+
+    def password_da_aggiornare(self):
+        """L'hash salvato usa parametri diversi dal profilo configurato"""
+        return da_aggiornare(self.password_hash)
     
     def get_reset_password_token(self, expires_in=600):
         """Genera token per reset password (valido 10 minuti)"""
@@ -54,6 +58,13 @@ class User(UserMixin, db.Model):
 
 
 class MenuGiornaliero(db.Model):
+    __table_args__ = (
+        # Homepage: menu disponibili dalla data odierna, in ordine di data
+        sa.Index('ix_menu_giornaliero_disponibile_data', 'disponibile', 'data'),
+        # Dashboard gestore: menu di un gestore, più recenti prima
+        sa.Index('ix_menu_giornaliero_gestore_data', 'gestore_id', 'data'),
+    )
+
     id: so.Mapped[int] = so.mapped_column(primary_key=True)
     data: so.Mapped[date] = so.mapped_column(sa.Date, index=True)
     primo: so.Mapped[str] = so.mapped_column(sa.String(200))
@@ -63,8 +74,10 @@ class MenuGiornaliero(db.Model):
     dolce: so.Mapped[Optional[str]] = so.mapped_column(sa.String(200))
     prezzo: so.Mapped[float] = so.mapped_column(default=5.0)
     disponibile: so.Mapped[bool] = so.mapped_column(default=True)
-    gestore_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(User.id), index=True)
+    gestore_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(User.id))
     created_at: so.Mapped[datetime] = so.mapped_column(default=lambda: datetime.now(timezone.utc))
+    # Incrementata con gli aggregati a ogni cambio di stato delle prenotazioni del menu
+    versione_prenotazioni: so.Mapped[int] = so.mapped_column(default=0, server_default='0')
 
     # Relazioni
     gestore: so.Mapped[User] = so.relationship(back_populates='menu_creati')
@@ -75,12 +88,25 @@ class MenuGiornaliero(db.Model):
 
 
 class Prenotazione(db.Model):
+    __table_args__ = (
+        sa.Index('ix_prenotazione_utente_created', 'utente_id', 'created_at', 'id'),
+        # Controllo "hai già una prenotazione per questo menu"
+        sa.Index('ix_prenotazione_utente_menu_stato', 'utente_id', 'menu_id', 'stato'),
+        # Elenco del gestore: prenotazioni di un menu in ordine di orario
+        sa.Index('ix_prenotazione_menu_orario_stato', 'menu_id', 'orario_ritiro', 'stato'),
+        # Parziale: solo le prenotazioni non pagate, per la scadenza automatica
+        sa.Index('ix_prenotazione_in_attesa_created', 'created_at',
+                 sqlite_where=sa.text("stato = 'in_attesa'"),
+                 postgresql_where=sa.text("stato = 'in_attesa'")),
+    )
+
     id: so.Mapped[int] = so.mapped_column(primary_key=True)
-    utente_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(User.id), index=True)
-    menu_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(MenuGiornaliero.id), index=True)
+    utente_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(User.id))
+    menu_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(MenuGiornaliero.id))
     orario_ritiro: so.Mapped[str] = so.mapped_column(sa.String(10))
-    stato: so.Mapped[str] = so.mapped_column(sa.String(20), default='in_attesa')  # in_attesa, pagata, confermata, ritirata, cancellata
+    stato: so.Mapped[str] = so.mapped_column(sa.String(20), default='in_attesa', active_history=True)  # in_attesa, pagata, confermata, ritirata, cancellata, scaduta
     note: so.Mapped[Optional[str]] = so.mapped_column(sa.String(500))
+    promemoria_inviato_at: so.Mapped[Optional[datetime]] = so.mapped_column()
     created_at: so.Mapped[datetime] = so.mapped_column(default=lambda: datetime.now(timezone.utc))
     updated_at: so.Mapped[datetime] = so.mapped_column(default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
     
@@ -104,14 +130,24 @@ class Prenotazione(db.Model):
 
 
 class Transazione(db.Model):
+    __table_args__ = (
+        sa.Index('ix_transazione_utente_created', 'utente_id', 'created_at', 'id'),
+        # Export mensile per la contabilità: intervallo di created_at già in ordine
+        sa.Index('ix_transazione_created', 'created_at', 'id'),
+        # Parziale: solo le transazioni da riconciliare, lette a blocchi per id
+        sa.Index('ix_transazione_in_attesa', 'id',
+                 sqlite_where=sa.text("stato = 'in_attesa'"),
+                 postgresql_where=sa.text("stato = 'in_attesa'")),
+    )
+
     id: so.Mapped[int] = so.mapped_column(primary_key=True)
-    utente_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(User.id), index=True)
+    utente_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(User.id))
     prenotazione_id: so.Mapped[Optional[int]] = so.mapped_column(sa.ForeignKey(Prenotazione.id), index=True)
     tipo: so.Mapped[str] = so.mapped_column(sa.String(50))  # pagamento_pasto
     importo: so.Mapped[float] = so.mapped_column()
     metodo_pagamento: so.Mapped[str] = so.mapped_column(sa.String(50))  # paypal
     stato: so.Mapped[str] = so.mapped_column(sa.String(20), default='completata')  # completata, fallita, in_attesa
-    paypal_order_id: so.Mapped[Optional[str]] = so.mapped_column(sa.String(200))
+    paypal_order_id: so.Mapped[Optional[str]] = so.mapped_column(sa.String(200), index=True, unique=True)
     created_at: so.Mapped[datetime] = so.mapped_column(default=lambda: datetime.now(timezone.utc))
     
     # Relazioni
@@ -122,6 +158,40 @@ class Transazione(db.Model):
         return f'<Transazione {self.id} - {self.tipo} - €{self.importo}>'
 
 
-@login.user_loader
-def load_user(id):
-    return db.session.get(User, int(id))
\ No newline at end of file
+class ChiaveIdempotenza(db.Model):
+    """Esito di una cattura PayPal, una riga per ordine: le ripetizioni rileggono la risposta salvata"""
+    chiave: so.Mapped[str] = so.mapped_column(sa.String(200), primary_key=True)  # paypal_order_id
+    # Unica per prenotazione: una sola cattura alla volta, anche con ordini diversi
+    prenotazione_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(Prenotazione.id), unique=True)
+    utente_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(User.id), index=True)
+    stato: so.Mapped[str] = so.mapped_column(sa.String(20), default='in_corso')  # in_corso, completata
+    codice: so.Mapped[Optional[int]] = so.mapped_column()
+    risposta: so.Mapped[Optional[str]] = so.mapped_column(sa.Text)
+    created_at: so.Mapped[datetime] = so.mapped_column(default=lambda: datetime.now(timezone.utc))
+    updated_at: so.Mapped[datetime] = so.mapped_column(default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+
+    def __repr__(self):
+        return f'<ChiaveIdempotenza {self.chiave} - {self.stato}>'
+
+
+class PostiSlot(db.Model):
+    """Contatore dei posti occupati per ogni coppia (menu, orario di ritiro)"""
+    menu_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(MenuGiornaliero.id), primary_key=True)
+    orario_ritiro: so.Mapped[str] = so.mapped_column(sa.String(10), primary_key=True)
+    occupati: so.Mapped[int] = so.mapped_column(default=0)
+
+    def __repr__(self):
+        return f'<PostiSlot {self.menu_id} {self.orario_ritiro} - {self.occupati}>'
+
+
+class StatisticheGiornaliere(db.Model):
+    """Prenotazioni e incasso per menu, orario di ritiro e stato, aggiornati a ogni cambio di stato"""
+    menu_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(MenuGiornaliero.id), primary_key=True)
+    orario_ritiro: so.Mapped[str] = so.mapped_column(sa.String(10), primary_key=True)
+    stato: so.Mapped[str] = so.mapped_column(sa.String(20), primary_key=True)
+    data: so.Mapped[date] = so.mapped_column(sa.Date, index=True)
+    prenotazioni: so.Mapped[int] = so.mapped_column(default=0)
+    incasso: so.Mapped[float] = so.mapped_column(default=0.0)
+
+    def __repr__(self):
+        return f'<StatisticheGiornaliere {self.data} {self.orario_ritiro} {self.stato}: {self.prenotazioni}>'
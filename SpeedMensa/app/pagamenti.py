@@ -0,0 +1,272 @@
+import json
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import requests
+import sqlalchemy as sa
+from app import app, db
+from app.models import MenuGiornaliero, Prenotazione, Transazione, ChiaveIdempotenza
+from app.paypal import get_paypal_client, RichiestaNonInviata
+from app.statistiche import applica_transizioni
+
+IN_CORSO = {'status': 'in_corso', 'msg': 'Pagamento già in elaborazione'}
+SUCCESSO = {'status': 'success'}
+DA_RIMBORSARE = {'status': 'failed',
+                 'msg': 'La prenotazione non è più valida: contatta la mensa per il rimborso'}
+IMPORTO_ERRATO = {'status': 'failed',
+                  'msg': 'L\'importo pagato non corrisponde al prezzo del menu: contatta la mensa per il rimborso'}
+ORDINE_NON_VALIDO = {'status': 'failed', 'msg': 'Ordine non valido per questa prenotazione'}
+# Stati PayPal di un ordine non ancora pagato né annullato
+STATI_APERTI = {'CREATED', 'SAVED', 'APPROVED', 'PAYER_ACTION_REQUIRED'}
+
+
+def _transazione_in_attesa(prenotazione_id, utente_id, importo, order_id):
+    return Transazione(
+        utente_id=utente_id,
+        prenotazione_id=prenotazione_id,
+        tipo='pagamento_pasto',
+        importo=importo,
+        metodo_pagamento='PayPal',
+        stato='in_attesa',
+        paypal_order_id=order_id
+    )
+
+def registra_ordine(prenotazione_id, utente_id, importo, order_id):
+    """Transazione in attesa per un ordine appena creato: la riconciliazione la ritrova"""
+    db.session.add(_transazione_in_attesa(prenotazione_id, utente_id, importo, order_id))
+    db.session.commit()
+
+def _esito_memorizzato(chiave, prenotazione):
+    """Risposta salvata per un ordine già visto"""
+    if chiave.prenotazione_id != prenotazione.id:
+        return ORDINE_NON_VALIDO, 409
+    if chiave.stato == 'in_corso':
+        return IN_CORSO, 409
+    return json.loads(chiave.risposta), chiave.codice
+
+def _importo_corretto(ordine, prezzo):
+    """True se le catture completate dell'ordine PayPal sommano esattamente `prezzo` euro"""
+    try:
+        catture = [cattura for unita in ordine['purchase_units'] for cattura in unita['payments']['captures']
+                   if cattura.get('status') == 'COMPLETED']
+        if not catture or any(cattura['amount']['currency_code'] != 'EUR' for cattura in catture):
+            return False
+        importo = sum(float(cattura['amount']['value']) for cattura in catture)
+    except (KeyError, TypeError, ValueError):
+        return False
+    return prezzo is not None and round(importo, 2) == round(prezzo, 2)
+
+def _riserva_ordine(prenotazione, order_id, registrata):
+    """Registra la cattura come in corso; False se un'altra richiesta l'ha già riservata.
+
+    Il vincolo di unicità su chiave e prenotazione fa da lock: delle richieste
+    concorrenti ne passa una sola, anche se usano ordini PayPal diversi.
+    """
+    if not registrata:
+        db.session.add(_transazione_in_attesa(prenotazione.id, prenotazione.utente_id,
+                                              prenotazione.menu.prezzo, order_id))
+    db.session.add(ChiaveIdempotenza(chiave=order_id, prenotazione_id=prenotazione.id,
+                                     utente_id=prenotazione.utente_id))
+    try:
+        db.session.commit()
+        return True
+    except sa.exc.IntegrityError:
+        db.session.rollback()
+        return False
+
+def _imposta_transazioni(order_ids, stato, da=('in_attesa',)):
+    """Chiude le transazioni degli ordini indicati che sono ancora in uno degli stati `da`"""
+    db.session.execute(
+        sa.update(Transazione)
+        .where(Transazione.paypal_order_id.in_(order_ids), Transazione.stato.in_(da))
+        .values(stato=stato)
+        .execution_options(synchronize_session=False)
+    )
+
+def _rilascia_ordini(order_ids):
+    db.session.execute(
+        sa.delete(ChiaveIdempotenza)
+        .where(ChiaveIdempotenza.chiave.in_(order_ids), ChiaveIdempotenza.stato == 'in_corso')
+        .execution_options(synchronize_session=False)
+    )
+
+def _completa_ordine(order_id, risposta, codice):
+    """Salva la risposta per le ripetizioni della richiesta"""
+    db.session.execute(
+        sa.update(ChiaveIdempotenza)
+        .where(ChiaveIdempotenza.chiave == order_id, ChiaveIdempotenza.stato == 'in_corso')
+        .values(stato='completata', codice=codice, risposta=json.dumps(risposta))
+        .execution_options(synchronize_session=False)
+    )
+
+def _segna_pagate(prenotazione_ids):
+    """Compare-and-set in blocco: passano a pagata solo le prenotazioni ancora in attesa.
+
+    Restituisce gli id aggiornati; l'UPDATE non passa dagli eventi ORM, quindi
+    aggregati e broker vengono aggiornati esplicitamente.
+    """
+    righe = db.session.execute(
+        sa.update(Prenotazione)
+        .where(Prenotazione.id.in_(prenotazione_ids), Prenotazione.stato == 'in_attesa')
+        .values(stato='pagata', updated_at=datetime.now(timezone.utc))
+        .returning(Prenotazione.id, Prenotazione.menu_id, Prenotazione.orario_ritiro)
+        .execution_options(synchronize_session=False)
+    ).all()
+    applica_transizioni(db.session, [(riga.menu_id, riga.orario_ritiro, 'in_attesa', 'pagata')
+                                     for riga in righe])
+    return {riga.id for riga in righe}
+
+def esegui_pagamento(prenotazione, order_id):
+    """Cattura l'ordine PayPal una sola volta e segna la prenotazione come pagata.
+
+    Restituisce (risposta, codice HTTP, eseguito): le ripetizioni della stessa
+    richiesta ricevono la risposta salvata senza chiamare PayPal, con eseguito False.
+    """
+    chiave = db.session.get(ChiaveIdempotenza, order_id)
+    if chiave is not None:
+        return *_esito_memorizzato(chiave, prenotazione), False
+    if prenotazione.stato != 'in_attesa':
+        return {'status': 'failed', 'msg': 'La prenotazione non è in attesa di pagamento'}, 409, False
+    # Un ordine creato per un'altra prenotazione non può pagare questa
+    registrata = db.session.execute(
+        sa.select(Transazione.prenotazione_id, Transazione.utente_id)
+        .where(Transazione.paypal_order_id == order_id)
+    ).first()
+    if registrata and tuple(registrata) != (prenotazione.id, prenotazione.utente_id):
+        return ORDINE_NON_VALIDO, 409, False
+    prezzo = prenotazione.menu.prezzo
+    if not _riserva_ordine(prenotazione, order_id, registrata):
+        chiave = db.session.get(ChiaveIdempotenza, order_id)
+        if chiave is not None:
+            return *_esito_memorizzato(chiave, prenotazione), False
+        return IN_CORSO, 409, False
+
+    try:
+        risultato = get_paypal_client().capture_order(order_id)
+    except RichiestaNonInviata as e:
+        # PayPal non ha ricevuto la cattura: l'ordine è intatto e si può ritentare subito
+        app.logger.error(f"Errore cattura ordine PayPal {order_id}: {e}")
+        _rilascia_ordini([order_id])
+        db.session.commit()
+        return {'status': 'failed', 'msg': 'Errore di comunicazione con PayPal'}, 502, False
+    except requests.RequestException as e:
+        # Esito sconosciuto: la chiave resta in corso finché la riconciliazione non lo chiarisce
+        app.logger.error(f"Errore cattura ordine PayPal {order_id}: {e}")
+        return {'status': 'failed', 'msg': 'Errore di comunicazione con PayPal'}, 502, False
+    if risultato.get('status') != 'COMPLETED':
+        _rilascia_ordini([order_id])
+        _imposta_transazioni([order_id], 'fallita')
+        db.session.commit()
+        return {'status': 'failed', 'msg': 'Pagamento non completato'}, 200, False
+
+    pagata = False
+    if not _importo_corretto(risultato, prezzo):
+        app.logger.warning(f"Ordine {order_id} catturato con un importo diverso dal prezzo del menu "
+                           f"({prezzo:.2f} €) della prenotazione {prenotazione.id}")
+        risposta, codice = IMPORTO_ERRATO, 409
+    elif _segna_pagate([prenotazione.id]):
+        pagata = True
+        risposta, codice = SUCCESSO, 200
+    else:
+        app.logger.warning(f"Ordine {order_id} catturato ma la prenotazione {prenotazione.id} "
+                           f"non è più in attesa")
+        risposta, codice = DA_RIMBORSARE, 409
+    _imposta_transazioni([order_id], 'completata', da=('in_attesa', 'fallita'))
+    _completa_ordine(order_id, risposta, codice)
+    db.session.commit()
+    return risposta, codice, pagata
+
+
+def _consulta_ordine(client, order_id):
+    """Ordine PayPal, None se lo stato non è noto (errore di rete o del server)"""
+    try:
+        ordine = client.get_order(order_id)
+    except requests.RequestException as e:
+        app.logger.error(f"Errore consultazione ordine PayPal {order_id}: {e}")
+        return None
+    if 'status' not in ordine and ordine.get('name') != 'RESOURCE_NOT_FOUND':
+        app.logger.error(f"Errore consultazione ordine PayPal {order_id}: {ordine}")
+        return None
+    return ordine
+
+def riconcilia(attesa, abbandono, concorrenza=8, blocco=100):
+    """Allinea le transazioni in attesa con lo stato degli ordini su PayPal.
+
+    Considera solo le transazioni più vecchie di `attesa` (timedelta), per non
+    interferire con i pagamenti in corso; gli ordini ancora aperti dopo
+    `abbandono` vengono chiusi come falliti; di quelli approvati ma non ancora
+    catturati si rilascia la chiave di idempotenza, così il pagamento si può
+    ritentare. Gli ordini catturati con un importo diverso dal prezzo del menu
+    non pagano la prenotazione. Le transazioni sono lette a blocchi
+    per chiave primaria, gli ordini di un blocco consultati in parallelo da al
+    più `concorrenza` thread e le correzioni salvate con un commit per blocco.
+    Restituisce i conteggi per esito.
+    """
+    ora = datetime.now(timezone.utc)
+    client = get_paypal_client()
+    esiti = Counter()
+    ultimo_id = 0
+    with ThreadPoolExecutor(max_workers=concorrenza) as executor:
+        while True:
+            righe = db.session.execute(
+                sa.select(Transazione.id, Transazione.paypal_order_id, Transazione.prenotazione_id,
+                          MenuGiornaliero.prezzo, (Transazione.created_at < ora - abbandono).label('abbandonata'))
+                .outerjoin(Prenotazione, Prenotazione.id == Transazione.prenotazione_id)
+                .outerjoin(MenuGiornaliero, MenuGiornaliero.id == Prenotazione.menu_id)
+                .where(
+                    Transazione.stato == 'in_attesa',
+                    Transazione.paypal_order_id.is_not(None),
+                    Transazione.created_at < ora - attesa,
+                    Transazione.id > ultimo_id
+                )
+                .order_by(Transazione.id)
+                .limit(blocco)
+            ).all()
+            if not righe:
+                break
+            ultimo_id = righe[-1].id
+            # Nessuna transazione aperta durante le chiamate a PayPal
+            db.session.commit()
+
+            ordini = executor.map(lambda riga: _consulta_ordine(client, riga.paypal_order_id), righe)
+            completati, importo_errato, approvati, falliti = [], [], [], []
+            for riga, ordine in zip(righe, ordini):
+                if ordine is None:
+                    esiti['errori'] += 1
+                elif ordine.get('status') == 'COMPLETED':
+                    (completati if _importo_corretto(ordine, riga.prezzo) else importo_errato).append(riga)
+                elif ordine.get('status') in STATI_APERTI and not riga.abbandonata:
+                    esiti['in_attesa'] += 1
+                    if ordine['status'] == 'APPROVED':
+                        approvati.append(riga.paypal_order_id)
+                else:
+                    falliti.append(riga.paypal_order_id)
+
+            pagate = _segna_pagate({riga.prenotazione_id for riga in completati}) if completati else set()
+            for riga in completati:
+                if riga.prenotazione_id in pagate:
+                    # Un secondo ordine catturato per la stessa prenotazione va rimborsato
+                    pagate.discard(riga.prenotazione_id)
+                    _completa_ordine(riga.paypal_order_id, SUCCESSO, 200)
+                    esiti['completate'] += 1
+                else:
+                    app.logger.warning(f"Ordine {riga.paypal_order_id} catturato ma la prenotazione "
+                                       f"{riga.prenotazione_id} non è più in attesa")
+                    _completa_ordine(riga.paypal_order_id, DA_RIMBORSARE, 409)
+                    esiti['da_rimborsare'] += 1
+            for riga in importo_errato:
+                app.logger.warning(f"Ordine {riga.paypal_order_id} catturato con un importo diverso dal "
+                                   f"prezzo del menu della prenotazione {riga.prenotazione_id}")
+                _completa_ordine(riga.paypal_order_id, IMPORTO_ERRATO, 409)
+                esiti['da_rimborsare'] += 1
+            if completati or importo_errato:
+                _imposta_transazioni([riga.paypal_order_id for riga in completati + importo_errato], 'completata')
+            if approvati:
+                _rilascia_ordini(approvati)
+            if falliti:
+                _rilascia_ordini(falliti)
+                _imposta_transazioni(falliti, 'fallita')
+                esiti['fallite'] += len(falliti)
+            db.session.commit()
+            esiti['verificate'] += len(righe)
+    return esiti
@@ -0,0 +1,80 @@
+import base64
+import json
+from datetime import datetime
+import sqlalchemy as sa
+from app import db
+
+
+class CursoreNonValido(ValueError):
+    pass
+
+
+def codifica_cursore(created_at, id, direzione):
+    dati = json.dumps([created_at.isoformat(), id, direzione]).encode()
+    return base64.urlsafe_b64encode(dati).decode().rstrip('=')
+
+def decodifica_cursore(token):
+    try:
+        dati = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        created_at, id, direzione = json.loads(dati)
+        if direzione not in ('dopo', 'prima'):
+            raise ValueError(direzione)
+        return datetime.fromisoformat(created_at), int(id), direzione
+    except (ValueError, TypeError) as e:
+        raise CursoreNonValido(token) from e
+
+
+class PaginaKeyset:
+    """Pagina di risultati ordinati per (created_at, id) decrescenti.
+
+    Invece di OFFSET, ogni pagina riparte dalla chiave dell'ultima (o della prima)
+    riga già mostrata, così il costo non cresce con il numero di pagina.
+    """
+
+    def __init__(self, items, has_next, has_prev):
+        self.items = items
+        self.has_next = has_next
+        self.has_prev = has_prev
+        self.next_cursor = None
+        self.prev_cursor = None
+        if items and has_next:
+            self.next_cursor = codifica_cursore(items[-1].created_at, items[-1].id, 'dopo')
+        if items and has_prev:
+            self.prev_cursor = codifica_cursore(items[0].created_at, items[0].id, 'prima')
+
+    @classmethod
+    def da_cursore(cls, query, modello, per_page, cursore=None):
+        created_at, id = modello.created_at, modello.id
+        query = query.order_by(None)
+        direzione = None
+        if cursore:
+            valore, chiave, direzione = decodifica_cursore(cursore)
+            if direzione == 'prima':
+                query = query.where(sa.or_(
+                    created_at > valore, sa.and_(created_at == valore, id > chiave)
+                ))
+            else:
+                query = query.where(sa.or_(
+                    created_at < valore, sa.and_(created_at == valore, id < chiave)
+                ))
+        if direzione == 'prima':
+            query = query.order_by(created_at.asc(), id.asc())
+        else:
+            query = query.order_by(created_at.desc(), id.desc())
+        righe = db.session.scalars(query.limit(per_page + 1)).unique().all()
+        altre = len(righe) > per_page
+        righe = righe[:per_page]
+        if direzione == 'prima':
+            righe.reverse()
+            return cls(righe, has_next=True, has_prev=altre)
+        return cls(righe, has_next=altre, has_prev=direzione is not None)
+
+    @classmethod
+    def da_offset(cls, query, modello, per_page, page):
+        """Compatibilità con i vecchi link a numero di pagina: i link successivi usano i cursori"""
+        page = max(page, 1)
+        query = query.order_by(None).order_by(modello.created_at.desc(), modello.id.desc())
+        righe = db.session.scalars(
+            query.limit(per_page + 1).offset((page - 1) * per_page)
+        ).unique().all()
+        return cls(righe[:per_page], has_next=len(righe) > per_page, has_prev=page > 1)
@@ -0,0 +1,60 @@
+import atexit
+from concurrent.futures import ProcessPoolExecutor
+from werkzeug.security import generate_password_hash, check_password_hash
+from app import app
+
+# Metodi Werkzeug per nome di profilo; un valore non in elenco è usato come metodo
+PROFILI_HASH = {
+    # Default di Werkzeug 3: scrypt con N=2^15, circa 32 MiB e qualche decina di ms
+    'standard': 'scrypt:32768:8:1',
+    # Metà della memoria e del tempo, per server con poca CPU all'ora di punta
+    'leggero': 'scrypt:16384:8:1',
+    # Raccomandazione OWASP per PBKDF2-SHA256, senza requisiti di memoria
+    'pbkdf2': 'pbkdf2:sha256:600000',
+}
+
+
+def metodo_hash():
+    profilo = app.config['PASSWORD_PROFILO']
+    return PROFILI_HASH.get(profilo, profilo)
+
+def genera_hash(password):
+    return generate_password_hash(password, method=metodo_hash())
+
+# Prefisso che Werkzeug scrive negli hash di ciascun metodo, calcolato una volta per metodo
+_prefissi = {}
+
+def prefisso_hash():
+    """Il metodo del profilo come compare negli hash: Werkzeug completa i parametri
+    omessi ('scrypt' diventa 'scrypt:32768:8:1'), quindi si ricava da un hash di prova"""
+    metodo = metodo_hash()
+    if metodo not in _prefissi:
+        _prefissi[metodo] = generate_password_hash('', method=metodo).split('$', 1)[0]
+    return _prefissi[metodo]
+
+def da_aggiornare(password_hash):
+    """True se l'hash è stato calcolato con parametri diversi da quelli del profilo attuale"""
+    return password_hash.split('$', 1)[0] != prefisso_hash()
+
+def _pool():
+    """Processi per la verifica delle password, creati alla prima richiesta"""
+    pool = app.extensions.get('password_pool')
+    if pool is None:
+        pool = app.extensions.setdefault('password_pool',
+                                         ProcessPoolExecutor(max_workers=app.config['PASSWORD_PROCESSI']))
+        atexit.register(pool.shutdown, cancel_futures=True)
+    return pool
+
+def verifica(password_hash, password):
+    """Confronta la password con l'hash.
+
+    Con PASSWORD_PROCESSI > 0 il calcolo avviene in un pool di processi: il
+    worker web attende senza occupare CPU, e gli hash calcolati insieme sono al
+    più quanti i processi, così durante un'ondata di login le altre richieste
+    continuano a trovare CPU libera.
+    """
+    if not password_hash:
+        return False
+    if not app.config['PASSWORD_PROCESSI']:
+        return check_password_hash(password_hash, password)
+    return _pool().submit(check_password_hash, password_hash, password).result()
@@ -0,0 +1,123 @@
+import threading
+from time import monotonic
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+from app import app
+from app.metriche import registra_http
+
+
+class RichiestaNonInviata(requests.RequestException):
+    """La richiesta non è arrivata a PayPal (token mancante, connessione rifiutata o scaduta):
+    l'operazione sicuramente non è stata eseguita"""
+
+
+def _connessione_mancata(errore):
+    """True se l'errore è avvenuto aprendo la connessione, prima di inviare la richiesta"""
+    if isinstance(errore, requests.ConnectTimeout):
+        return True
+    motivo = errore.args[0] if errore.args else None
+    return isinstance(getattr(motivo, 'reason', motivo), NewConnectionError)
+
+
+class PayPalClient:
+    """Client PayPal con token OAuth in cache e connessioni keep-alive condivise"""
+
+    def __init__(self, api_base, client_id, client_secret, pool_size=10,
+                 timeout=(3.05, 15), margine_token=60):
+        self.api_base = api_base
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.timeout = timeout
+        self.margine_token = margine_token
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.hooks['response'].append(registra_http)
+        self._token = None
+        self._scadenza = 0.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            config['PAYPAL_API_BASE'],
+            config['PAYPAL_CLIENT_ID'],
+            config['PAYPAL_CLIENT_SECRET'],
+            pool_size=config['PAYPAL_POOL_SIZE'],
+            timeout=config['PAYPAL_TIMEOUT'],
+            margine_token=config['PAYPAL_TOKEN_MARGIN']
+        )
+
+    def get_token(self):
+        """Restituisce il token OAuth, rinnovandolo poco prima della scadenza.
+
+        Il rinnovo avviene sotto lock: le richieste concorrenti attendono
+        il token ottenuto dalla prima invece di chiederne uno ciascuna.
+        """
+        token = self._token
+        if token and monotonic() < self._scadenza:
+            return token
+        with self._lock:
+            if self._token and monotonic() < self._scadenza:
+                return self._token
+            try:
+                response = self.session.post(
+                    f"{self.api_base}/v1/oauth2/token",
+                    auth=(self.client_id, self.client_secret or ''),
+                    headers={"Accept": "application/json", "Accept-Language": "en_US"},
+                    data={"grant_type": "client_credentials"},
+                    timeout=self.timeout
+                )
+                dati = response.json()
+            except Exception as e:
+                app.logger.error(f"Errore Token PayPal: {e}")
+                return None
+            self._token = dati.get('access_token')
+            durata = int(dati.get('expires_in', 0))
+            self._scadenza = monotonic() + max(durata - self.margine_token, 0)
+            return self._token
+
+    def invalida_token(self):
+        with self._lock:
+            self._token = None
+            self._scadenza = 0.0
+
+    def _richiesta(self, metodo, percorso, **kwargs):
+        """Esegue una chiamata autenticata, ritentando una volta se il token è stato revocato"""
+        for tentativo in range(2):
+            token = self.get_token()
+            if not token:
+                raise RichiestaNonInviata('Token PayPal non disponibile')
+            headers = {"Content-Type": "application/json", "Authorization": f"Bearer {token}"}
+            try:
+                response = self.session.request(metodo, f"{self.api_base}{percorso}",
+                                                headers=headers, timeout=self.timeout, **kwargs)
+            except requests.ConnectionError as e:
+                if _connessione_mancata(e):
+                    raise RichiestaNonInviata(e) from e
+                raise
+            if response.status_code != 401 or tentativo:
+                return response.json()
+            self.invalida_token()
+
+    def create_order(self, payload):
+        return self._richiesta('POST', '/v2/checkout/orders', json=payload)
+
+    def capture_order(self, order_id):
+        return self._richiesta('POST', f'/v2/checkout/orders/{order_id}/capture')
+
+    def get_order(self, order_id):
+        return self._richiesta('GET', f'/v2/checkout/orders/{order_id}')
+
+    def close(self):
+        self.session.close()
+
+
+def get_paypal_client():
+    """Client condiviso dall'applicazione, creato alla prima richiesta"""
+    client = app.extensions.get('paypal')
+    if client is None:
+        client = app.extensions.setdefault('paypal', PayPalClient.from_config(app.config))
+    return client
@@ -0,0 +1,155 @@
+import csv
+import json
+from collections import Counter
+from datetime import date, datetime, timedelta, timezone
+import sqlalchemy as sa
+from app import db
+from app.models import MenuGiornaliero
+
+# Colonne del CSV e chiavi del JSON di pianificazione; data, primo, secondo e contorno obbligatori
+CAMPI_MENU = ('data', 'primo', 'secondo', 'contorno', 'frutta', 'dolce', 'prezzo', 'disponibile')
+_PORTATE = ('primo', 'secondo', 'contorno', 'frutta', 'dolce')
+_OBBLIGATORI = ('primo', 'secondo', 'contorno')
+# Come in MenuForm
+_LUNGHEZZA_PORTATA = 200
+_PREZZO_MASSIMO = 50.0
+
+
+class PianificazioneNonValida(ValueError):
+    """Menu rifiutati; `errori` elenca un messaggio per ogni problema trovato"""
+
+    def __init__(self, errori):
+        super().__init__('; '.join(errori))
+        self.errori = errori
+
+
+def _booleano(valore):
+    if isinstance(valore, str):
+        return valore.strip().lower() not in ('0', 'no', 'false', 'n', '')
+    return bool(valore)
+
+
+def normalizza_menu(dati):
+    """Valida un menu (dizionario con i CAMPI_MENU) e restituisce i valori da inserire"""
+    if not isinstance(dati, dict):
+        raise ValueError('ogni menu deve essere un oggetto con i campi del menu')
+    valore_data = dati.get('data')
+    if isinstance(valore_data, datetime):
+        valore_data = valore_data.date()
+    elif not isinstance(valore_data, date):
+        try:
+            valore_data = date.fromisoformat(str(valore_data or '').strip())
+        except ValueError:
+            raise ValueError(f'data non valida: {valore_data!r}')
+    if valore_data < date.today():
+        raise ValueError(f'{valore_data} è una data passata')
+    menu = {'data': valore_data}
+    for campo in _PORTATE:
+        testo = dati.get(campo)
+        if testo is None:
+            testo = ''
+        elif not isinstance(testo, str):
+            raise ValueError(f'{valore_data}: {campo} deve essere un testo')
+        testo = testo.strip()
+        if campo in _OBBLIGATORI and not testo:
+            raise ValueError(f'{valore_data}: {campo} mancante')
+        if len(testo) > _LUNGHEZZA_PORTATA:
+            raise ValueError(f'{valore_data}: {campo} più lungo di {_LUNGHEZZA_PORTATA} caratteri')
+        menu[campo] = testo or None
+    prezzo = dati.get('prezzo')
+    try:
+        menu['prezzo'] = 5.0 if prezzo in (None, '') else float(prezzo)
+    except (TypeError, ValueError):
+        raise ValueError(f'{valore_data}: prezzo non valido: {prezzo!r}')
+    if not 0 <= menu['prezzo'] <= _PREZZO_MASSIMO:
+        raise ValueError(f'{valore_data}: il prezzo deve essere tra 0 e {_PREZZO_MASSIMO:.0f} €')
+    disponibile = dati.get('disponibile')
+    menu['disponibile'] = True if disponibile in (None, '') else _booleano(disponibile)
+    return menu
+
+
+def date_occupate(date_menu):
+    """Date dell'elenco che hanno già un menu, con una sola query IN"""
+    if not date_menu:
+        return set()
+    return set(db.session.scalars(
+        sa.select(MenuGiornaliero.data).where(MenuGiornaliero.data.in_(sorted(set(date_menu))))
+    ))
+
+
+def pianifica(menu, gestore_id):
+    """Inserisce i menu di un periodo; o tutti o nessuno.
+
+    Ogni menu viene validato come in MenuForm; le date ripetute nell'elenco o
+    già occupate (una sola SELECT ... IN per tutto il periodo) rendono non
+    valida l'intera pianificazione. Gli inserimenti sono un unico executemany
+    nella transazione corrente: il commit e l'invalidazione di menu_cache
+    spettano al chiamante.
+    """
+    righe = []
+    errori = []
+    for i, dati in enumerate(menu, 1):
+        try:
+            righe.append(normalizza_menu(dati))
+        except ValueError as e:
+            errori.append(f'menu {i}: {e}')
+    ripetute = sorted(giorno for giorno, volte in Counter(riga['data'] for riga in righe).items() if volte > 1)
+    errori += [f'{giorno} compare più volte' for giorno in ripetute]
+    errori += [f'esiste già un menu per il {giorno}'
+               for giorno in sorted(date_occupate([riga['data'] for riga in righe]))]
+    if not righe and not errori:
+        errori.append('nessun menu da inserire')
+    if errori:
+        raise PianificazioneNonValida(errori)
+    db.session.execute(sa.insert(MenuGiornaliero), [dict(riga, gestore_id=gestore_id) for riga in righe])
+    return len(righe)
+
+
+def clona(gestore_id, dal, al, inizio):
+    """Copia i menu del gestore tra `dal` e `al` nel periodo che comincia il giorno `inizio`.
+
+    La copia è un INSERT ... SELECT eseguito dal database, con la data spostata
+    di (inizio - dal) giorni. Se una data del periodo di arrivo ha già un menu
+    non si copia nulla. Restituisce il numero di menu creati; come per
+    pianifica, commit e invalidazione della cache spettano al chiamante.
+    """
+    if al < dal:
+        raise PianificazioneNonValida(['la fine del periodo precede l\'inizio'])
+    if inizio < date.today():
+        raise PianificazioneNonValida([f'{inizio} è una data passata'])
+    giorni = (inizio - dal).days
+    fine = inizio + (al - dal)
+    occupate = db.session.scalars(
+        sa.select(MenuGiornaliero.data).where(MenuGiornaliero.data.between(inizio, fine)).order_by(MenuGiornaliero.data)
+    ).all()
+    if occupate:
+        raise PianificazioneNonValida([f'esiste già un menu per il {giorno}' for giorno in occupate])
+
+    sorgente = sa.and_(MenuGiornaliero.gestore_id == gestore_id, MenuGiornaliero.data.between(dal, al))
+    colonne = ['data', *_PORTATE, 'prezzo', 'disponibile', 'gestore_id', 'created_at']
+    dialetto = db.session.get_bind().dialect.name
+    if dialetto == 'sqlite':
+        nuova_data = sa.func.date(MenuGiornaliero.data, f'{giorni:+d} days')
+    elif dialetto == 'postgresql':
+        nuova_data = MenuGiornaliero.data + giorni
+    else:
+        # Senza aritmetica sulle date portabile si copiano le righe lato Python
+        righe = db.session.execute(sa.select(*(getattr(MenuGiornaliero, c) for c in colonne[:-2])).where(sorgente))
+        valori = [dict(riga._mapping, data=riga.data + timedelta(days=giorni), gestore_id=gestore_id)
+                  for riga in righe]
+        if valori:
+            db.session.execute(sa.insert(MenuGiornaliero), valori)
+        return len(valori)
+    selezione = sa.select(
+        nuova_data, *(getattr(MenuGiornaliero, campo) for campo in _PORTATE), MenuGiornaliero.prezzo,
+        MenuGiornaliero.disponibile, sa.literal(gestore_id), sa.literal(datetime.now(timezone.utc))
+    ).where(sorgente)
+    return db.session.execute(sa.insert(MenuGiornaliero).from_select(colonne, selezione)).rowcount
+
+
+def leggi_menu(file, formato):
+    """Menu da un file CSV (intestazione con i CAMPI_MENU) o JSON (lista, o oggetto con chiave "menu")"""
+    if formato == 'json':
+        dati = json.load(file)
+        return dati.get('menu', []) if isinstance(dati, dict) else dati
+    return list(csv.DictReader(file, skipinitialspace=True))
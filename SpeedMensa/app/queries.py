@@ -0,0 +1,112 @@
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+from app.models import User, MenuGiornaliero, Prenotazione, Transazione
+
+# Query di elenco con le relazioni usate dai template già caricate,
+# così il rendering non esegue una SELECT per ogni riga.
+# Gli indici che le servono sono in models.py; i piani di esecuzione
+# sono verificati da QueryPlanCase in tests.py.
+
+
+def prenotazioni_utente(utente_id):
+    """Prenotazioni di un utente, più recenti prima, con il menu associato"""
+    return (
+        sa.select(Prenotazione)
+        .options(so.joinedload(Prenotazione.menu))
+        .where(Prenotazione.utente_id == utente_id)
+        .order_by(Prenotazione.created_at.desc(), Prenotazione.id.desc())
+    )
+
+def prenotazione_attiva(utente_id, menu_id):
+    """Prenotazione non cancellata né scaduta di un utente per un menu"""
+    return sa.select(Prenotazione).where(
+        Prenotazione.utente_id == utente_id,
+        Prenotazione.menu_id == menu_id,
+        Prenotazione.stato.in_(['in_attesa', 'pagata', 'confermata'])
+    )
+
+def prenotazioni_menu(menu_id, stati):
+    """Prenotazioni di un menu negli stati indicati, con i dati dello studente"""
+    return (
+        sa.select(Prenotazione)
+        .options(so.joinedload(Prenotazione.utente))
+        .where(
+            Prenotazione.menu_id == menu_id,
+            Prenotazione.stato.in_(stati)
+        )
+        .order_by(Prenotazione.orario_ritiro)
+    )
+
+def transazioni_utente(utente_id, solo_completate=False):
+    """Transazioni di un utente, più recenti prima"""
+    query = (
+        sa.select(Transazione)
+        .where(Transazione.utente_id == utente_id)
+        .order_by(Transazione.created_at.desc(), Transazione.id.desc())
+    )
+    if solo_completate:
+        query = query.where(Transazione.stato == 'completata')
+    return query
+
+def menu_disponibili(dal):
+    """Menu prenotabili a partire dalla data indicata"""
+    return (
+        sa.select(MenuGiornaliero)
+        .where(
+            MenuGiornaliero.data >= dal,
+            MenuGiornaliero.disponibile == True
+        )
+        .order_by(MenuGiornaliero.data)
+    )
+
+def menu_gestore(gestore_id):
+    """Menu creati da un gestore, più recenti prima"""
+    return (
+        sa.select(MenuGiornaliero)
+        .where(MenuGiornaliero.gestore_id == gestore_id)
+        .order_by(MenuGiornaliero.data.desc())
+    )
+
+def esporta_prenotazioni(gestore_id, menu_id=None, dal=None, al=None):
+    """Righe dell'export prenotazioni: per data, menu e orario, senza ordinamenti temporanei.
+
+    Seleziona colonne e non oggetti, così l'export non popola la identity map.
+    """
+    query = (
+        sa.select(
+            MenuGiornaliero.data, Prenotazione.orario_ritiro, Prenotazione.stato, User.matricola,
+            User.cognome, User.nome, User.email, MenuGiornaliero.prezzo, Prenotazione.note,
+            Prenotazione.created_at, Prenotazione.id, MenuGiornaliero.id
+        )
+        .join(Prenotazione.menu)
+        .join(Prenotazione.utente)
+        .where(MenuGiornaliero.gestore_id == gestore_id)
+        .order_by(MenuGiornaliero.data, MenuGiornaliero.id, Prenotazione.orario_ritiro,
+                  Prenotazione.stato, Prenotazione.id)
+    )
+    if menu_id is not None:
+        query = query.where(MenuGiornaliero.id == menu_id)
+    if dal is not None:
+        query = query.where(MenuGiornaliero.data >= dal)
+    if al is not None:
+        query = query.where(MenuGiornaliero.data <= al)
+    return query
+
+def esporta_transazioni(inizio, fine):
+    """Righe dell'export transazioni create in [inizio, fine), in ordine cronologico.
+
+    Tutte le transazioni del periodo, anche quelle senza prenotazione: è
+    l'elenco per la contabilità della mensa, non di un singolo gestore.
+    """
+    return (
+        sa.select(
+            Transazione.created_at, Transazione.id, Transazione.tipo, Transazione.importo,
+            Transazione.metodo_pagamento, Transazione.stato, Transazione.paypal_order_id,
+            User.matricola, User.cognome, User.nome, Transazione.prenotazione_id, MenuGiornaliero.data
+        )
+        .join(Transazione.utente)
+        .outerjoin(Transazione.prenotazione)
+        .outerjoin(Prenotazione.menu)
+        .where(Transazione.created_at >= inizio, Transazione.created_at < fine)
+        .order_by(Transazione.created_at, Transazione.id)
+    )
@@ -1,21 +1,43 @@
-from flask import render_template, flash, redirect, request, url_for, jsonify, current_app
+from flask import render_template, flash, redirect, request, url_for, jsonify, current_app, Response, abort
 from app import app, db
 from app.forms import (
     LoginForm, RegistrationForm, MenuForm, PrenotazioneForm, 
-    EditProfileForm, CancellaPrenotazioneForm, ResetPasswordRequestForm, ResetPasswordForm
+    EditProfileForm, CancellaPrenotazioneForm, ResetPasswordRequestForm, ResetPasswordForm,
+    PianificaMenuForm, ClonaMenuForm, ORARI_PRENOTABILI
 )
 from flask_login import current_user, login_user, logout_user, login_required
 import sqlalchemy as sa
 from app.models import User, MenuGiornaliero, Prenotazione, Transazione
 from urllib.parse import urlsplit
-from datetime import date
+from datetime import date, datetime, timedelta
 from functools import wraps
+from hashlib import md5
+import hmac
 from app.email import send_password_reset_email, send_prenotazione_conferma_email
+from app.capacita import (
+    occupa_posto, libera_posto, posti_per_slot, capienza_slot, disponibilita_menu, scadi_prenotazioni,
+    STATI_OCCUPANTI
+)
+from app.paypal import get_paypal_client
+from app.pagamenti import esegui_pagamento, registra_ordine
+from app import queries
+from app.paginazione import PaginaKeyset, CursoreNonValido
+from app.cache import menu_cache, menu_disponibili
+from app.eventi import broker, evento_sse, RISINCRONIZZA
+from app.statistiche import statistiche_menu, riepilogo_menu, riallinea_menu
+from app.metriche import registro as registro_metriche
+from app.pianificazione import pianifica, clona, leggi_menu, PianificazioneNonValida
+from app.esportazione import risposta_csv, INTESTAZIONE_PRENOTAZIONI, INTESTAZIONE_TRANSAZIONI
 import requests
-import base64
+import queue
+import io
+import csv
 
 # ... (I decoratori e le rotte login/logout/register rimangono uguali a prima) ...
 
+# Stati delle prenotazioni mostrate e conteggiate nella dashboard del gestore
+STATI_CONTEGGIATI = ['confermata', 'pagata']
+
 def gestore_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -36,6 +58,10 @@ def login():
         if user is None or not user.check_password(form.password.data):
             flash('Username o password errati.', 'error')
             return redirect(url_for('login'))
+        if user.password_da_aggiornare():
+            # Password appena verificata: si ricalcola l'hash con il profilo attuale
+            user.set_password(form.password.data)
+            db.session.commit()
         login_user(user, remember=form.remember_me.data)
         next_page = request.args.get('next')
         if not next_page or urlsplit(next_page).netloc != '':
@@ -47,17 +73,7 @@ def login():
 @app.route('/index')
 @login_required
 def index():
-    oggi = date.today()
-    menu_query = (
-        sa.select(MenuGiornaliero)
-        .where(
-            MenuGiornaliero.data >= oggi,
-            MenuGiornaliero.disponibile == True
-        )
-        .order_by(MenuGiornaliero.data)
-    )
-    menu_disponibili = db.session.scalars(menu_query).all()
-    return render_template('index.html', title='Home', menu_disponibili=menu_disponibili)
+    return render_template('index.html', title='Home', menu_disponibili=menu_disponibili(date.today()))
 
 @app.route('/logout')
 @login_required
@@ -83,6 +99,13 @@ def register():
         try:
             db.session.add(user)
             db.session.commit()
+        except sa.exc.IntegrityError:
+            # Valori registrati da un'altra richiesta dopo la validazione
+            db.session.rollback()
+            if form.segnala_duplicati():
+                return render_template('register.html', title='Registrati', form=form)
+            flash('Registrazione non riuscita. Riprovare più tardi.', 'error')
+            return redirect(url_for('register'))
         except Exception:
             db.session.rollback()
             flash('Registrazione non riuscita. Riprovare più tardi.', 'error')
@@ -94,52 +117,67 @@ def register():
 @app.route('/profilo')
 @login_required
 def profilo():
-    pren_page = request.args.get('pren_page', default=1, type=int)
-    trans_page = request.args.get('trans_page', default=1, type=int)
     per_page = 10
-
-    prenotazioni_query = (
-        sa.select(Prenotazione)
-        .where(Prenotazione.utente_id == current_user.id)
-        .order_by(Prenotazione.created_at.desc())
-        .limit(per_page)
-        .offset((pren_page - 1) * per_page)
-    )
-    prenotazioni = db.session.scalars(prenotazioni_query).all()
-
-    transazioni_query = (
-        sa.select(Transazione)
-        .where(Transazione.utente_id == current_user.id)
-        .order_by(Transazione.created_at.desc())
-        .limit(per_page)
-        .offset((trans_page - 1) * per_page)
-    )
-    transazioni = db.session.scalars(transazioni_query).all()
+    try:
+        prenotazioni = _pagina_profilo(
+            queries.prenotazioni_utente(current_user.id), Prenotazione, per_page, 'pren'
+        )
+        transazioni = _pagina_profilo(
+            queries.transazioni_utente(current_user.id, solo_completate=True), Transazione, per_page, 'trans'
+        )
+    except CursoreNonValido:
+        return redirect(url_for('profilo'))
 
     form = CancellaPrenotazioneForm()
     return render_template(
         'profilo.html',
         title='Profilo',
-        prenotazioni=prenotazioni,
-        transazioni=transazioni,
+        prenotazioni=prenotazioni.items,
+        transazioni=transazioni.items,
+        pagina_prenotazioni=prenotazioni,
+        pagina_transazioni=transazioni,
+        posizione_prenotazioni=_posizione_profilo('pren'),
+        posizione_transazioni=_posizione_profilo('trans'),
         form=form,
-        pren_page=pren_page,
-        trans_page=trans_page,
         per_page=per_page
     )
 
+def _pagina_profilo(query, modello, per_page, prefisso):
+    """Usa il cursore se presente, altrimenti il vecchio parametro <prefisso>_page"""
+    cursore = request.args.get(f'{prefisso}_cursor')
+    page = request.args.get(f'{prefisso}_page', type=int)
+    if not cursore and page:
+        return PaginaKeyset.da_offset(query, modello, per_page, page)
+    return PaginaKeyset.da_cursore(query, modello, per_page, cursore)
+
+def _posizione_profilo(prefisso):
+    """Parametri che mantengono la pagina di una lista mentre si sfoglia l'altra"""
+    cursore = request.args.get(f'{prefisso}_cursor')
+    if cursore:
+        return {f'{prefisso}_cursor': cursore}
+    page = request.args.get(f'{prefisso}_page', type=int)
+    return {f'{prefisso}_page': page} if page else {}
+
 @app.route('/edit_profilo', methods=['GET', 'POST'])
 @login_required
 def edit_profilo():
     form = EditProfileForm(current_user.username, current_user.email, current_user.matricola)
     if form.validate_on_submit():
-        current_user.username = form.username.data
-        current_user.email = form.email.data
-        current_user.nome = form.nome.data
-        current_user.cognome = form.cognome.data
-        current_user.matricola = form.matricola.data
+        # current_user è la copia in cache: si modifica il modello, la cache si aggiorna al commit
+        utente = db.session.get(User, current_user.id)
+        utente.username = form.username.data
+        utente.email = form.email.data
+        utente.nome = form.nome.data
+        utente.cognome = form.cognome.data
+        utente.matricola = form.matricola.data
         try:
             db.session.commit()
+        except sa.exc.IntegrityError:
+            db.session.rollback()
+            if form.segnala_duplicati():
+                return render_template('edit_profilo.html', title='Modifica Profilo', form=form)
+            flash('Aggiornamento profilo non riuscito. Riprovare più tardi.', 'error')
+            return redirect(url_for('edit_profilo'))
         except Exception:
             db.session.rollback()
             flash('Aggiornamento profilo non riuscito. Riprovare più tardi.', 'error')
@@ -159,13 +197,10 @@ def edit_profilo():
 @login_required
 @gestore_required
 def gestore_menu():
-    menu_query = (
-        sa.select(MenuGiornaliero)
-        .where(MenuGiornaliero.gestore_id == current_user.id)
-        .order_by(MenuGiornaliero.data.desc())
-    )
-    menu_list = db.session.scalars(menu_query).all()
-    return render_template('gestore/menu_list.html', title='I Miei Menu', menu_list=menu_list)
+    menu_list = db.session.scalars(queries.menu_gestore(current_user.id)).all()
+    riepilogo = riepilogo_menu([menu.id for menu in menu_list], STATI_CONTEGGIATI)
+    return render_template('gestore/menu_list.html', title='I Miei Menu', menu_list=menu_list,
+                           riepilogo=riepilogo)
 
 @app.route('/gestore/menu/nuovo', methods=['GET', 'POST'])
 @login_required
@@ -198,11 +233,96 @@ def crea_menu():
             db.session.rollback()
             flash('Creazione menu non riuscita. Riprovare più tardi.', 'error')
             return redirect(url_for('crea_menu'))
+        menu_cache.invalida()
 
         flash('Menu creato con successo!', 'success')
         return redirect(url_for('gestore_menu'))
     return render_template('gestore/crea_menu.html', title='Crea Menu', form=form)
 
+@app.route('/gestore/menu/pianifica', methods=['GET', 'POST'])
+@login_required
+@gestore_required
+def pianifica_menu():
+    form = PianificaMenuForm()
+    clona_form = ClonaMenuForm(prefix='clona')
+    if form.validate_on_submit():
+        try:
+            if form.file.data:
+                menu = leggi_menu(io.TextIOWrapper(form.file.data.stream, encoding='utf-8-sig'), 'csv')
+            else:
+                menu = [dict(riga.data, data=riga.giorno.data) for riga in form.righe if riga.primo.data]
+        except (ValueError, csv.Error):
+            flash('File CSV non leggibile.', 'error')
+            return redirect(url_for('pianifica_menu'))
+        try:
+            creati = pianifica(menu, current_user.id)
+            db.session.commit()
+        except PianificazioneNonValida as e:
+            db.session.rollback()
+            for errore in e.errori:
+                flash(errore, 'error')
+            return render_template('gestore/pianifica_menu.html', title='Pianifica Menu', form=form,
+                                   clona_form=clona_form)
+        except Exception:
+            db.session.rollback()
+            flash('Creazione menu non riuscita. Riprovare più tardi.', 'error')
+            return redirect(url_for('pianifica_menu'))
+        menu_cache.invalida()
+        flash(f'{creati} menu creati con successo!', 'success')
+        return redirect(url_for('gestore_menu'))
+    elif request.method == 'GET':
+        # Griglia precompilata con la settimana successiva, da lunedì
+        oggi = date.today()
+        lunedi = oggi + timedelta(days=7 - oggi.weekday())
+        for i, riga in enumerate(form.righe):
+            riga.giorno.data = lunedi + timedelta(days=i)
+    return render_template('gestore/pianifica_menu.html', title='Pianifica Menu', form=form,
+                           clona_form=clona_form)
+
+@app.route('/gestore/menu/clona', methods=['POST'])
+@login_required
+@gestore_required
+def clona_menu():
+    form = ClonaMenuForm(prefix='clona')
+    if not form.validate_on_submit():
+        flash('Indicare le date del periodo da copiare e del nuovo inizio.', 'error')
+        return redirect(url_for('pianifica_menu'))
+    try:
+        creati = clona(current_user.id, form.dal.data, form.al.data, form.inizio.data)
+        db.session.commit()
+    except PianificazioneNonValida as e:
+        db.session.rollback()
+        for errore in e.errori:
+            flash(errore, 'error')
+        return redirect(url_for('pianifica_menu'))
+    except Exception:
+        db.session.rollback()
+        flash('Copia dei menu non riuscita. Riprovare più tardi.', 'error')
+        return redirect(url_for('pianifica_menu'))
+    menu_cache.invalida()
+    flash(f'{creati} menu copiati dal periodo {form.dal.data:%d/%m} - {form.al.data:%d/%m}.', 'success')
+    return redirect(url_for('gestore_menu'))
+
+@app.route('/api/gestore/menu', methods=['POST'])
+@login_required
+@gestore_required
+def api_pianifica_menu():
+    dati = request.get_json(silent=True)
+    menu = dati.get('menu') if isinstance(dati, dict) else dati
+    if not isinstance(menu, list):
+        return jsonify({'error': 'Atteso un elenco di menu'}), 400
+    try:
+        creati = pianifica(menu, current_user.id)
+        db.session.commit()
+    except PianificazioneNonValida as e:
+        db.session.rollback()
+        return jsonify({'error': 'Pianificazione non valida', 'errori': e.errori}), 400
+    except Exception:
+        db.session.rollback()
+        return jsonify({'error': 'Pianificazione non riuscita, riprovare più tardi'}), 500
+    menu_cache.invalida()
+    return jsonify({'creati': creati}), 201
+
 @app.route('/gestore/menu/<int:menu_id>/modifica', methods=['GET', 'POST'])
 @login_required
 @gestore_required
@@ -223,11 +343,16 @@ def modifica_menu(menu_id):
         menu.prezzo = form.prezzo.data
         menu.disponibile = form.disponibile.data
         try:
+            db.session.flush()
+            riallinea_menu(menu.id)
             db.session.commit()
         except Exception:
             db.session.rollback()
             flash('Aggiornamento menu non riuscito. Riprovare più tardi.', 'error')
             return redirect(url_for('modifica_menu', menu_id=menu_id))
+        menu_cache.invalida()
+        # Gli incassi sono stati ricalcolati: le dashboard aperte rileggono lo stato completo
+        broker.pubblica(menu_id, RISINCRONIZZA)
         flash('Menu aggiornato con successo!', 'success')
         return redirect(url_for('gestore_menu'))
     elif request.method == 'GET':
@@ -249,22 +374,108 @@ def visualizza_prenotazioni_menu(menu_id):
     if not menu or menu.gestore_id != current_user.id:
         flash('Menu non trovato.', 'error')
         return redirect(url_for('gestore_menu'))
-    prenotazioni_query = (
-        sa.select(Prenotazione)
-        .where(
-            Prenotazione.menu_id == menu_id,
-            Prenotazione.stato.in_(['confermata', 'pagata'])
-        )
-        .order_by(Prenotazione.orario_ritiro)
-    )
-    prenotazioni = db.session.scalars(prenotazioni_query).all()
+    prenotazioni = db.session.scalars(
+        queries.prenotazioni_menu(menu_id, STATI_CONTEGGIATI)
+    ).all()
     return render_template(
         'gestore/prenotazioni_menu.html',
         title='Prenotazioni Menu',
         menu=menu,
-        prenotazioni=prenotazioni
+        prenotazioni=prenotazioni,
+        statistiche=statistiche_menu(menu_id, STATI_CONTEGGIATI)
     )
 
+@app.route('/gestore/menu/<int:menu_id>/prenotazioni/stream')
+@login_required
+@gestore_required
+def stream_prenotazioni_menu(menu_id):
+    """Server-Sent Events con i conteggi per orario e l'incasso del menu.
+
+    Il primo evento è lo stato completo, poi arrivano solo le variazioni pubblicate
+    dal broker al commit di ogni prenotazione, con il prezzo del menu della loro
+    transazione; quelle già comprese nello stato completo (versione del menu non
+    superiore) vengono scartate. Una modifica del menu fa rileggere lo stato. Nessun thread dedicato per client:
+    ogni stream attende sulla propria coda, e con worker gevent/eventlet le
+    connessioni inattive costano una greenlet ciascuna.
+    """
+    menu = db.session.get(MenuGiornaliero, menu_id)
+    if not menu or menu.gestore_id != current_user.id:
+        abort(404)
+    # Iscrizione prima dello stato completo: gli eventi intermedi sono scartati per versione
+    coda = broker.iscrivi(menu_id)
+
+    def stato_completo():
+        statistiche = statistiche_menu(menu_id, STATI_CONTEGGIATI)
+        return statistiche['versione'], evento_sse('snapshot', statistiche)
+
+    versione, iniziale = stato_completo()
+
+    def genera():
+        nonlocal versione
+        try:
+            yield iniziale
+            while True:
+                try:
+                    evento = coda.get(timeout=app.config['SSE_HEARTBEAT'])
+                except queue.Empty:
+                    yield ': ping\n\n'
+                    continue
+                if evento is RISINCRONIZZA:
+                    with app.app_context():
+                        versione, aggiornato = stato_completo()
+                    yield aggiornato
+                    continue
+                if evento['versione'] is not None and evento['versione'] <= versione:
+                    continue
+                delta = (evento['a'] in STATI_CONTEGGIATI) - (evento['da'] in STATI_CONTEGGIATI)
+                if delta:
+                    yield evento_sse('delta', {'orario': evento['orario'], 'delta': delta,
+                                               'incasso': round(delta * evento['prezzo'], 2)})
+        finally:
+            broker.disiscrivi(menu_id, coda)
+
+    return Response(genera(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/gestore/esporta/prenotazioni.csv')
+@login_required
+@gestore_required
+def esporta_prenotazioni():
+    """CSV delle prenotazioni dei menu del gestore, filtrabile per menu_id e per intervallo dal/al"""
+    try:
+        dal = date.fromisoformat(request.args['dal']) if request.args.get('dal') else None
+        al = date.fromisoformat(request.args['al']) if request.args.get('al') else None
+    except ValueError:
+        abort(400)
+    menu_id = request.args.get('menu_id', type=int)
+    nome = f'prenotazioni-menu-{menu_id}.csv' if menu_id else f'prenotazioni-{dal or "inizio"}-{al or "oggi"}.csv'
+    return risposta_csv(nome, INTESTAZIONE_PRENOTAZIONI,
+                        queries.esporta_prenotazioni(current_user.id, menu_id, dal, al))
+
+@app.route('/gestore/esporta/transazioni.csv')
+@login_required
+@gestore_required
+def esporta_transazioni():
+    """CSV delle transazioni di un mese (parametro mese=AAAA-MM, default il mese corrente)"""
+    try:
+        inizio = datetime.strptime(request.args.get('mese') or f'{date.today():%Y-%m}', '%Y-%m')
+    except ValueError:
+        abort(400)
+    fine = inizio.replace(year=inizio.year + inizio.month // 12, month=inizio.month % 12 + 1)
+    return risposta_csv(f'transazioni-{inizio:%Y-%m}.csv', INTESTAZIONE_TRANSAZIONI,
+                        queries.esporta_transazioni(inizio, fine))
+
+@app.route('/gestore/metrics')
+def metriche():
+    """Metriche del processo in formato Prometheus, per i gestori o con il token dello scraper"""
+    if not app.config['METRICHE_ABILITATE']:
+        abort(404)
+    token = app.config['METRICHE_TOKEN']
+    if not (token and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}')):
+        if not current_user.is_authenticated or not current_user.is_gestore:
+            abort(403)
+    return Response(registro_metriche.esporta(), mimetype='text/plain; version=0.0.4')
+
 # ... (Prenotazioni) ...
 @app.route('/prenota/<int:menu_id>', methods=['GET', 'POST'])
 @login_required
@@ -276,13 +487,7 @@ def prenota(menu_id):
     if menu.data < date.today():
         flash('Non puoi prenotare menu passati.', 'error')
         return redirect(url_for('index'))
-    prenotazione_esistente = db.session.scalar(
-        sa.select(Prenotazione).where(
-            Prenotazione.utente_id == current_user.id,
-            Prenotazione.menu_id == menu_id,
-            Prenotazione.stato.in_(['in_attesa', 'pagata', 'confermata'])
-        )
-    )
+    prenotazione_esistente = db.session.scalar(queries.prenotazione_attiva(current_user.id, menu_id))
     if prenotazione_esistente:
         flash('Hai già una prenotazione per questo menu.', 'info')
         return redirect(url_for('index'))
@@ -297,6 +502,14 @@ def prenota(menu_id):
             stato='in_attesa'
         )
         try:
+            occupato = occupa_posto(menu_id, form.orario_ritiro.data)
+            if not occupato and scadi_prenotazioni():
+                # Slot pieno: prima di rifiutare si liberano i posti delle prenotazioni scadute
+                occupato = occupa_posto(menu_id, form.orario_ritiro.data)
+            if not occupato:
+                db.session.rollback()
+                flash('Posti esauriti per questo orario. Scegline un altro.', 'error')
+                return redirect(url_for('prenota', menu_id=menu_id))
             db.session.add(prenotazione)
             db.session.commit()
         except Exception:
@@ -305,7 +518,23 @@ def prenota(menu_id):
             return redirect(url_for('prenota', menu_id=menu_id))
         flash('Prenotazione effettuata! Procedi al pagamento.', 'success')
         return redirect(url_for('pagamento', prenotazione_id=prenotazione.id))
-    return render_template('prenota.html', title='Prenota Pasto', form=form, menu=menu)
+    posti = posti_per_slot(menu_id, [orario for orario, _ in form.orario_ritiro.choices])
+    return render_template('prenota.html', title='Prenota Pasto', form=form, menu=menu, posti=posti)
+
+@app.route('/api/menu/<int:menu_id>/disponibilita')
+def disponibilita(menu_id):
+    posti = disponibilita_menu(menu_id, ORARI_PRENOTABILI)
+    if posti is None:
+        return jsonify({'error': 'Menu non disponibile'}), 404
+    # ETag calcolato dai soli contatori: se nulla è cambiato si risponde 304 senza corpo
+    etag = md5(repr(sorted(posti.items())).encode()).hexdigest()
+    if request.if_none_match.contains(etag):
+        risposta = app.response_class(status=304)
+    else:
+        risposta = jsonify({'menu_id': menu_id, 'capienza': capienza_slot(), 'posti': posti})
+    risposta.set_etag(etag)
+    risposta.headers['Cache-Control'] = 'no-cache'
+    return risposta
 
 @app.route('/prenotazione/<int:prenotazione_id>/cancella', methods=['POST'])
 @login_required
@@ -321,6 +550,9 @@ def cancella_prenotazione(prenotazione_id):
         flash('Non puoi cancellare una prenotazione già pagata.', 'error')
         return redirect(url_for('profilo'))
     try:
+        # Una prenotazione scaduta ha già restituito il posto allo slot
+        if prenotazione.stato in STATI_OCCUPANTI:
+            libera_posto(prenotazione.menu_id, prenotazione.orario_ritiro)
         prenotazione.cancella()
         db.session.commit()
     except Exception:
@@ -332,23 +564,6 @@ def cancella_prenotazione(prenotazione_id):
 
 # --- NUOVA IMPLEMENTAZIONE PAYPAL ---
 
-# Helper per Token PayPal
-def get_paypal_token():
-    client_id = app.config['PAYPAL_CLIENT_ID']
-    client_secret = app.config['PAYPAL_CLIENT_SECRET']
-    url = f"{app.config['PAYPAL_API_BASE']}/v1/oauth2/token"
-    headers = {
-        "Accept": "application/json",
-        "Accept-Language": "en_US",
-    }
-    data = {"grant_type": "client_credentials"}
-    try:
-        response = requests.post(url, auth=(client_id, client_secret), headers=headers, data=data)
-        return response.json().get('access_token')
-    except Exception as e:
-        app.logger.error(f"Errore Token PayPal: {e}")
-        return None
-
 @app.route('/pagamento/<int:prenotazione_id>')
 @login_required
 def pagamento(prenotazione_id):
@@ -368,68 +583,45 @@ def create_payment(prenotazione_id):
     prenotazione = db.session.get(Prenotazione, prenotazione_id)
     if not prenotazione or prenotazione.utente_id != current_user.id:
         return jsonify({'error': 'Prenotazione non valida'}), 404
+    if prenotazione.stato != 'in_attesa':
+        return jsonify({'error': 'La prenotazione non è in attesa di pagamento'}), 409
 
-    token = get_paypal_token()
-    if not token:
-        return jsonify({'error': 'Errore configurazione PayPal'}), 500
-
-    url = f"{app.config['PAYPAL_API_BASE']}/v2/checkout/orders"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {token}"
-    }
-    
     # Payload ordine
+    importo = prenotazione.menu.prezzo
     payload = {
         "intent": "CAPTURE",
         "purchase_units": [{
             "amount": {
                 "currency_code": "EUR",
-                "value": f"{prenotazione.menu.prezzo:.2f}"
+                "value": f"{importo:.2f}"
             },
             "description": f"Menu del {prenotazione.menu.data} - SpeedMensa"
         }]
     }
+    # Restituisce la connessione al pool prima della chiamata a PayPal
+    db.session.commit()
     
-    response = requests.post(url, headers=headers, json=payload)
-    return jsonify(response.json())
+    try:
+        ordine = get_paypal_client().create_order(payload)
+    except requests.RequestException as e:
+        app.logger.error(f"Errore creazione ordine PayPal: {e}")
+        return jsonify({'error': 'Errore configurazione PayPal'}), 500
+    if ordine.get('id'):
+        registra_ordine(prenotazione_id, current_user.id, importo, ordine['id'])
+    return jsonify(ordine)
 
 @app.route('/api/payment/execute/<int:prenotazione_id>', methods=['POST'])
 @login_required
 def execute_payment(prenotazione_id):
-    data = request.json
-    order_id = data.get('orderID')
-    
-    token = get_paypal_token()
-    url = f"{app.config['PAYPAL_API_BASE']}/v2/checkout/orders/{order_id}/capture"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {token}"
-    }
-    
-    response = requests.post(url, headers=headers)
-    result = response.json()
-    
-    if result.get('status') == 'COMPLETED':
-        prenotazione = db.session.get(Prenotazione, prenotazione_id)
-        
-        # Crea Transazione
-        transazione = Transazione(
-            utente_id=current_user.id,
-            prenotazione_id=prenotazione.id,
-            tipo='pagamento_pasto',
-            importo=prenotazione.menu.prezzo,
-            metodo_pagamento='PayPal',
-            stato='completata',
-            paypal_order_id=order_id
-        )
-        
-        # Aggiorna Prenotazione
-        prenotazione.conferma_pagamento()
-        
-        db.session.add(transazione)
-        db.session.commit()
-        
+    prenotazione = db.session.get(Prenotazione, prenotazione_id)
+    if not prenotazione or prenotazione.utente_id != current_user.id:
+        return jsonify({'status': 'failed', 'msg': 'Prenotazione non valida'}), 404
+    order_id = (request.get_json(silent=True) or {}).get('orderID')
+    if not order_id:
+        return jsonify({'status': 'failed', 'msg': 'Ordine PayPal mancante'}), 400
+
+    risposta, codice, eseguito = esegui_pagamento(prenotazione, order_id)
+    if eseguito:
         flash('Pagamento completato con successo!', 'success')
         
         # Invia email conferma (opzionale)
@@ -438,9 +630,7 @@ def execute_payment(prenotazione_id):
         except:
             pass # Non blocchiamo se l'email fallisce
             
-        return jsonify({'status': 'success'})
-    else:
-        return jsonify({'status': 'failed', 'msg': 'Pagamento non completato'})
+    return jsonify(risposta), codice
 
 # --- FINE PAYPAL ---
 
@@ -3,6 +3,7 @@ document.addEventListener('DOMContentLoaded', () => {
     initForms();
     initInteractions();
     checkConnection();
+    initDisponibilita();
 });
 
 
@@ -131,6 +132,54 @@ function checkConnection() {
     window.addEventListener('online', () => showNotification('Tornato online', 'success'));
 }
 
+// Aggiornamento dei posti liberi nella pagina di prenotazione.
+// Il server risponde 304 finché i contatori non cambiano: in quel caso
+// l'intervallo di polling si allunga, e torna breve appena arriva una variazione.
+function initDisponibilita() {
+    const lista = document.querySelector('.posti-slot[data-url]');
+    if (!lista) return;
+
+    const MIN_ATTESA = 3000;
+    const MAX_ATTESA = 30000;
+    let attesa = MIN_ATTESA;
+    let etag = null;
+
+    const aggiorna = (posti) => {
+        const select = document.querySelector('select[name="orario_ritiro"]');
+        Object.entries(posti).forEach(([orario, liberi]) => {
+            const voce = lista.querySelector(`[data-orario="${orario}"] .posti-liberi`);
+            if (voce) voce.textContent = liberi;
+            const opzione = select && select.querySelector(`option[value="${orario}"]`);
+            if (opzione) opzione.disabled = liberi === 0;
+        });
+    };
+
+    const poll = async () => {
+        if (document.hidden) {
+            setTimeout(poll, attesa);
+            return;
+        }
+        try {
+            const headers = etag ? { 'If-None-Match': etag } : {};
+            const response = await fetch(lista.dataset.url, { headers, cache: 'no-store' });
+            if (response.status === 200) {
+                etag = response.headers.get('ETag');
+                aggiorna((await response.json()).posti);
+                attesa = MIN_ATTESA;
+            } else if (response.status === 304) {
+                attesa = Math.min(attesa * 1.5, MAX_ATTESA);
+            } else {
+                attesa = Math.min(attesa * 2, MAX_ATTESA);
+            }
+        } catch (e) {
+            attesa = Math.min(attesa * 2, MAX_ATTESA);
+        }
+        setTimeout(poll, attesa);
+    };
+
+    setTimeout(poll, attesa);
+}
+
 // Export funzioni globali se servono nell'HTML (es. onclick="SpeedMensa.toggleDarkMode()")
 window.SpeedMensa = {
     toggleDarkMode,
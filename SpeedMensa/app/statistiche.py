@@ -0,0 +1,161 @@
+from collections import Counter
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+from sqlalchemy.dialects import postgresql, sqlite
+from app import db
+from app.models import MenuGiornaliero, Prenotazione, StatisticheGiornaliere
+from app.eventi import transizioni_flush, accoda_transizioni
+
+_COLONNE = ['menu_id', 'orario_ritiro', 'stato', 'data', 'prenotazioni', 'incasso']
+
+
+def _incrementa(conn, menu_id, orario, stato, delta):
+    """Somma `delta` prenotazioni (e il relativo incasso) alla riga aggregata, creandola se manca"""
+    tabella = StatisticheGiornaliere.__table__
+    valori = (
+        sa.select(MenuGiornaliero.id, sa.literal(orario), sa.literal(stato), MenuGiornaliero.data,
+                  sa.literal(delta), MenuGiornaliero.prezzo * delta)
+        .where(MenuGiornaliero.id == menu_id)
+    )
+    dialetto = conn.dialect.name
+    if dialetto in ('sqlite', 'postgresql'):
+        insert = (sqlite if dialetto == 'sqlite' else postgresql).insert(tabella)
+        stmt = insert.from_select(_COLONNE, valori).on_conflict_do_update(
+            index_elements=['menu_id', 'orario_ritiro', 'stato'],
+            set_={'prenotazioni': tabella.c.prenotazioni + insert.excluded.prenotazioni,
+                  'incasso': tabella.c.incasso + insert.excluded.incasso}
+        )
+        conn.execute(stmt)
+        return
+    prezzo = conn.scalar(sa.select(MenuGiornaliero.prezzo).where(MenuGiornaliero.id == menu_id))
+    aggiornate = conn.execute(
+        sa.update(tabella)
+        .where(tabella.c.menu_id == menu_id, tabella.c.orario_ritiro == orario, tabella.c.stato == stato)
+        .values(prenotazioni=tabella.c.prenotazioni + delta, incasso=tabella.c.incasso + prezzo * delta)
+    ).rowcount
+    if not aggiornate:
+        conn.execute(sa.insert(tabella).from_select(_COLONNE, valori))
+
+def registra_transizioni(conn, transizioni):
+    """Applica agli aggregati una lista di transizioni (menu_id, orario, da, a).
+
+    Restituisce le transizioni completate con la nuova versione del menu e il
+    prezzo usato per l'incasso, (menu_id, orario, da, a, versione, prezzo):
+    chi legge gli aggregati insieme alla versione sa quali eventi vi sono già
+    compresi.
+    """
+    variazioni = Counter()
+    for menu_id, orario, da, a in transizioni:
+        if da is not None:
+            variazioni[(menu_id, orario, da)] -= 1
+        if a is not None:
+            variazioni[(menu_id, orario, a)] += 1
+    for (menu_id, orario, stato), delta in sorted(variazioni.items()):
+        if delta:
+            _incrementa(conn, menu_id, orario, stato, delta)
+    menu = MenuGiornaliero.__table__
+    versioni = {}
+    # In ordine di id, come gli aggregati, per non creare deadlock tra transazioni
+    for menu_id in sorted({transizione[0] for transizione in transizioni}):
+        riga = conn.execute(
+            sa.update(menu).where(menu.c.id == menu_id)
+            .values(versione_prenotazioni=menu.c.versione_prenotazioni + 1)
+            .returning(menu.c.versione_prenotazioni, menu.c.prezzo)
+        ).first()
+        # SQLite restituisce con RETURNING i prezzi interi come int
+        versioni[menu_id] = (riga.versione_prenotazioni, float(riga.prezzo)) if riga else (None, None)
+    return [(*transizione, *versioni[transizione[0]]) for transizione in transizioni]
+
+
+def applica_transizioni(session, transizioni):
+    """Per gli UPDATE diretti, che non passano dagli eventi ORM: aggiorna gli aggregati e pubblica al commit"""
+    accoda_transizioni(session, registra_transizioni(session.connection(), transizioni))
+
+
+@sa.event.listens_for(so.Session, 'after_flush')
+def _aggiorna_statistiche(session, flush_context):
+    transizioni = transizioni_flush(session)
+    if transizioni:
+        applica_transizioni(session, transizioni)
+
+
+def _riconteggio():
+    """Aggregati calcolati da zero sulle prenotazioni"""
+    numero = sa.func.count(Prenotazione.id)
+    return (
+        sa.select(Prenotazione.menu_id, Prenotazione.orario_ritiro, Prenotazione.stato,
+                  MenuGiornaliero.data, numero, numero * MenuGiornaliero.prezzo)
+        .join(Prenotazione.menu)
+        .group_by(Prenotazione.menu_id, Prenotazione.orario_ritiro, Prenotazione.stato,
+                  MenuGiornaliero.data, MenuGiornaliero.prezzo)
+    )
+
+def ricostruisci():
+    """Rigenera tutta la tabella degli aggregati con due statement"""
+    conn = db.session.connection()
+    conn.execute(sa.delete(StatisticheGiornaliere))
+    conn.execute(sa.insert(StatisticheGiornaliere).from_select(_COLONNE, _riconteggio()))
+
+def riallinea_menu(menu_id):
+    """Riporta data e incasso degli aggregati di un menu ai valori attuali del menu.
+
+    Gli aggregati copiano data e prezzo del menu al momento di ogni
+    transizione: dopo una modifica del menu vanno riallineati nella stessa
+    transazione, dopo il flush della modifica.
+    """
+    tabella = StatisticheGiornaliere.__table__
+    menu = sa.select(MenuGiornaliero.data, MenuGiornaliero.prezzo).where(MenuGiornaliero.id == menu_id).subquery()
+    db.session.connection().execute(
+        sa.update(tabella).where(tabella.c.menu_id == menu_id)
+        .values(data=sa.select(menu.c.data).scalar_subquery(),
+                incasso=tabella.c.prenotazioni * sa.select(menu.c.prezzo).scalar_subquery())
+    )
+
+def verifica():
+    """Confronta gli aggregati con un riconteggio completo e restituisce le differenze"""
+    attesi = {tuple(r[:3]): (r[4], round(r[5], 2)) for r in db.session.execute(_riconteggio())}
+    trovati = {
+        (s.menu_id, s.orario_ritiro, s.stato): (s.prenotazioni, round(s.incasso, 2))
+        for s in db.session.scalars(sa.select(StatisticheGiornaliere))
+        if s.prenotazioni
+    }
+    return [
+        (chiave, attesi.get(chiave), trovati.get(chiave))
+        for chiave in sorted(attesi.keys() | trovati.keys())
+        if attesi.get(chiave) != trovati.get(chiave)
+    ]
+
+
+def statistiche_menu(menu_id, stati):
+    """Prenotazioni per orario, totale e incasso di un menu, letti dagli aggregati.
+
+    `versione` è la versione del menu letta nello stesso statement: gli eventi
+    del broker con versione non superiore sono già compresi nei conteggi.
+    """
+    righe = db.session.execute(
+        sa.select(MenuGiornaliero.versione_prenotazioni, StatisticheGiornaliere.orario_ritiro,
+                  sa.func.sum(StatisticheGiornaliere.prenotazioni),
+                  sa.func.sum(StatisticheGiornaliere.incasso))
+        .select_from(MenuGiornaliero)
+        .outerjoin(StatisticheGiornaliere, sa.and_(StatisticheGiornaliere.menu_id == MenuGiornaliero.id,
+                                                   StatisticheGiornaliere.stato.in_(stati)))
+        .where(MenuGiornaliero.id == menu_id)
+        .group_by(MenuGiornaliero.versione_prenotazioni, StatisticheGiornaliere.orario_ritiro)
+    ).all()
+    slot = {orario: numero for _, orario, numero, _ in righe if numero}
+    return {'slot': slot, 'totale': sum(slot.values()),
+            'incasso': round(sum(incasso or 0 for *_, incasso in righe), 2),
+            'versione': righe[0][0] if righe else 0}
+
+def riepilogo_menu(menu_ids, stati):
+    """Prenotazioni e incasso per ciascun menu indicato: {menu_id: (prenotazioni, incasso)}"""
+    if not menu_ids:
+        return {}
+    righe = db.session.execute(
+        sa.select(StatisticheGiornaliere.menu_id,
+                  sa.func.sum(StatisticheGiornaliere.prenotazioni),
+                  sa.func.sum(StatisticheGiornaliere.incasso))
+        .where(StatisticheGiornaliere.menu_id.in_(menu_ids), StatisticheGiornaliere.stato.in_(stati))
+        .group_by(StatisticheGiornaliere.menu_id)
+    ).all()
+    return {menu_id: (numero, round(incasso, 2)) for menu_id, numero, incasso in righe}
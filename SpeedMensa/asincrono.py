@@ -0,0 +1,28 @@
+"""Avvio non bloccante con gevent.
+
+Le chiamate di rete (PayPal, SMTP, stream SSE) cedono il controllo invece di
+occupare un worker per tutta l'attesa: le richieste concorrenti crescono con
+l'I/O e non con il numero di processi. Con molte richieste contemporanee
+conviene alzare PAYPAL_POOL_SIZE.
+
+    python asincrono.py --porta 5000
+    gunicorn -k gevent -w 2 asincrono:app
+"""
+from gevent import monkey
+monkey.patch_all()
+
+import argparse
+from gevent.pywsgi import WSGIServer
+from speedmensa import app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--porta', type=int, default=5000)
+    args = parser.parse_args()
+    WSGIServer((args.host, args.porta), app).serve_forever()
+
+
+if __name__ == '__main__':
+    main()
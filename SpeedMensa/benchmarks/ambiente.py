@@ -0,0 +1,97 @@
+"""Configurazione comune ai benchmark.
+
+Va importato prima di `app`: punta l'applicazione a un database SQLite
+temporaneo (se DATABASE_URL non è già impostata) e disattiva l'invio email.
+"""
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from time import perf_counter
+import requests
+
+CARTELLA = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(CARTELLA))
+if 'DATABASE_URL' not in os.environ:
+    _fd, DB_PATH = tempfile.mkstemp(suffix='.db')
+    os.close(_fd)
+    os.environ['DATABASE_URL'] = 'sqlite:///' + DB_PATH
+os.environ.setdefault('MAIL_SERVER', '')
+
+import sqlalchemy as sa
+from werkzeug.security import generate_password_hash
+from app import app, db
+from app.models import User, MenuGiornaliero
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.extensions['mail'].suppress = True
+PASSWORD = 'password'
+
+
+def prepara_db():
+    db.drop_all()
+    db.create_all()
+
+def crea_utenti(n, prefisso='studente', is_gestore=False):
+    """Inserisce `n` utenti con la stessa password, calcolando l'hash una sola volta"""
+    password_hash = generate_password_hash(PASSWORD)
+    db.session.execute(sa.insert(User), [
+        {'username': f'{prefisso}{i}', 'email': f'{prefisso}{i}@studenti.uniparthenope.it',
+         'password_hash': password_hash, 'nome': prefisso.capitalize(), 'cognome': str(i),
+         'matricola': f'{prefisso[:3].upper()}{i:06d}', 'is_gestore': is_gestore}
+        for i in range(n)
+    ])
+    db.session.commit()
+    return db.session.scalars(sa.select(User.id).where(User.username.like(f'{prefisso}%'))).all()
+
+def crea_menu(n, gestore_id, dal=None):
+    dal = dal or date.today()
+    db.session.execute(sa.insert(MenuGiornaliero), [
+        {'data': dal + timedelta(days=i), 'primo': f'Primo {i}', 'secondo': f'Secondo {i}',
+         'contorno': 'Insalata', 'prezzo': 5.0, 'disponibile': True, 'gestore_id': gestore_id}
+        for i in range(n)
+    ])
+    db.session.commit()
+    return db.session.scalars(sa.select(MenuGiornaliero.id).order_by(MenuGiornaliero.data)).all()
+
+def cronometra(funzione, ripetizioni):
+    """Esegue `funzione` più volte e restituisce le durate in millisecondi"""
+    durate = []
+    for _ in range(ripetizioni):
+        inizio = perf_counter()
+        funzione()
+        durate.append((perf_counter() - inizio) * 1000)
+    return durate
+
+def percentile(valori, p):
+    ordinati = sorted(valori)
+    return ordinati[min(int(len(ordinati) * p / 100), len(ordinati) - 1)]
+
+def riepilogo(nome, durate, **extra):
+    totale = sum(durate) / 1000
+    righe = [f'{nome:<20}', f'p50 {statistics.median(durate):8.2f} ms',
+             f'p99 {percentile(durate, 99):8.2f} ms',
+             f'{len(durate) / totale if totale else 0:9.1f} req/s']
+    righe += [f'{chiave} {valore}' for chiave, valore in extra.items()]
+    print('  '.join(righe))
+
+def avvia_server(modo, workers, paypal):
+    """Avvia servi.py su una porta libera e ne attende l'avvio: (processo, URL base)"""
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        porta = s.getsockname()[1]
+    processo = subprocess.Popen([sys.executable, os.path.join(CARTELLA, 'servi.py'), '--modo', modo,
+                                 '--workers', str(workers), '--porta', str(porta), '--paypal', paypal])
+    base = f'http://127.0.0.1:{porta}'
+    for _ in range(100):
+        try:
+            requests.get(f'{base}/login', timeout=1)
+            return processo, base
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    processo.kill()
+    raise RuntimeError(f'server {modo} non avviato')
@@ -0,0 +1,90 @@
+"""Checkout concorrenti (creazione + cattura ordine) con worker sincroni e con gevent.
+
+    python benchmarks/bench_checkout.py --clienti 64 --checkout 512 --latenza 0.2 --workers 8
+
+Ogni client è uno studente autenticato che paga le proprie prenotazioni in
+sequenza; PayPal è il server finto con latenza iniettata.
+"""
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+import requests
+import sqlalchemy as sa
+from ambiente import app, db, prepara_db, crea_utenti, crea_menu, riepilogo, avvia_server, PASSWORD
+from app.models import User, Prenotazione
+from paypal_stub import FakePayPal
+
+
+def prepara(clienti, checkout):
+    """Utenti e prenotazioni in attesa di pagamento: {username: [prenotazione_id, ...]}"""
+    with app.app_context():
+        prepara_db()
+        gestore_id = crea_utenti(1, prefisso='gestore', is_gestore=True)[0]
+        menu_ids = crea_menu(checkout // clienti + 1, gestore_id)
+        utenti = crea_utenti(clienti)
+        db.session.execute(sa.insert(Prenotazione), [
+            {'utente_id': utente_id, 'menu_id': menu_ids[i // clienti],
+             'orario_ritiro': '12:00', 'stato': 'in_attesa'}
+            for i, utente_id in zip(range(checkout), utenti * (checkout // clienti + 1))
+        ])
+        db.session.commit()
+        righe = db.session.execute(
+            sa.select(User.username, Prenotazione.id).join(Prenotazione.utente).order_by(Prenotazione.id)
+        ).all()
+    piano = {}
+    for username, prenotazione_id in righe:
+        piano.setdefault(username, []).append(prenotazione_id)
+    return piano
+
+
+def esegui(base, piano):
+    """Un thread per client; restituisce le durate dei checkout e il tempo totale"""
+    durate, errori = [], []
+    lock = threading.Lock()
+    partenza = threading.Barrier(len(piano))
+
+    def cliente(username, prenotazioni):
+        with requests.Session() as sessione:
+            sessione.post(f'{base}/login', data={'username': username, 'password': PASSWORD})
+            partenza.wait()
+            for prenotazione_id in prenotazioni:
+                inizio = perf_counter()
+                ordine = sessione.post(f'{base}/api/payment/create/{prenotazione_id}').json()
+                esito = sessione.post(f'{base}/api/payment/execute/{prenotazione_id}',
+                                      json={'orderID': ordine.get('id')}).json()
+                with lock:
+                    durate.append((perf_counter() - inizio) * 1000)
+                    if esito.get('status') != 'success':
+                        errori.append(esito)
+
+    inizio = perf_counter()
+    with ThreadPoolExecutor(max_workers=len(piano)) as executor:
+        for futuro in [executor.submit(cliente, u, p) for u, p in piano.items()]:
+            futuro.result()
+    return durate, errori, perf_counter() - inizio
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clienti', type=int, default=64)
+    parser.add_argument('--checkout', type=int, default=512)
+    parser.add_argument('--latenza', type=float, default=0.2, help='latenza PayPal simulata in secondi')
+    parser.add_argument('--workers', type=int, default=8, help='worker del server sincrono')
+    args = parser.parse_args()
+
+    with FakePayPal(latenza=args.latenza) as stub:
+        for modo in ('sync', 'gevent'):
+            piano = prepara(args.clienti, args.checkout)
+            processo, base = avvia_server(modo, args.workers, stub.url)
+            try:
+                durate, errori, totale = esegui(base, piano)
+            finally:
+                processo.terminate()
+                processo.wait()
+            nome = f'{modo} ({args.workers} worker)' if modo == 'sync' else modo
+            riepilogo(nome, durate, throughput=f'{len(durate) / totale:.1f}/s', errori=len(errori))
+
+
+if __name__ == '__main__':
+    main()
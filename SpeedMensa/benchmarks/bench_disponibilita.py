@@ -0,0 +1,38 @@
+"""Richieste al secondo sull'API dei posti liberi, con e senza If-None-Match.
+
+    python benchmarks/bench_disponibilita.py --richieste 5000
+"""
+import argparse
+from ambiente import app, db, prepara_db, crea_utenti, crea_menu, cronometra, riepilogo
+from app.capacita import occupa_posto
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--richieste', type=int, default=5000)
+    args = parser.parse_args()
+
+    with app.app_context():
+        prepara_db()
+        gestore_id = crea_utenti(1, prefisso='gestore', is_gestore=True)[0]
+        menu_id = crea_menu(1, gestore_id)[0]
+        for orario in ('12:00', '12:30', '13:00'):
+            for _ in range(20):
+                occupa_posto(menu_id, orario)
+        db.session.commit()
+
+    client = app.test_client()
+    url = f'/api/menu/{menu_id}/disponibilita'
+    etag = client.get(url).headers['ETag']
+    stati = {}
+
+    def condizionale():
+        stato = client.get(url, headers={'If-None-Match': etag}).status_code
+        stati[stato] = stati.get(stato, 0) + 1
+
+    riepilogo('GET completa', cronometra(lambda: client.get(url), args.richieste))
+    riepilogo('GET condizionale', cronometra(condizionale, args.richieste), **{'304': stati.get(304, 0)})
+
+
+if __name__ == '__main__':
+    main()
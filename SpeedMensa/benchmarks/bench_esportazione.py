@@ -0,0 +1,119 @@
+"""Export CSV di un milione di righe: tempo, dimensione e picco di memoria.
+
+    python benchmarks/bench_esportazione.py --righe 1000000
+
+Il database sintetico (prenotazioni su 1000 menu, transazioni tutte nello
+stesso mese) viene creato una volta; ogni export gira poi in un processo
+separato, così il picco RSS riportato è quello del solo export. L'ultima
+riga è il confronto con la lettura di tutte le righe in memoria prima di
+scrivere il CSV.
+
+Con il profilo SQLite 'produzione' l'RSS comprende anche le pagine del file
+lette tramite mmap (al più mmap_size, 128 MB) e la cache delle pagine: un
+tetto fisso, indipendente dal numero di righe. DB_PROFILO=predefinito le
+esclude e mostra solo la memoria dell'export.
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+from datetime import date, datetime, timedelta
+from time import perf_counter
+
+MENU = 1000
+UTENTI = 1000
+MESE = datetime(2026, 3, 1)
+
+
+def popola(righe):
+    import sqlalchemy as sa
+    from ambiente import app, db, prepara_db, crea_utenti, crea_menu
+    from app.models import Prenotazione, Transazione
+
+    orari = app.config['ORARI_RITIRO']
+    with app.app_context():
+        prepara_db()
+        gestore_id = crea_utenti(1, prefisso='gestore', is_gestore=True)[0]
+        utenti = crea_utenti(UTENTI)
+        menu_ids = crea_menu(MENU, gestore_id, dal=date.today() - timedelta(days=MENU))
+        adesso = datetime.now()
+        for inizio in range(0, righe, 50000):
+            indici = range(inizio, min(inizio + 50000, righe))
+            db.session.execute(sa.insert(Prenotazione), [
+                {'id': i + 1, 'utente_id': utenti[i % UTENTI], 'menu_id': menu_ids[i * MENU // righe],
+                 'orario_ritiro': orari[i % len(orari)], 'stato': 'pagata', 'note': f'nota {i}' if i % 7 == 0 else None,
+                 'created_at': adesso, 'updated_at': adesso}
+                for i in indici
+            ])
+            db.session.execute(sa.insert(Transazione), [
+                {'utente_id': utenti[i % UTENTI], 'prenotazione_id': i + 1, 'tipo': 'pagamento_pasto',
+                 'importo': 5.0, 'metodo_pagamento': 'paypal', 'stato': 'completata',
+                 'paypal_order_id': f'ORDINE{i:09d}', 'created_at': MESE + timedelta(seconds=i % (28 * 86400))}
+                for i in indici
+            ])
+            db.session.commit()
+
+
+def esporta(nome, url):
+    from ambiente import app, db, PASSWORD
+    from app import queries
+    from app.esportazione import csv_a_blocchi, INTESTAZIONE_PRENOTAZIONI
+
+    client = app.test_client()
+    client.post('/login', data={'username': 'gestore0', 'password': PASSWORD})
+    iniziale = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    inizio = perf_counter()
+    byte = 0
+    if url == 'in-memoria':
+        with app.app_context():
+            righe = db.session.execute(queries.esporta_prenotazioni(1)).all()
+            byte = len(b''.join(csv_a_blocchi(INTESTAZIONE_PRENOTAZIONI, righe, blocco=len(righe) + 1)))
+    else:
+        risposta = client.get(url)
+        for pezzo in risposta.iter_encoded():
+            byte += len(pezzo)
+        risposta.close()
+    durata = perf_counter() - inizio
+    picco = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f'{nome:<28} {durata:6.1f} s  {byte / 2 ** 20:7.1f} MB di CSV  '
+          f'RSS max {picco:6.0f} MB (+{picco - iniziale:.0f} MB durante l\'export)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--righe', type=int, default=1000000)
+    parser.add_argument('--popola', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--esegui', nargs=2, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.popola:
+        popola(args.righe)
+        return
+    if args.esegui:
+        esporta(*args.esegui)
+        return
+    _fd, percorso = tempfile.mkstemp(suffix='.db')
+    os.close(_fd)
+    ambiente = dict(os.environ, DATABASE_URL='sqlite:///' + percorso)
+    try:
+        inizio = perf_counter()
+        subprocess.run([sys.executable, __file__, '--righe', str(args.righe), '--popola'], env=ambiente, check=True)
+        print(f'database con {args.righe} prenotazioni e transazioni in {perf_counter() - inizio:.0f} s')
+        dal = (date.today() - timedelta(days=MENU // 10)).isoformat()
+        for nome, url in (
+            (f'prenotazioni, dal {dal}', f'/gestore/esporta/prenotazioni.csv?dal={dal}'),
+            ('prenotazioni, tutte', '/gestore/esporta/prenotazioni.csv'),
+            (f'transazioni, {MESE:%Y-%m}', f'/gestore/esporta/transazioni.csv?mese={MESE:%Y-%m}'),
+            ('prenotazioni, in memoria', 'in-memoria'),
+        ):
+            subprocess.run([sys.executable, __file__, '--esegui', nome, url], env=ambiente, check=True)
+    finally:
+        for file in (percorso, percorso + '-wal', percorso + '-shm'):
+            if os.path.exists(file):
+                os.remove(file)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""Import degli utenti da CSV: righe al secondo e memoria, a confronto con un commit per utente.
+
+    python benchmarks/bench_importazione.py --righe 100000 --esistenti 20000
+
+Il CSV generato contiene un 5% di matricole già registrate. Il confronto è con
+l'inserimento di un utente alla volta tramite ORM, come fa la registrazione
+(senza hash della password in entrambi i casi). La memoria riportata è il
+picco RSS del processo figlio che esegue l'import.
+"""
+import argparse
+import csv
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+from time import perf_counter
+from ambiente import app, db, prepara_db, crea_utenti
+from app.importazione import importa_utenti
+from app.models import User
+
+
+def genera_csv(percorso, righe, esistenti):
+    with open(percorso, 'w', newline='', encoding='utf-8') as file:
+        scrittore = csv.writer(file)
+        scrittore.writerow(['matricola', 'nome', 'cognome', 'email'])
+        for i in range(righe):
+            # Le matricole di crea_utenti sono STU000000, STU000001, ...
+            matricola = f'STU{i % esistenti:06d}' if i % 20 == 0 else f'N{i:08d}'
+            scrittore.writerow([matricola, 'Matricola', str(i), f'{matricola.lower()}@studenti.uniparthenope.it'])
+
+
+def importa(percorso, blocco, esistenti):
+    """Eseguito in un processo figlio: il picco RSS è quello del solo import"""
+    with app.app_context():
+        prepara_db()
+        crea_utenti(esistenti)
+        inizio = perf_counter()
+        with open(percorso, encoding='utf-8') as file:
+            esiti = importa_utenti(file, blocco)
+        durata = perf_counter() - inizio
+    picco = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f'blocco {blocco:<14}  {esiti["lette"] / durata:9.0f} righe/s  '
+          f'creati {esiti["inserite"]}  saltati {esiti["duplicate"]}  RSS max {picco:.0f} MB')
+
+
+def uno_alla_volta(righe, esistenti):
+    with app.app_context():
+        prepara_db()
+        crea_utenti(esistenti)
+        inizio = perf_counter()
+        for i in range(righe):
+            db.session.add(User(username=f'N{i:08d}', email=f'n{i:08d}@studenti.uniparthenope.it',
+                                nome='Matricola', cognome=str(i), matricola=f'N{i:08d}'))
+            db.session.commit()
+        durata = perf_counter() - inizio
+    print(f'{"un commit per utente":<20}  {righe / durata:9.0f} righe/s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--righe', type=int, default=100000)
+    parser.add_argument('--esistenti', type=int, default=20000)
+    parser.add_argument('--blocco', type=int, default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--csv', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.blocco:
+        importa(args.csv, args.blocco, args.esistenti)
+        return
+
+    uno_alla_volta(min(args.righe, 2000), args.esistenti)
+    with tempfile.TemporaryDirectory() as cartella:
+        percorso = os.path.join(cartella, 'immatricolazioni.csv')
+        genera_csv(percorso, args.righe, args.esistenti)
+        for blocco in (100, 1000, 5000):
+            subprocess.run([sys.executable, __file__, '--righe', str(args.righe), '--esistenti',
+                            str(args.esistenti), '--blocco', str(blocco), '--csv', percorso], check=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""Login al secondo per core con i vari profili di hash, e risposta dell'app durante un'ondata di login.
+
+    python benchmarks/bench_login.py --login 200 --concorrenti 16 --processi 1
+
+Prima parte: login sequenziali (POST /login) per profilo, cioè login al secondo
+per core. Seconda parte: `--concorrenti` thread fanno login mentre un altro
+thread misura la latenza dell'API di disponibilità, con la verifica nel thread
+della richiesta e con il pool di `--processi` processi.
+"""
+import argparse
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+import sqlalchemy as sa
+from ambiente import app, db, prepara_db, crea_utenti, crea_menu, cronometra, riepilogo, PASSWORD
+from app.models import User
+from app.password import PROFILI_HASH, genera_hash
+
+
+def prepara(profilo, utenti):
+    app.config['PASSWORD_PROFILO'] = profilo
+    with app.app_context():
+        prepara_db()
+        gestore_id = crea_utenti(1, prefisso='gestore', is_gestore=True)[0]
+        menu_id = crea_menu(1, gestore_id)[0]
+        crea_utenti(utenti)
+        db.session.execute(sa.update(User).values(password_hash=genera_hash(PASSWORD)))
+        db.session.commit()
+    return menu_id
+
+
+def login(i):
+    with app.test_client() as client:
+        risposta = client.post('/login', data={'username': f'studente{i % 100}', 'password': PASSWORD})
+    assert risposta.status_code == 302
+
+
+def ondata(concorrenti, n, menu_id):
+    """Login concorrenti con una sonda sull'API di disponibilità; durate della sonda e login/s"""
+    finito = threading.Event()
+    sonda = []
+
+    def misura_sonda():
+        with app.test_client() as client:
+            while not finito.wait(0.01):
+                inizio = perf_counter()
+                client.get(f'/api/menu/{menu_id}/disponibilita')
+                sonda.append((perf_counter() - inizio) * 1000)
+
+    thread = threading.Thread(target=misura_sonda)
+    thread.start()
+    inizio = perf_counter()
+    with ThreadPoolExecutor(max_workers=concorrenti) as executor:
+        list(executor.map(login, range(n)))
+    durata = perf_counter() - inizio
+    finito.set()
+    thread.join()
+    return sonda, n / durata
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--login', type=int, default=200)
+    parser.add_argument('--concorrenti', type=int, default=16)
+    parser.add_argument('--processi', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    for profilo in PROFILI_HASH:
+        prepara(profilo, 100)
+        riepilogo(profilo, cronometra(lambda: login(0), args.login // 4))
+
+    menu_id = prepara('standard', 100)
+    for processi in (0, args.processi):
+        app.config['PASSWORD_PROCESSI'] = processi
+        sonda, throughput = ondata(args.concorrenti, args.login, menu_id)
+        nome = f'pool {processi} processi' if processi else 'nel thread'
+        riepilogo(f'sonda ({nome})', sonda, login=f'{throughput:.1f}/s')
+
+
+if __name__ == '__main__':
+    main()
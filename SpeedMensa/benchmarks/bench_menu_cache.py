@@ -0,0 +1,35 @@
+"""Latenza di /index con la cache dei menu vuota (fredda) e popolata (calda).
+
+    python benchmarks/bench_menu_cache.py --richieste 500 --menu 60
+"""
+import argparse
+from ambiente import app, db, prepara_db, crea_utenti, crea_menu, cronometra, riepilogo, PASSWORD
+from app.cache import menu_cache
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--richieste', type=int, default=500)
+    parser.add_argument('--menu', type=int, default=60)
+    args = parser.parse_args()
+
+    with app.app_context():
+        prepara_db()
+        gestore_id = crea_utenti(1, prefisso='gestore', is_gestore=True)[0]
+        crea_menu(args.menu, gestore_id)
+
+    client = app.test_client()
+    client.post('/login', data={'username': 'gestore0', 'password': PASSWORD})
+
+    def fredda():
+        menu_cache.invalida()
+        client.get('/index')
+
+    riepilogo('cache fredda', cronometra(fredda, args.richieste))
+    menu_cache.hits = menu_cache.misses = 0
+    riepilogo('cache calda', cronometra(lambda: client.get('/index'), args.richieste),
+              **menu_cache.statistiche())
+
+
+if __name__ == '__main__':
+    main()
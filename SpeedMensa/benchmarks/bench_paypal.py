@@ -0,0 +1,53 @@
+"""Confronta la latenza del checkout PayPal con e senza token in cache e keep-alive.
+
+    python benchmarks/bench_paypal.py --richieste 200 --latenza 0.005
+"""
+import argparse
+import ambiente
+import requests
+from app.paypal import PayPalClient
+from paypal_stub import FakePayPal
+
+PAYLOAD = {'intent': 'CAPTURE',
+           'purchase_units': [{'amount': {'currency_code': 'EUR', 'value': '5.00'}}]}
+
+
+def checkout_senza_cache(base):
+    """Percorso originale: nuovo token e nuova connessione per ogni chiamata"""
+    for percorso in ('/v2/checkout/orders', None):
+        token = requests.post(f'{base}/v1/oauth2/token', auth=('sb', ''),
+                              data={'grant_type': 'client_credentials'}).json()['access_token']
+        headers = {'Authorization': f'Bearer {token}'}
+        if percorso:
+            order_id = requests.post(f'{base}{percorso}', headers=headers, json=PAYLOAD).json()['id']
+        else:
+            requests.post(f'{base}/v2/checkout/orders/{order_id}/capture', headers=headers).json()
+
+
+def checkout_con_client(client):
+    order_id = client.create_order(PAYLOAD)['id']
+    client.capture_order(order_id)
+
+
+def misura(nome, funzione, richieste, stub):
+    stub.contatori.clear()
+    durate = ambiente.cronometra(funzione, richieste)
+    ambiente.riepilogo(nome, durate, token=stub.contatori.get('token', 0),
+                       connessioni=stub.contatori.get('connessioni', 0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--richieste', type=int, default=200)
+    parser.add_argument('--latenza', type=float, default=0.005, help='latenza simulata in secondi')
+    args = parser.parse_args()
+
+    with FakePayPal(latenza=args.latenza) as stub:
+        client = PayPalClient(stub.url, 'sb', '')
+        misura('senza cache', lambda: checkout_senza_cache(stub.url), args.richieste, stub)
+        misura('PayPalClient', lambda: checkout_con_client(client), args.richieste, stub)
+        client.close()
+
+
+if __name__ == '__main__':
+    main()
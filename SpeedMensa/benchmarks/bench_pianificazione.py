@@ -0,0 +1,71 @@
+"""Pianificazione di un mese di menu: un POST per giorno, pianificazione in blocco e copia di un periodo.
+
+    python benchmarks/bench_pianificazione.py --giorni 30 --ripetizioni 20 --esistenti 2000
+
+Ogni ripetizione pianifica un periodo diverso, dopo `--esistenti` menu già
+presenti; si riportano la durata per periodo e gli statement SQL eseguiti.
+"""
+import argparse
+from datetime import date, timedelta
+import sqlalchemy as sa
+from ambiente import app, db, prepara_db, crea_utenti, crea_menu, cronometra, riepilogo, PASSWORD
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--giorni', type=int, default=30)
+    parser.add_argument('--ripetizioni', type=int, default=20)
+    parser.add_argument('--esistenti', type=int, default=2000)
+    args = parser.parse_args()
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    with app.app_context():
+        prepara_db()
+        gestore_id = crea_utenti(1, prefisso='gestore', is_gestore=True)[0]
+        # Menu passati, come in un'installazione in uso da qualche anno
+        crea_menu(args.esistenti, gestore_id, dal=date.today() - timedelta(days=args.esistenti))
+        statement = []
+        sa.event.listen(db.engine, 'before_cursor_execute', lambda *a: statement.append(1))
+
+    client = app.test_client()
+    client.post('/login', data={'username': 'gestore0', 'password': PASSWORD})
+    periodi = iter(range(3 * args.ripetizioni))
+
+    def giorni_periodo():
+        inizio = date.today() + timedelta(days=1 + next(periodi) * args.giorni)
+        return [inizio + timedelta(days=i) for i in range(args.giorni)]
+
+    def menu(giorno):
+        return {'data': giorno.isoformat(), 'primo': 'Pasta', 'secondo': 'Pollo', 'contorno': 'Insalata',
+                'prezzo': '5', 'disponibile': 'y'}
+
+    def un_post_per_giorno():
+        for giorno in giorni_periodo():
+            client.post('/gestore/menu/nuovo', data=menu(giorno))
+
+    def in_blocco():
+        client.post('/api/gestore/menu', json=[menu(giorno) for giorno in giorni_periodo()])
+
+    primo_periodo = date.today() + timedelta(days=1)
+
+    def copia():
+        giorni = giorni_periodo()
+        client.post('/gestore/menu/clona', data={
+            'clona-dal': primo_periodo.isoformat(),
+            'clona-al': (primo_periodo + timedelta(days=args.giorni - 1)).isoformat(),
+            'clona-inizio': giorni[0].isoformat()})
+
+    for nome, funzione in (('un POST per giorno', un_post_per_giorno), ('in blocco', in_blocco),
+                           ('copia periodo', copia)):
+        statement.clear()
+        durate = cronometra(funzione, args.ripetizioni)
+        riepilogo(nome, durate, query=f'{len(statement) / args.ripetizioni:.1f}/periodo')
+
+    with app.app_context():
+        menu_creati = db.session.scalar(sa.select(sa.func.count()).select_from(sa.table('menu_giornaliero')))
+    attesi = args.esistenti + 3 * args.ripetizioni * args.giorni
+    assert menu_creati == attesi, f'{menu_creati} menu invece di {attesi}'
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""Prenotazioni concorrenti su SQLite con i vari profili di connessione.
+
+    python benchmarks/bench_prenotazioni.py --scrittori 16 --lettori 4 --prenotazioni 2000
+
+Ogni configurazione gira in un processo separato con un database nuovo: gli
+scrittori ripetono il percorso della vista `prenota` (controllo duplicati,
+posto nello slot, inserimento, commit) mentre i lettori interrogano la
+disponibilità come la homepage.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+CONFIGURAZIONI = {
+    # Impostazioni di SQLite e di SQLAlchemy prima della messa a punto
+    'predefinito': {'DB_PROFILO': 'predefinito', 'DB_SERIALIZZA_SCRITTURE': 'false',
+                    'DB_POOL_SIZE': '5', 'DB_POOL_OVERFLOW': '10'},
+    'wal': {'DB_PROFILO': 'produzione', 'DB_SERIALIZZA_SCRITTURE': 'false'},
+    'wal+serializzate': {'DB_PROFILO': 'produzione', 'DB_SERIALIZZA_SCRITTURE': 'true'},
+}
+
+
+def misura(nome, scrittori, lettori, prenotazioni):
+    import sqlalchemy as sa
+    from ambiente import app, db, prepara_db, crea_utenti, crea_menu, riepilogo
+    from app import queries
+    from app.capacita import occupa_posto, disponibilita_menu
+    from app.models import Prenotazione
+
+    orari = app.config['ORARI_RITIRO']
+    with app.app_context():
+        prepara_db()
+        gestore_id = crea_utenti(1, prefisso='gestore', is_gestore=True)[0]
+        utenti = crea_utenti(prenotazioni)
+        menu_ids = crea_menu(prenotazioni // (len(orari) * app.config['POSTI_DISPONIBILI_PER_SLOT']) + 1,
+                             gestore_id)
+    app.config['PRENOTAZIONE_TTL'] = 10 ** 6
+
+    durate, letture, errori = [], [], []
+    lock = threading.Lock()
+    finito = threading.Event()
+
+    def prenota(i):
+        menu_id = menu_ids[i % len(menu_ids)]
+        with app.app_context():
+            inizio = perf_counter()
+            try:
+                if db.session.scalar(queries.prenotazione_attiva(utenti[i], menu_id)) is None:
+                    if occupa_posto(menu_id, orari[i % len(orari)]):
+                        db.session.add(Prenotazione(utente_id=utenti[i], menu_id=menu_id,
+                                                    orario_ritiro=orari[i % len(orari)], stato='in_attesa'))
+                    db.session.commit()
+            except sa.exc.OperationalError as e:
+                db.session.rollback()
+                with lock:
+                    errori.append(e)
+                return
+            finally:
+                db.session.remove()
+            with lock:
+                durate.append((perf_counter() - inizio) * 1000)
+
+    def leggi():
+        with app.app_context():
+            # Pausa tra due letture, come un client che aggiorna la pagina
+            while not finito.wait(0.01):
+                inizio = perf_counter()
+                try:
+                    disponibilita_menu(menu_ids[0], orari)
+                except sa.exc.OperationalError as e:
+                    with lock:
+                        errori.append(e)
+                    continue
+                with lock:
+                    letture.append((perf_counter() - inizio) * 1000)
+
+    thread_lettori = [threading.Thread(target=leggi) for _ in range(lettori)]
+    for thread in thread_lettori:
+        thread.start()
+    inizio = perf_counter()
+    with ThreadPoolExecutor(max_workers=scrittori) as executor:
+        list(executor.map(prenota, range(prenotazioni)))
+    totale = perf_counter() - inizio
+    finito.set()
+    for thread in thread_lettori:
+        thread.join()
+
+    riepilogo(f'{nome} scritture', durate, throughput=f'{len(durate) / totale:.1f}/s', errori=len(errori))
+    if letture:
+        riepilogo(f'{nome} letture', letture, throughput=f'{len(letture) / totale:.1f}/s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scrittori', type=int, default=16)
+    parser.add_argument('--lettori', type=int, default=4)
+    parser.add_argument('--prenotazioni', type=int, default=2000)
+    parser.add_argument('--configurazione', choices=list(CONFIGURAZIONI),
+                        help='misura una sola configurazione nel processo corrente')
+    args = parser.parse_args()
+
+    if args.configurazione:
+        misura(args.configurazione, args.scrittori, args.lettori, args.prenotazioni)
+        return
+    for nome, variabili in CONFIGURAZIONI.items():
+        ambiente = {chiave: valore for chiave, valore in os.environ.items() if chiave != 'DATABASE_URL'}
+        subprocess.run([sys.executable, os.path.abspath(__file__), '--configurazione', nome,
+                        '--scrittori', str(args.scrittori), '--lettori', str(args.lettori),
+                        '--prenotazioni', str(args.prenotazioni)],
+                       env={**ambiente, **variabili}, check=True)
+
+
+if __name__ == '__main__':
+    main()
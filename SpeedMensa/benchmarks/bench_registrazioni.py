@@ -0,0 +1,49 @@
+"""Registrazioni in blocco (giorno delle immatricolazioni): latenza e query per invio.
+
+    python benchmarks/bench_registrazioni.py --registrazioni 2000 --esistenti 20000
+
+Ogni `--duplicati` invii uno riusa l'email di uno studente già registrato ed è
+respinto dalla validazione. L'hash della password usa un metodo economico,
+così il tempo misurato è quello di validazione e INSERT.
+"""
+import argparse
+import sqlalchemy as sa
+from ambiente import app, db, prepara_db, crea_utenti, cronometra, riepilogo
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--registrazioni', type=int, default=2000)
+    parser.add_argument('--esistenti', type=int, default=20000)
+    parser.add_argument('--duplicati', type=int, default=10)
+    args = parser.parse_args()
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.config['PASSWORD_PROFILO'] = 'pbkdf2:sha256:1'
+    with app.app_context():
+        prepara_db()
+        crea_utenti(args.esistenti)
+        statement = []
+        sa.event.listen(db.engine, 'before_cursor_execute', lambda *a: statement.append(1))
+
+    client = app.test_client()
+    invii = iter(range(args.registrazioni))
+    respinti = []
+
+    def registra():
+        i = next(invii)
+        email = f'studente{i}@studenti.uniparthenope.it' if i % args.duplicati == 0 \
+            else f'matricola{i}@studenti.uniparthenope.it'
+        risposta = client.post('/register', data={
+            'username': f'matricola{i}', 'email': email, 'nome': 'Matricola', 'cognome': str(i),
+            'matricola': f'N{i:07d}', 'password': 'segreta', 'password2': 'segreta'})
+        if risposta.status_code == 200:
+            respinti.append(i)
+
+    durate = cronometra(registra, args.registrazioni)
+    riepilogo('registrazioni', durate, query=f'{len(statement) / args.registrazioni:.2f}/invio',
+              respinte=len(respinti))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""Throughput della riconciliazione pagamenti al variare della concorrenza verso PayPal.
+
+    python benchmarks/bench_riconcilia.py --transazioni 2000 --latenza 0.02 --concorrenza 1 4 16
+"""
+import argparse
+from datetime import datetime, timedelta, timezone
+from time import perf_counter
+import sqlalchemy as sa
+from ambiente import app, db, prepara_db, crea_utenti, crea_menu
+from app.models import Prenotazione, Transazione
+from app.pagamenti import riconcilia
+from paypal_stub import FakePayPal
+
+
+def prepara(n, stub):
+    """`n` prenotazioni con transazione in attesa; metà degli ordini risulta catturata"""
+    prepara_db()
+    gestore_id = crea_utenti(1, prefisso='gestore', is_gestore=True)[0]
+    menu_id = crea_menu(1, gestore_id)[0]
+    utente_id = crea_utenti(1)[0]
+    db.session.execute(sa.insert(Prenotazione), [
+        {'utente_id': utente_id, 'menu_id': menu_id, 'orario_ritiro': '12:00', 'stato': 'in_attesa'}
+        for _ in range(n)
+    ])
+    ids = db.session.scalars(sa.select(Prenotazione.id)).all()
+    un_ora_fa = datetime.now(timezone.utc) - timedelta(hours=1)
+    db.session.execute(sa.insert(Transazione), [
+        {'utente_id': utente_id, 'prenotazione_id': id, 'tipo': 'pagamento_pasto', 'importo': 5.0,
+         'metodo_pagamento': 'PayPal', 'stato': 'in_attesa', 'paypal_order_id': f'ORDER-B{id}',
+         'created_at': un_ora_fa}
+        for id in ids
+    ])
+    db.session.commit()
+    stub.ordini.clear()
+    stub.ordini.update({f'ORDER-B{id}': 'COMPLETED' if id % 2 else 'APPROVED' for id in ids})
+    stub.importi.clear()
+    stub.importi.update({f'ORDER-B{id}': '5.00' for id in ids})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--transazioni', type=int, default=2000)
+    parser.add_argument('--latenza', type=float, default=0.02, help='latenza PayPal simulata in secondi')
+    parser.add_argument('--concorrenza', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--blocco', type=int, default=100)
+    args = parser.parse_args()
+
+    with FakePayPal(latenza=args.latenza) as stub, app.app_context():
+        app.config['PAYPAL_API_BASE'] = stub.url
+        app.config['PAYPAL_POOL_SIZE'] = max(args.concorrenza)
+        for concorrenza in args.concorrenza:
+            prepara(args.transazioni, stub)
+            inizio = perf_counter()
+            esiti = riconcilia(timedelta(minutes=15), timedelta(hours=3), concorrenza, args.blocco)
+            durata = perf_counter() - inizio
+            print(f'concorrenza {concorrenza:<4} {esiti["verificate"] / durata:9.1f} transazioni/s  '
+                  f'completate {esiti["completate"]}  in attesa {esiti["in_attesa"]}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+"""Richieste al secondo su /index con e senza la cache degli utenti autenticati.
+
+    python benchmarks/bench_utenti_cache.py --richieste 2000 --studenti 50
+
+La cache dei menu resta calda in entrambi i casi: la differenza è la SELECT
+dell'utente che il user_loader esegue a ogni richiesta.
+"""
+import argparse
+import sqlalchemy as sa
+from ambiente import app, db, prepara_db, crea_utenti, crea_menu, cronometra, riepilogo, PASSWORD
+from app.cache import utenti_cache, CacheMemoria
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--richieste', type=int, default=2000)
+    parser.add_argument('--studenti', type=int, default=50)
+    args = parser.parse_args()
+
+    with app.app_context():
+        prepara_db()
+        gestore_id = crea_utenti(1, prefisso='gestore', is_gestore=True)[0]
+        crea_menu(20, gestore_id)
+        crea_utenti(args.studenti)
+
+    clienti = []
+    for i in range(args.studenti):
+        client = app.test_client()
+        client.post('/login', data={'username': f'studente{i}', 'password': PASSWORD})
+        clienti.append(client)
+    statement = []
+    with app.app_context():
+        sa.event.listen(db.engine, 'before_cursor_execute', lambda *a: statement.append(1))
+
+    for nome, backend in (('senza cache', None), ('cache in memoria', CacheMemoria(60, 2048))):
+        utenti_cache.backend = backend
+        clienti[0].get('/index')
+        richieste = iter(range(args.richieste))
+        statement.clear()
+        durate = cronometra(lambda: clienti[next(richieste) % len(clienti)].get('/index'), args.richieste)
+        riepilogo(nome, durate, query=f'{len(statement) / args.richieste:.2f}/richiesta')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+"""Test di carico dell'ora di punta: login, homepage, prenotazione e pagamento.
+
+    python benchmarks/carico.py --studenti 500 --concorrenza 32 --output carico.json
+    python benchmarks/carico.py --studenti 500 --confronta carico.json
+
+Ogni studente virtuale percorre login → index → prenota (GET e POST) →
+create_payment → execute_payment con la propria sessione HTTP, contro
+l'applicazione avviata da servi.py e il server PayPal finto. Per ogni rotta
+si riportano throughput, p50/p95/p99 e tasso di errore; i risultati vengono
+salvati in JSON insieme al commit, per confrontare esecuzioni successive.
+"""
+import argparse
+import json
+import re
+import subprocess
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from time import perf_counter
+import requests
+from ambiente import app, prepara_db, crea_utenti, crea_menu, percentile, avvia_server, CARTELLA, PASSWORD
+from app.forms import ORARI_PRENOTABILI
+from paypal_stub import FakePayPal
+
+ROTTE = ['login', 'index', 'prenota GET', 'prenota POST', 'create_payment', 'execute_payment']
+
+
+class Misure:
+    """Durate ed errori per rotta, condivisi tra i thread degli studenti"""
+
+    def __init__(self):
+        self.durate = defaultdict(list)
+        self.errori = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def registra(self, rotta, durata, ok):
+        with self._lock:
+            self.durate[rotta].append(durata)
+            if not ok:
+                self.errori[rotta] += 1
+
+    def riepilogo(self, totale):
+        rotte = {}
+        for rotta in ROTTE:
+            durate = self.durate.get(rotta)
+            if not durate:
+                continue
+            rotte[rotta] = {
+                'richieste': len(durate),
+                'errori': self.errori[rotta],
+                'tasso_errori': round(self.errori[rotta] / len(durate), 4),
+                'throughput': round(len(durate) / totale, 2),
+                **{f'p{p}': round(percentile(durate, p), 2) for p in (50, 95, 99)},
+            }
+        return rotte
+
+
+def prepara(studenti):
+    """Studenti e menu con posti sufficienti per tutti: [(username, menu_id, orario), ...]"""
+    posti_per_menu = len(ORARI_PRENOTABILI) * app.config['POSTI_DISPONIBILI_PER_SLOT']
+    with app.app_context():
+        prepara_db()
+        gestore_id = crea_utenti(1, prefisso='gestore', is_gestore=True)[0]
+        menu_ids = crea_menu(studenti // posti_per_menu + 1, gestore_id)
+        crea_utenti(studenti)
+    return [(f'studente{i}', menu_ids[i // posti_per_menu],
+             ORARI_PRENOTABILI[i % len(ORARI_PRENOTABILI)])
+            for i in range(studenti)]
+
+
+def studente(base, misure, username, menu_id, orario):
+    """Un percorso completo; si interrompe alla prima risposta non valida"""
+    with requests.Session() as sessione:
+        def chiama(rotta, metodo, url, valida, **kwargs):
+            inizio = perf_counter()
+            try:
+                risposta = sessione.request(metodo, base + url, allow_redirects=False, timeout=60, **kwargs)
+                esito = valida(risposta)
+            except (requests.RequestException, ValueError):
+                esito = None
+            misure.registra(rotta, (perf_counter() - inizio) * 1000, esito is not None)
+            return esito
+
+        def pagamento(risposta):
+            trovato = re.search(r'/pagamento/(\d+)', risposta.headers.get('Location', ''))
+            return trovato and trovato.group(1)
+
+        if not chiama('login', 'POST', '/login', lambda r: r.status_code == 302 or None,
+                      data={'username': username, 'password': PASSWORD}):
+            return
+        if not chiama('index', 'GET', '/index', lambda r: r.status_code == 200 or None):
+            return
+        if not chiama('prenota GET', 'GET', f'/prenota/{menu_id}', lambda r: r.status_code == 200 or None):
+            return
+        prenotazione_id = chiama('prenota POST', 'POST', f'/prenota/{menu_id}', pagamento,
+                                 data={'orario_ritiro': orario})
+        if not prenotazione_id:
+            return
+        order_id = chiama('create_payment', 'POST', f'/api/payment/create/{prenotazione_id}',
+                          lambda r: r.json().get('id'))
+        if not order_id:
+            return
+        chiama('execute_payment', 'POST', f'/api/payment/execute/{prenotazione_id}',
+               lambda r: r.json().get('status') == 'success' or None, json={'orderID': order_id})
+
+
+def commit_corrente():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=CARTELLA,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def stampa(risultati, precedenti=None):
+    print(f"{'rotta':<16}{'richieste':>10}{'errori':>8}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for rotta, m in risultati['rotte'].items():
+        riga = (f"{rotta:<16}{m['richieste']:>10}{m['tasso_errori']:>8.1%}{m['throughput']:>9.1f}"
+                f"{m['p50']:>10.1f}{m['p95']:>10.1f}{m['p99']:>10.1f}")
+        prima = (precedenti or {}).get('rotte', {}).get(rotta)
+        if prima and prima['p99']:
+            riga += f"   p99 {(m['p99'] - prima['p99']) / prima['p99']:+.0%} rispetto a {precedenti['commit']}"
+        print(riga)
+    totale = risultati['totale']
+    print(f"{totale['studenti']} studenti in {totale['durata']:.1f} s: "
+          f"{totale['completati'] / totale['durata']:.1f} percorsi completati/s, {totale['completati']} completati")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--studenti', type=int, default=500)
+    parser.add_argument('--concorrenza', type=int, default=32, help='studenti contemporanei')
+    parser.add_argument('--modo', choices=['sync', 'gevent'], default='gevent')
+    parser.add_argument('--workers', type=int, default=8, help='worker del server sincrono')
+    parser.add_argument('--latenza', type=float, default=0.2, help='latenza PayPal simulata in secondi')
+    parser.add_argument('--output', help='file JSON in cui salvare i risultati')
+    parser.add_argument('--confronta', help='risultati JSON di un\'esecuzione precedente')
+    args = parser.parse_args()
+
+    piano = prepara(args.studenti)
+    misure = Misure()
+    with FakePayPal(latenza=args.latenza) as stub:
+        processo, base = avvia_server(args.modo, args.workers, stub.url)
+        try:
+            inizio = perf_counter()
+            with ThreadPoolExecutor(max_workers=args.concorrenza) as executor:
+                for futuro in [executor.submit(studente, base, misure, *passo) for passo in piano]:
+                    futuro.result()
+            durata = perf_counter() - inizio
+        finally:
+            processo.terminate()
+            processo.wait()
+
+    risultati = {
+        'commit': commit_corrente(),
+        'data': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'parametri': {chiave: valore for chiave, valore in vars(args).items()
+                      if chiave not in ('output', 'confronta')},
+        'totale': {'studenti': args.studenti, 'durata': round(durata, 2),
+                   'completati': len(misure.durate['execute_payment']) - misure.errori['execute_payment']},
+        'rotte': misure.riepilogo(durata),
+    }
+    precedenti = None
+    if args.confronta:
+        with open(args.confronta) as f:
+            precedenti = json.load(f)
+    stampa(risultati, precedenti)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(risultati, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""Server PayPal finto per test e benchmark offline.
+
+Implementa solo le chiamate usate da SpeedMensa (token OAuth, creazione,
+cattura e consultazione ordini) e tiene il conto delle richieste ricevute
+e delle connessioni TCP aperte. Una latenza artificiale simula la rete.
+"""
+import itertools
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        self.server.stub.conta('connessioni')
+
+    def log_message(self, format, *args):
+        pass
+
+    def _rispondi(self, stato, corpo):
+        dati = json.dumps(corpo).encode()
+        self.send_response(stato)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(dati)))
+        self.end_headers()
+        self.wfile.write(dati)
+
+    def _leggi_corpo(self):
+        lunghezza = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(lunghezza) if lunghezza else b''
+
+    def do_POST(self):
+        corpo = self._leggi_corpo()
+        stub = self.server.stub
+        stub.attendi()
+        if self.path == '/v1/oauth2/token':
+            stub.conta('token')
+            return self._rispondi(200, {'access_token': f'TOKEN-{next(stub.sequenza)}',
+                                        'token_type': 'Bearer', 'expires_in': stub.expires_in})
+        if not self._autorizzato():
+            return self._rispondi(401, {'error': 'invalid_token'})
+        if self.path == '/v2/checkout/orders':
+            stub.conta('ordini')
+            order_id = f'ORDER-{next(stub.sequenza)}'
+            stub.ordini[order_id] = 'APPROVED'
+            unita = (json.loads(corpo or b'{}').get('purchase_units') or [{}])[0]
+            if 'amount' in unita:
+                stub.importi[order_id] = unita['amount']['value']
+            return self._rispondi(201, {'id': order_id, 'status': 'CREATED'})
+        match = re.fullmatch(r'/v2/checkout/orders/([^/]+)/capture', self.path)
+        if match:
+            stub.conta('catture')
+            order_id = match.group(1)
+            if stub.ordini.get(order_id) == 'COMPLETED':
+                return self._rispondi(422, {'name': 'UNPROCESSABLE_ENTITY',
+                                            'details': [{'issue': 'ORDER_ALREADY_CAPTURED'}]})
+            stub.ordini[order_id] = 'COMPLETED'
+            return self._rispondi(201, stub.ordine(order_id))
+        self._rispondi(404, {'name': 'RESOURCE_NOT_FOUND'})
+
+    def do_GET(self):
+        stub = self.server.stub
+        stub.attendi()
+        if not self._autorizzato():
+            return self._rispondi(401, {'error': 'invalid_token'})
+        match = re.fullmatch(r'/v2/checkout/orders/([^/]+)', self.path)
+        if match and match.group(1) in stub.ordini:
+            stub.conta('consultazioni')
+            order_id = match.group(1)
+            return self._rispondi(200, stub.ordine(order_id))
+        self._rispondi(404, {'name': 'RESOURCE_NOT_FOUND'})
+
+    def _autorizzato(self):
+        return self.headers.get('Authorization', '').startswith('Bearer TOKEN-')
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # Backlog ampio: i benchmark aprono molte connessioni contemporaneamente
+    request_queue_size = 128
+
+
+class FakePayPal:
+    """Avvia il server su una porta libera di localhost in un thread separato"""
+
+    def __init__(self, latenza=0.0, expires_in=32400):
+        self.latenza = latenza
+        self.expires_in = expires_in
+        self.sequenza = itertools.count(1)
+        self.ordini = {}
+        # Importo in EUR di ogni ordine, come stringa; riportato nelle catture
+        self.importi = {}
+        self.contatori = {}
+        self._lock = threading.Lock()
+        self.server = _Server(('127.0.0.1', 0), _Handler)
+        self.server.stub = self
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def conta(self, nome):
+        with self._lock:
+            self.contatori[nome] = self.contatori.get(nome, 0) + 1
+
+    def ordine(self, order_id):
+        """Risposta di PayPal per l'ordine; se catturato, con la cattura e il suo importo"""
+        stato = self.ordini[order_id]
+        ordine = {'id': order_id, 'status': stato}
+        if stato == 'COMPLETED' and order_id in self.importi:
+            cattura = {'id': f'CAPTURE-{order_id}', 'status': 'COMPLETED',
+                       'amount': {'currency_code': 'EUR', 'value': self.importi[order_id]}}
+            ordine['purchase_units'] = [{'payments': {'captures': [cattura]}}]
+        return ordine
+
+    def attendi(self):
+        if self.latenza:
+            time.sleep(self.latenza)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
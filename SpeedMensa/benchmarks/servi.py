@@ -0,0 +1,60 @@
+"""Avvia l'applicazione per i benchmark HTTP (bench_checkout.py, carico.py) in una delle due modalità.
+
+    python benchmarks/servi.py --modo sync --workers 8 --porta 5001 --paypal URL
+    python benchmarks/servi.py --modo gevent --porta 5001 --paypal URL
+
+`sync` gestisce al massimo `--workers` richieste alla volta, come un server
+WSGI con worker sincroni; `gevent` è l'avvio di asincrono.py.
+"""
+import argparse
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+parser.add_argument('--modo', choices=['sync', 'gevent'], default='sync')
+parser.add_argument('--workers', type=int, default=8)
+parser.add_argument('--porta', type=int, default=5001)
+parser.add_argument('--paypal', required=True, help='URL del server PayPal finto')
+parser.add_argument('--pool-paypal', type=int, default=100)
+args = parser.parse_args()
+
+if args.modo == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+
+from werkzeug.serving import BaseWSGIServer
+from ambiente import app
+
+
+class ServerSync(BaseWSGIServer):
+    """Server WSGI con un numero fisso di worker: le richieste in eccesso attendono"""
+
+    def __init__(self, host, port, app, workers):
+        super().__init__(host, port, app)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    def process_request(self, request, client_address):
+        self.executor.submit(self._gestisci, request, client_address)
+
+    def _gestisci(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+def main():
+    app.config['PAYPAL_API_BASE'] = args.paypal
+    app.config['PAYPAL_POOL_SIZE'] = args.pool_paypal
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    if args.modo == 'gevent':
+        from gevent.pywsgi import WSGIServer
+        WSGIServer(('127.0.0.1', args.porta), app, log=None).serve_forever()
+    else:
+        ServerSync('127.0.0.1', args.porta, app, args.workers).serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -5,6 +5,22 @@ class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'chiave-segreta-SpeedMensa-2025'
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///' + os.path.join(basedir, 'mensa.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Pool di connessioni (i database SQLite in memoria usano una connessione unica)
+    SQLALCHEMY_ENGINE_OPTIONS = {} if SQLALCHEMY_DATABASE_URI in ('sqlite://', 'sqlite:///:memory:') else {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE') or 10),
+        'max_overflow': int(os.environ.get('DB_POOL_OVERFLOW') or 20),
+        'pool_timeout': float(os.environ.get('DB_POOL_TIMEOUT') or 10),
+    }
+    # Profilo SQLite applicato a ogni connessione ('produzione': WAL e pragma; 'predefinito')
+    # e serializzazione delle transazioni di scrittura all'interno del processo
+    DB_PROFILO = os.environ.get('DB_PROFILO', 'produzione')
+    DB_SERIALIZZA_SCRITTURE = os.environ.get('DB_SERIALIZZA_SCRITTURE', 'true').lower() in ['true', 'on', '1']
+
+    # Hash delle password: profilo di app/password.py ('standard', 'leggero', 'pbkdf2') o metodo
+    # Werkzeug; gli hash con altri parametri vengono ricalcolati al login successivo.
+    # Con PASSWORD_PROCESSI > 0 la verifica avviene in un pool di processi
+    PASSWORD_PROFILO = os.environ.get('PASSWORD_PROFILO', 'standard')
+    PASSWORD_PROCESSI = int(os.environ.get('PASSWORD_PROCESSI') or 0)
     
     # Configurazione Email
     MAIL_SERVER = os.environ.get('MAIL_SERVER', 'smtp.gmail.com')
@@ -13,13 +29,57 @@ class Config:
     MAIL_USERNAME = os.environ.get('MAIL_USERNAME') or 'dorus0100@gmail.com'
     MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')  or 'rtml qjbv wswv sdpi'
     ADMINS = ['dorus0100@gmail.com']
+    # Log: coda verso il thread di scrittura, file JSON ruotato, un'email di errori ogni N secondi
+    LOG_CODA = int(os.environ.get('LOG_CODA') or 10000)
+    LOG_FILE_MAX_BYTES = int(os.environ.get('LOG_FILE_MAX_BYTES') or 10 * 1024 * 1024)
+    LOG_FILE_BACKUP = int(os.environ.get('LOG_FILE_BACKUP') or 10)
+    LOG_EMAIL_INTERVALLO = int(os.environ.get('LOG_EMAIL_INTERVALLO') or 300)
+    # Invio in background: worker, dimensione della coda, tentativi e backoff (secondi)
+    MAIL_WORKERS = int(os.environ.get('MAIL_WORKERS') or 2)
+    MAIL_QUEUE_SIZE = int(os.environ.get('MAIL_QUEUE_SIZE') or 1000)
+    MAIL_RETRY = int(os.environ.get('MAIL_RETRY') or 3)
+    MAIL_RETRY_BACKOFF = float(os.environ.get('MAIL_RETRY_BACKOFF') or 1.0)
+    MAIL_IDLE_TIMEOUT = float(os.environ.get('MAIL_IDLE_TIMEOUT') or 5.0)
     
     # Configurazione Mensa
     ORARI_RITIRO = ['12:00', '12:30', '13:00', '13:30', '14:00']
     POSTI_DISPONIBILI_PER_SLOT = 50
+    # Minuti dopo i quali una prenotazione non pagata scade e libera il posto
+    PRENOTAZIONE_TTL = int(os.environ.get('PRENOTAZIONE_TTL') or 20)
+    # Secondi tra due heartbeat sugli stream SSE della dashboard gestore
+    SSE_HEARTBEAT = int(os.environ.get('SSE_HEARTBEAT') or 15)
+
+    # Cache dei menu in homepage: 'memoria' (per processo), 'file', 'redis' o 'nessuna'
+    MENU_CACHE_BACKEND = os.environ.get('MENU_CACHE_BACKEND', 'memoria')
+    MENU_CACHE_TTL = int(os.environ.get('MENU_CACHE_TTL') or 300)
+    MENU_CACHE_SIZE = int(os.environ.get('MENU_CACHE_SIZE') or 32)
+    MENU_CACHE_DIR = os.environ.get('MENU_CACHE_DIR') or os.path.join(basedir, 'cache')
+    MENU_CACHE_URL = os.environ.get('MENU_CACHE_URL') or 'redis://localhost:6379/0'
+    # Cache degli utenti autenticati (user_loader), stessi backend; con più worker e
+    # backend 'memoria' una modifica arriva agli altri processi entro il TTL
+    UTENTI_CACHE_BACKEND = os.environ.get('UTENTI_CACHE_BACKEND', 'memoria')
+    UTENTI_CACHE_TTL = int(os.environ.get('UTENTI_CACHE_TTL') or 60)
+    UTENTI_CACHE_SIZE = int(os.environ.get('UTENTI_CACHE_SIZE') or 2048)
+    UTENTI_CACHE_DIR = os.environ.get('UTENTI_CACHE_DIR') or os.path.join(basedir, 'cache', 'utenti')
+    UTENTI_CACHE_URL = os.environ.get('UTENTI_CACHE_URL') or MENU_CACHE_URL
+    
+    # Metriche per endpoint su /gestore/metrics (formato Prometheus); lo scraper può
+    # autenticarsi con "Authorization: Bearer <METRICHE_TOKEN>" invece che da gestore
+    METRICHE_ABILITATE = os.environ.get('METRICHE_ABILITATE', 'false').lower() in ['true', 'on', '1']
+    METRICHE_TOKEN = os.environ.get('METRICHE_TOKEN')
+    # Frazione di richieste profilate con cProfile; il profilo si salva se durano più di SOGLIA ms
+    METRICHE_PROFILO_CAMPIONE = float(os.environ.get('METRICHE_PROFILO_CAMPIONE') or 0)
+    METRICHE_PROFILO_SOGLIA = int(os.environ.get('METRICHE_PROFILO_SOGLIA') or 500)
+    METRICHE_PROFILO_DIR = os.environ.get('METRICHE_PROFILO_DIR') or os.path.join(basedir, 'profili')
     
     # Configurazione PayPal
     PAYPAL_CLIENT_ID = os.environ.get('PAYPAL_CLIENT_ID') or 'sb' # 'sb' è default per sandbox test
     PAYPAL_CLIENT_SECRET = os.environ.get('PAYPAL_CLIENT_SECRET')
     # Se la mode è 'sandbox', usa l'URL di test, altrimenti quello live
-    PAYPAL_API_BASE = 'https://api-m.sandbox.paypal.com' if os.environ.get('PAYPAL_MODE', 'sandbox') == 'sandbox' else 'https://api-m.paypal.com'
\ No newline at end of file
+    PAYPAL_API_BASE = 'https://api-m.sandbox.paypal.com' if os.environ.get('PAYPAL_MODE', 'sandbox') == 'sandbox' else 'https://api-m.paypal.com'
+    # Connessioni HTTP verso PayPal: dimensione del pool, timeout (connessione, lettura)
+    # e secondi di anticipo con cui rinnovare il token OAuth
+    PAYPAL_POOL_SIZE = int(os.environ.get('PAYPAL_POOL_SIZE') or 10)
+    PAYPAL_TIMEOUT = (float(os.environ.get('PAYPAL_CONNECT_TIMEOUT') or 3.05),
+                      float(os.environ.get('PAYPAL_READ_TIMEOUT') or 15))
+    PAYPAL_TOKEN_MARGIN = int(os.environ.get('PAYPAL_TOKEN_MARGIN') or 60)
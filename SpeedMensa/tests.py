@@ -0,0 +1,1306 @@
+#!/usr/bin/env python
+import csv
+import io
+import json
+import logging
+import os
+import tempfile
+_db_fd, _db_path = tempfile.mkstemp(suffix='.db')
+os.close(_db_fd)
+os.environ['DATABASE_URL'] = 'sqlite:///' + _db_path
+os.environ['MAIL_SERVER'] = ''
+
+import pstats
+import re
+import queue
+import socket
+import threading
+import time
+import unittest
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+import sqlalchemy as sa
+from email import message_from_bytes
+from logging.handlers import QueueListener
+from aiosmtpd.controller import Controller
+from flask import g
+from flask_mail import Message
+from app import app, db, mail
+from app.models import User, MenuGiornaliero, Prenotazione, PostiSlot, Transazione, ChiaveIdempotenza
+from app.capacita import occupa_posto, libera_posto, posti_rimanenti, posti_per_slot, scadi_prenotazioni
+from app.paypal import PayPalClient, get_paypal_client
+from app.pagamenti import riconcilia, registra_ordine
+from app.paginazione import PaginaKeyset
+from app import queries
+from app.email import EmailWorkerPool
+from app.eventi import broker
+from app.statistiche import statistiche_menu, verifica, ricostruisci
+from app.models import StatisticheGiornaliere
+from app.forms import RegistrationForm, EditProfileForm
+from app.cache import menu_cache, utenti_cache, load_user, CacheFile, CacheMemoria, ReadThroughCache, UtenteSnapshot
+from app.database import configura_sqlite
+from app.metriche import registro as registro_metriche
+from app.log import CodaLog, EmailDigest, FormatterJSON
+from app.esportazione import csv_a_blocchi
+from benchmarks.paypal_stub import FakePayPal
+
+
+class SpeedMensaTestCase(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.extensions['mail'].suppress = True
+        self.app_context = app.app_context()
+        self.app_context.push()
+        db.create_all()
+        menu_cache.invalida()
+        utenti_cache.invalida()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def crea_utente(self, username, is_gestore=False):
+        user = User(username=username, email=f'{username}@studenti.uniparthenope.it',
+                    nome=username.capitalize(), cognome='Rossi', matricola=username.upper(),
+                    is_gestore=is_gestore)
+        user.set_password('password')
+        db.session.add(user)
+        db.session.commit()
+        return user
+
+    def crea_menu(self, gestore, giorni=1, prezzo=5.0):
+        menu = MenuGiornaliero(data=date.today() + timedelta(days=giorni), primo='Pasta',
+                               secondo='Pollo', contorno='Insalata', prezzo=prezzo,
+                               gestore_id=gestore.id)
+        db.session.add(menu)
+        db.session.commit()
+        return menu
+
+    def login(self, client, username):
+        return client.post('/login', data={'username': username, 'password': 'password'})
+
+    @contextmanager
+    def budget_query(self, massimo):
+        """Fallisce se il blocco esegue più di `massimo` statement SQL"""
+        statements = []
+
+        def registra(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        sa.event.listen(db.engine, 'before_cursor_execute', registra)
+        try:
+            yield statements
+        finally:
+            sa.event.remove(db.engine, 'before_cursor_execute', registra)
+        self.assertLessEqual(len(statements), massimo,
+                             f'{len(statements)} query eseguite:\n' + '\n'.join(statements))
+
+
+class PasswordCase(SpeedMensaTestCase):
+    def tearDown(self):
+        app.config.update(PASSWORD_PROFILO='standard', PASSWORD_PROCESSI=0)
+        pool = app.extensions.pop('password_pool', None)
+        if pool:
+            pool.shutdown()
+        super().tearDown()
+
+    def test_rehash_al_login(self):
+        app.config['PASSWORD_PROFILO'] = 'leggero'
+        user = self.crea_utente('mario')
+        self.assertTrue(user.password_hash.startswith('scrypt:16384:8:1$'))
+        app.config['PASSWORD_PROFILO'] = 'pbkdf2'
+        self.assertTrue(user.password_da_aggiornare())
+        with app.test_client() as client:
+            client.post('/login', data={'username': 'mario', 'password': 'sbagliata'})
+            db.session.expire_all()
+            self.assertTrue(user.password_hash.startswith('scrypt:16384:8:1$'))
+            self.login(client, 'mario')
+        db.session.expire_all()
+        self.assertTrue(user.password_hash.startswith('pbkdf2:sha256:600000$'))
+        self.assertTrue(user.check_password('password'))
+        self.assertFalse(user.password_da_aggiornare())
+
+    def test_metodo_senza_parametri_non_rifa_l_hash(self):
+        for metodo in ('scrypt', 'pbkdf2'):
+            app.config['PASSWORD_PROFILO'] = metodo
+            user = self.crea_utente(f'utente_{metodo}')
+            self.assertFalse(user.password_da_aggiornare(), user.password_hash)
+        # L'ultimo hash è PBKDF2: con scrypt va ancora aggiornato
+        app.config['PASSWORD_PROFILO'] = 'scrypt'
+        self.assertTrue(user.password_da_aggiornare())
+
+    def test_verifica_nel_pool_di_processi(self):
+        user = self.crea_utente('mario')
+        app.config['PASSWORD_PROCESSI'] = 1
+        self.assertTrue(user.check_password('password'))
+        self.assertFalse(user.check_password('sbagliata'))
+        self.assertIn('password_pool', app.extensions)
+
+
+class CapacitaSlotCase(SpeedMensaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.capienza = app.config['POSTI_DISPONIBILI_PER_SLOT']
+        gestore = self.crea_utente('gestore', is_gestore=True)
+        self.menu_id = self.crea_menu(gestore).id
+
+    def tearDown(self):
+        app.config['POSTI_DISPONIBILI_PER_SLOT'] = self.capienza
+        super().tearDown()
+
+    def test_occupa_e_libera(self):
+        app.config['POSTI_DISPONIBILI_PER_SLOT'] = 2
+        self.assertEqual(posti_rimanenti(self.menu_id, '12:00'), 2)
+        self.assertTrue(occupa_posto(self.menu_id, '12:00'))
+        self.assertTrue(occupa_posto(self.menu_id, '12:00'))
+        self.assertFalse(occupa_posto(self.menu_id, '12:00'))
+        db.session.commit()
+        self.assertEqual(posti_per_slot(self.menu_id, ['12:00', '12:30']), {'12:00': 0, '12:30': 2})
+        libera_posto(self.menu_id, '12:00')
+        db.session.commit()
+        self.assertEqual(posti_rimanenti(self.menu_id, '12:00'), 1)
+
+    def test_prenotazioni_concorrenti(self):
+        app.config['POSTI_DISPONIBILI_PER_SLOT'] = 50
+
+        def prenota(_):
+            with app.app_context():
+                try:
+                    ok = occupa_posto(self.menu_id, '12:00')
+                    db.session.commit()
+                    return ok
+                finally:
+                    db.session.remove()
+
+        with ThreadPoolExecutor(max_workers=32) as executor:
+            esiti = list(executor.map(prenota, range(2000)))
+        self.assertEqual(sum(esiti), 50)
+        self.assertEqual(db.session.get(PostiSlot, (self.menu_id, '12:00')).occupati, 50)
+
+    def test_api_disponibilita_etag(self):
+        app.config['POSTI_DISPONIBILI_PER_SLOT'] = 10
+        with app.test_client() as client:
+            risposta = client.get(f'/api/menu/{self.menu_id}/disponibilita')
+            self.assertEqual(risposta.get_json()['posti']['12:00'], 10)
+            etag = risposta.headers['ETag']
+            risposta = client.get(f'/api/menu/{self.menu_id}/disponibilita',
+                                  headers={'If-None-Match': etag})
+            self.assertEqual(risposta.status_code, 304)
+            occupa_posto(self.menu_id, '12:00')
+            db.session.commit()
+            risposta = client.get(f'/api/menu/{self.menu_id}/disponibilita',
+                                  headers={'If-None-Match': etag})
+            self.assertEqual(risposta.status_code, 200)
+            self.assertEqual(risposta.get_json()['posti']['12:00'], 9)
+            self.assertNotEqual(risposta.headers['ETag'], etag)
+            self.assertEqual(client.get('/api/menu/999/disponibilita').status_code, 404)
+
+    def test_prenota_slot_pieno(self):
+        app.config['POSTI_DISPONIBILI_PER_SLOT'] = 1
+        for username in ('mario', 'luigi'):
+            self.crea_utente(username)
+        with app.test_client() as client:
+            self.login(client, 'mario')
+            client.post(f'/prenota/{self.menu_id}', data={'orario_ritiro': '12:00'})
+        with app.test_client() as client:
+            self.login(client, 'luigi')
+            client.post(f'/prenota/{self.menu_id}', data={'orario_ritiro': '12:00'})
+        prenotazioni = db.session.scalars(sa.select(Prenotazione)).all()
+        self.assertEqual([p.utente.username for p in prenotazioni], ['mario'])
+
+
+class ProfiloSqliteCase(SpeedMensaTestCase):
+    def test_pragma_applicati(self):
+        with db.engine.connect() as conn:
+            pragma = {nome: conn.exec_driver_sql(f'PRAGMA {nome}').scalar()
+                      for nome in ('journal_mode', 'synchronous', 'busy_timeout')}
+        self.assertEqual(pragma, {'journal_mode': 'wal', 'synchronous': 1, 'busy_timeout': 5000})
+
+    def test_scritture_in_coda(self):
+        # Con un busy handler così breve il secondo scrittore fallirebbe prima del commit del primo
+        engine = sa.create_engine(app.config['SQLALCHEMY_DATABASE_URI'], connect_args={'timeout': 0.05})
+        configura_sqlite(engine, 'predefinito', serializza_scritture=True)
+
+        def scrivi(orario):
+            with engine.begin() as conn:
+                conn.execute(sa.insert(PostiSlot).values(menu_id=1, orario_ritiro=orario, occupati=0))
+
+        try:
+            with engine.connect() as prima, ThreadPoolExecutor(max_workers=1) as executor:
+                prima.execute(sa.insert(PostiSlot).values(menu_id=1, orario_ritiro='12:00', occupati=0))
+                seconda = executor.submit(scrivi, '12:30')
+                time.sleep(0.2)
+                self.assertFalse(seconda.done())
+                prima.commit()
+                seconda.result()
+        finally:
+            engine.dispose()
+        self.assertEqual(posti_per_slot(1, ['12:00', '12:30']), {'12:00': 50, '12:30': 50})
+
+
+class ScadenzaPrenotazioniCase(SpeedMensaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.capienza = app.config['POSTI_DISPONIBILI_PER_SLOT']
+        gestore = self.crea_utente('gestore', is_gestore=True)
+        self.menu_id = self.crea_menu(gestore).id
+        self.utente = self.crea_utente('luigi')
+
+    def tearDown(self):
+        app.config['POSTI_DISPONIBILI_PER_SLOT'] = self.capienza
+        super().tearDown()
+
+    def prenota(self, minuti_fa, stato='in_attesa', orario='12:00'):
+        occupa_posto(self.menu_id, orario)
+        prenotazione = Prenotazione(utente_id=self.utente.id, menu_id=self.menu_id, orario_ritiro=orario,
+                                    stato=stato, created_at=datetime.now() - timedelta(minutes=minuti_fa))
+        db.session.add(prenotazione)
+        db.session.commit()
+        return prenotazione.id
+
+    def test_scadi_prenotazioni(self):
+        vecchie = [self.prenota(60), self.prenota(60, orario='12:30')]
+        recente = self.prenota(5)
+        pagata = self.prenota(60, stato='pagata')
+        in_pagamento = self.prenota(60)
+        db.session.add(ChiaveIdempotenza(chiave='ORDER-1', prenotazione_id=in_pagamento,
+                                         utente_id=self.utente.id))
+        db.session.commit()
+
+        # Un UPDATE sulle prenotazioni, poi statement per slot (e uno per menu, la versione)
+        # e non per prenotazione
+        with self.budget_query(8):
+            self.assertEqual(scadi_prenotazioni(timedelta(minutes=20)), 2)
+        db.session.commit()
+        stati = dict(db.session.execute(sa.select(Prenotazione.id, Prenotazione.stato)).all())
+        self.assertEqual([stati[id] for id in vecchie], ['scaduta', 'scaduta'])
+        self.assertEqual([stati[recente], stati[pagata], stati[in_pagamento]],
+                         ['in_attesa', 'pagata', 'in_attesa'])
+        self.assertEqual(posti_per_slot(self.menu_id, ['12:00', '12:30']),
+                         {'12:00': self.capienza - 3, '12:30': self.capienza})
+        self.assertEqual(verifica(), [])
+
+        esito = app.test_cli_runner().invoke(args=['prenotazioni', 'scadi', '--ttl', '1'])
+        self.assertIn('Prenotazioni scadute: 1', esito.output)
+
+    def test_slot_pieno_libera_prenotazioni_scadute(self):
+        app.config['POSTI_DISPONIBILI_PER_SLOT'] = 1
+        abbandonata = self.prenota(60)
+        self.crea_utente('mario')
+        with app.test_client() as client:
+            self.login(client, 'mario')
+            client.post(f'/prenota/{self.menu_id}', data={'orario_ritiro': '12:00'})
+        self.assertEqual(db.session.get(Prenotazione, abbandonata).stato, 'scaduta')
+        self.assertEqual(db.session.scalar(
+            sa.select(sa.func.count(Prenotazione.id)).where(Prenotazione.stato == 'in_attesa')), 1)
+        self.assertEqual(posti_rimanenti(self.menu_id, '12:00'), 0)
+
+
+    def test_cancellare_una_prenotazione_scaduta_non_libera_altri_posti(self):
+        scaduta = self.prenota(60)
+        scadi_prenotazioni(timedelta(minutes=20))
+        db.session.commit()
+        self.crea_utente('mario')
+        with app.test_client() as client:
+            self.login(client, 'mario')
+            client.post(f'/prenota/{self.menu_id}', data={'orario_ritiro': '12:00'})
+        self.assertEqual(posti_rimanenti(self.menu_id, '12:00'), self.capienza - 1)
+        # Le richieste del test condividono `g`: si dimentica l'utente della richiesta precedente
+        g.pop('_login_user', None)
+        with app.test_client() as client:
+            self.login(client, 'luigi')
+            client.post(f'/prenotazione/{scaduta}/cancella')
+        self.assertEqual(db.session.get(Prenotazione, scaduta).stato, 'cancellata')
+        self.assertEqual(posti_rimanenti(self.menu_id, '12:00'), self.capienza - 1)
+        self.assertEqual(verifica(), [])
+
+class QueryBudgetCase(SpeedMensaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.gestore = self.crea_utente('gestore', is_gestore=True)
+        self.studenti = [self.crea_utente(f'studente{i}') for i in range(30)]
+        self.menu = [self.crea_menu(self.gestore, giorni=i) for i in range(1, 11)]
+        for i, studente in enumerate(self.studenti):
+            for menu in self.menu:
+                db.session.add(Prenotazione(utente_id=studente.id, menu_id=menu.id,
+                                            orario_ritiro='12:00', stato='pagata'))
+        db.session.commit()
+
+    def test_profilo(self):
+        with app.test_client() as client:
+            self.login(client, 'studente0')
+            with self.budget_query(4):
+                self.assertEqual(client.get('/profilo').status_code, 200)
+
+    def test_prenotazioni_menu_gestore(self):
+        with app.test_client() as client:
+            self.login(client, 'gestore')
+            with self.budget_query(4):
+                risposta = client.get(f'/gestore/menu/{self.menu[0].id}/prenotazioni')
+        self.assertIn(b'STUDENTE29', risposta.data)
+
+
+    def test_registrazione(self):
+        dati = {'username': 'matricola', 'email': 'matricola@studenti.uniparthenope.it', 'nome': 'Anna',
+                'cognome': 'Bianchi', 'matricola': 'M0001', 'password': 'segreta', 'password2': 'segreta'}
+        with app.test_client() as client:
+            # Una SELECT per i tre vincoli di unicità, poi l'INSERT
+            with self.budget_query(2):
+                self.assertEqual(client.post('/register', data=dati).status_code, 302)
+
+
+class UnicitaCase(SpeedMensaTestCase):
+    DATI = {'username': 'studente', 'email': 'studente@studenti.uniparthenope.it', 'nome': 'Anna',
+            'cognome': 'Bianchi', 'matricola': 'STUDENTE', 'password': 'segreta', 'password2': 'segreta'}
+
+    def test_campi_occupati(self):
+        self.crea_utente('studente')
+        with app.test_client() as client:
+            risposta = client.post('/register', data=dict(self.DATI, username='altro'))
+        self.assertEqual(risposta.status_code, 200)
+        self.assertNotIn(b'Username utilizzato', risposta.data)
+        self.assertIn(b'Email associata ad un utente', risposta.data)
+        self.assertIn(b'Matricola associata ad un utente.', risposta.data)
+
+    def test_profilo_ignora_valori_propri(self):
+        self.crea_utente('studente')
+        self.crea_utente('collega')
+        with app.test_request_context(method='POST', data=dict(self.DATI, matricola='COLLEGA')):
+            form = EditProfileForm('studente', 'studente@studenti.uniparthenope.it', 'STUDENTE')
+            self.assertFalse(form.validate())
+        self.assertEqual(set(form.errors), {'matricola'})
+
+    def test_integrity_error_riportato_sul_campo(self):
+        with app.test_request_context(method='POST', data=self.DATI):
+            form = RegistrationForm()
+            self.assertTrue(form.validate())
+            # Un'altra richiesta registra gli stessi dati tra validazione e commit
+            self.crea_utente('studente')
+            self.assertTrue(form.segnala_duplicati())
+        self.assertEqual(set(form.errors), {'username', 'email', 'matricola'})
+
+
+class QueryPlanCase(SpeedMensaTestCase):
+    """EXPLAIN QUERY PLAN delle query più frequenti: ognuna deve usare l'indice previsto.
+
+    Fallisce se una modifica ai modelli o alle query fa tornare una scansione completa.
+    """
+
+    def piani(self, esegui):
+        """Piano SQLite di ogni statement eseguito da `esegui`, con gli stessi parametri"""
+        statements = []
+
+        def registra(conn, cursor, statement, parameters, context, executemany):
+            statements.append((statement, parameters))
+
+        sa.event.listen(db.engine, 'before_cursor_execute', registra)
+        try:
+            esegui()
+        finally:
+            sa.event.remove(db.engine, 'before_cursor_execute', registra)
+        conn = db.session.connection()
+        return [[riga[3] for riga in conn.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters)]
+                for statement, parameters in statements]
+
+    def assertUsaIndice(self, esegui, indice):
+        piano = [dettaglio for piano in self.piani(esegui) for dettaglio in piano]
+        self.assertTrue(any(indice in dettaglio for dettaglio in piano), piano)
+        for dettaglio in piano:
+            self.assertFalse(dettaglio.startswith('SCAN'), f'scansione completa: {piano}')
+            self.assertNotIn('TEMP B-TREE', dettaglio, piano)
+
+    def test_piani_query_frequenti(self):
+        oggi = date.today()
+        casi = [
+            (lambda: db.session.scalar(queries.prenotazione_attiva(1, 1)),
+             'ix_prenotazione_utente_menu_stato'),
+            (lambda: db.session.scalars(queries.prenotazioni_menu(1, ['confermata', 'pagata'])).all(),
+             'ix_prenotazione_menu_orario_stato'),
+            (lambda: db.session.scalars(queries.menu_disponibili(oggi)).all(),
+             'ix_menu_giornaliero_disponibile_data'),
+            (lambda: db.session.scalars(queries.menu_gestore(1)).all(),
+             'ix_menu_giornaliero_gestore_data'),
+            (lambda: db.session.scalars(queries.prenotazioni_utente(1).limit(10)).all(),
+             'ix_prenotazione_utente_created'),
+            (lambda: scadi_prenotazioni(timedelta(minutes=20)),
+             'ix_prenotazione_in_attesa_created'),
+            (lambda: db.session.execute(queries.esporta_prenotazioni(1, dal=oggi)).all(),
+             'ix_menu_giornaliero_gestore_data'),
+            (lambda: db.session.execute(queries.esporta_transazioni(datetime(2026, 1, 1),
+                                                                    datetime(2026, 2, 1))).all(),
+             'ix_transazione_created'),
+        ]
+        for esegui, indice in casi:
+            with self.subTest(indice=indice):
+                self.assertUsaIndice(esegui, indice)
+
+    def test_piano_riconciliazione(self):
+        self.assertUsaIndice(lambda: riconcilia(timedelta(minutes=15), timedelta(hours=3)),
+                             'ix_transazione_in_attesa')
+
+
+class PaginazioneKeysetCase(SpeedMensaTestCase):
+    def setUp(self):
+        super().setUp()
+        gestore = self.crea_utente('gestore', is_gestore=True)
+        self.utente = self.crea_utente('mario')
+        menu = self.crea_menu(gestore)
+        inizio = datetime(2025, 1, 1, 12, 0)
+        # Coppie con lo stesso created_at per verificare lo spareggio sull'id
+        for i in range(25):
+            db.session.add(Prenotazione(utente_id=self.utente.id, menu_id=menu.id,
+                                        orario_ritiro='12:00', stato='cancellata',
+                                        created_at=inizio + timedelta(days=i // 2)))
+        db.session.commit()
+        self.attese = [p.id for p in db.session.scalars(
+            sa.select(Prenotazione).order_by(Prenotazione.created_at.desc(), Prenotazione.id.desc())
+        )]
+
+    def pagina(self, cursore=None):
+        query = queries.prenotazioni_utente(self.utente.id)
+        return PaginaKeyset.da_cursore(query, Prenotazione, 10, cursore)
+
+    def test_avanti_e_indietro(self):
+        pagine = [self.pagina()]
+        while pagine[-1].next_cursor:
+            pagine.append(self.pagina(pagine[-1].next_cursor))
+        self.assertEqual([p.id for pagina in pagine for p in pagina.items], self.attese)
+        self.assertFalse(pagine[0].has_prev)
+        indietro = self.pagina(pagine[-1].prev_cursor)
+        self.assertEqual([p.id for p in indietro.items], self.attese[10:20])
+        indietro = self.pagina(indietro.prev_cursor)
+        self.assertEqual([p.id for p in indietro.items], self.attese[:10])
+        self.assertIsNone(indietro.prev_cursor)
+
+    def test_vecchi_link_e_cursore_non_valido(self):
+        with app.test_client() as client:
+            self.login(client, 'mario')
+            self.assertEqual(client.get('/profilo?pren_page=3&trans_page=2').status_code, 200)
+            # Sfogliando le prenotazioni la pagina delle transazioni resta quella del vecchio link
+            pagina = client.get('/profilo?pren_page=2&trans_page=2').get_data(as_text=True)
+            link = re.findall(r'href="(/profilo\?[^"]*pren_cursor[^"]*)"', pagina)
+            self.assertEqual(len(link), 2)
+            self.assertTrue(all('trans_page=2' in href for href in link), link)
+            self.assertEqual(client.get('/profilo?pren_cursor=xyz').status_code, 302)
+        query = queries.prenotazioni_utente(self.utente.id)
+        pagina = PaginaKeyset.da_offset(query, Prenotazione, 10, 2)
+        self.assertEqual([p.id for p in pagina.items], self.attese[10:20])
+        self.assertEqual([p.id for p in self.pagina(pagina.next_cursor).items], self.attese[20:])
+
+
+class PayPalClientCase(SpeedMensaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.stub = FakePayPal().__enter__()
+        self.api_base = app.config['PAYPAL_API_BASE']
+        app.config['PAYPAL_API_BASE'] = self.stub.url
+        app.extensions.pop('paypal', None)
+
+    def tearDown(self):
+        client = app.extensions.pop('paypal', None)
+        if client:
+            client.close()
+        app.config['PAYPAL_API_BASE'] = self.api_base
+        self.stub.__exit__()
+        super().tearDown()
+
+    def test_token_condiviso_tra_thread(self):
+        client = PayPalClient(self.stub.url, 'sb', '')
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            tokens = set(executor.map(lambda _: client.get_token(), range(200)))
+        self.assertEqual(len(tokens), 1)
+        self.assertEqual(self.stub.contatori['token'], 1)
+        client.close()
+
+    def test_token_rinnovato_prima_della_scadenza(self):
+        self.stub.expires_in = 30
+        client = PayPalClient(self.stub.url, 'sb', '', margine_token=60)
+        self.assertNotEqual(client.get_token(), client.get_token())
+        client.invalida_token()
+        self.stub.expires_in = 3600
+        self.assertEqual(client.get_token(), client.get_token())
+        self.assertEqual(self.stub.contatori['token'], 3)
+        client.close()
+
+    def test_checkout_riusa_token_e_connessione(self):
+        gestore = self.crea_utente('gestore', is_gestore=True)
+        menu = self.crea_menu(gestore)
+        self.crea_utente('mario')
+        with app.test_client() as client:
+            self.login(client, 'mario')
+            client.post(f'/prenota/{menu.id}', data={'orario_ritiro': '12:30'})
+            prenotazione = db.session.scalar(sa.select(Prenotazione))
+            ordine = client.post(f'/api/payment/create/{prenotazione.id}').get_json()
+            esito = client.post(f'/api/payment/execute/{prenotazione.id}',
+                                json={'orderID': ordine['id']}).get_json()
+        self.assertEqual(esito['status'], 'success')
+        self.assertEqual(db.session.get(Prenotazione, prenotazione.id).stato, 'pagata')
+        self.assertEqual(self.stub.contatori['token'], 1)
+        self.assertEqual(self.stub.contatori['connessioni'], 1)
+
+
+class PagamentoIdempotenteCase(SpeedMensaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.stub = FakePayPal(latenza=0.05).__enter__()
+        self.api_base = app.config['PAYPAL_API_BASE']
+        app.config['PAYPAL_API_BASE'] = self.stub.url
+        app.extensions.pop('paypal', None)
+        gestore = self.crea_utente('gestore', is_gestore=True)
+        menu = self.crea_menu(gestore)
+        self.utente = self.crea_utente('mario')
+        self.prenotazione = Prenotazione(utente_id=self.utente.id, menu_id=menu.id, orario_ritiro='12:00')
+        db.session.add(self.prenotazione)
+        db.session.commit()
+        self.prenotazione_id = self.prenotazione.id
+        self.order_id = self.crea_ordine()
+
+    def tearDown(self):
+        client = app.extensions.pop('paypal', None)
+        if client:
+            client.close()
+        app.config['PAYPAL_API_BASE'] = self.api_base
+        self.stub.__exit__()
+        super().tearDown()
+
+    def crea_ordine(self, importo='5.00'):
+        return get_paypal_client().create_order({
+            'intent': 'CAPTURE', 'purchase_units': [{'amount': {'currency_code': 'EUR', 'value': importo}}]
+        })['id']
+
+    def esegui(self, client, order_id=None):
+        risposta = client.post(f'/api/payment/execute/{self.prenotazione_id}',
+                               json={'orderID': order_id or self.order_id})
+        return risposta.status_code, risposta.get_json()['status']
+
+    def test_esecuzioni_concorrenti(self):
+        clients = [app.test_client() for _ in range(8)]
+        partenza = threading.Barrier(len(clients))
+
+        def paga(client):
+            # Ogni thread ha il proprio contesto: il login va fatto lì
+            self.login(client, 'mario')
+            partenza.wait()
+            return self.esegui(client)
+
+        with ThreadPoolExecutor(max_workers=len(clients)) as executor:
+            esiti = list(executor.map(paga, clients))
+        self.assertIn((200, 'success'), esiti)
+        self.assertTrue(set(esiti) <= {(200, 'success'), (409, 'in_corso')}, esiti)
+        # Le ripetizioni successive rileggono l'esito salvato
+        self.assertEqual(self.esegui(clients[0]), (200, 'success'))
+        self.assertEqual(self.stub.contatori['catture'], 1)
+        self.assertEqual(db.session.scalar(sa.select(sa.func.count(Transazione.id))), 1)
+        db.session.expire_all()
+        prenotazione = db.session.get(Prenotazione, self.prenotazione_id)
+        self.assertEqual(prenotazione.stato, 'pagata')
+        self.assertEqual(statistiche_menu(prenotazione.menu_id, ['pagata'])['totale'], 1)
+
+    def test_prenotazione_di_altri_utenti(self):
+        self.crea_utente('luigi')
+        with app.test_client() as client:
+            self.login(client, 'luigi')
+            self.assertEqual(self.esegui(client), (404, 'failed'))
+        self.assertNotIn('catture', self.stub.contatori)
+
+    def test_secondo_ordine_rifiutato(self):
+        with app.test_client() as client:
+            self.login(client, 'mario')
+            self.assertEqual(self.esegui(client), (200, 'success'))
+            secondo = self.crea_ordine()
+            self.assertEqual(self.esegui(client, secondo), (409, 'failed'))
+        self.assertEqual(self.stub.contatori['catture'], 1)
+
+    def test_nessun_ordine_per_prenotazioni_non_in_attesa(self):
+        for stato in ('pagata', 'cancellata', 'scaduta'):
+            self.prenotazione.stato = stato
+            db.session.commit()
+            with app.test_client() as client:
+                self.login(client, 'mario')
+                risposta = client.post(f'/api/payment/create/{self.prenotazione_id}')
+            self.assertEqual(risposta.status_code, 409, stato)
+        self.assertEqual(self.stub.contatori['ordini'], 1)
+        self.assertEqual(db.session.scalar(sa.select(sa.func.count(Transazione.id))), 0)
+
+    def test_ordine_di_un_altra_prenotazione(self):
+        luigi = self.crea_utente('luigi')
+        altra = Prenotazione(utente_id=luigi.id, menu_id=self.prenotazione.menu_id, orario_ritiro='12:30')
+        db.session.add(altra)
+        db.session.commit()
+        registra_ordine(altra.id, luigi.id, 5.0, self.order_id)
+        with app.test_client() as client:
+            self.login(client, 'mario')
+            self.assertEqual(self.esegui(client), (409, 'failed'))
+        self.assertNotIn('catture', self.stub.contatori)
+        db.session.expire_all()
+        self.assertEqual(db.session.get(Prenotazione, self.prenotazione_id).stato, 'in_attesa')
+        self.assertIsNone(db.session.get(ChiaveIdempotenza, self.order_id))
+
+    def test_importo_diverso_dal_prezzo(self):
+        with app.test_client() as client:
+            self.login(client, 'mario')
+            self.assertEqual(self.esegui(client, self.crea_ordine('0.01')), (409, 'failed'))
+        db.session.expire_all()
+        self.assertEqual(db.session.get(Prenotazione, self.prenotazione_id).stato, 'in_attesa')
+        self.assertEqual(db.session.scalar(sa.select(Transazione.stato)), 'completata')
+
+    def test_errore_di_connessione_rilascia_l_ordine(self):
+        paypal = get_paypal_client()
+        paypal.get_token()
+        paypal.api_base = f'http://127.0.0.1:{porta_libera()}'
+        with app.test_client() as client:
+            self.login(client, 'mario')
+            self.assertEqual(self.esegui(client), (502, 'failed'))
+            self.assertIsNone(db.session.get(ChiaveIdempotenza, self.order_id))
+            paypal.api_base = self.stub.url
+            self.assertEqual(self.esegui(client), (200, 'success'))
+
+
+class RiconciliazioneCase(SpeedMensaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.stub = FakePayPal().__enter__()
+        self.api_base = app.config['PAYPAL_API_BASE']
+        app.config['PAYPAL_API_BASE'] = self.stub.url
+        app.extensions.pop('paypal', None)
+        gestore = self.crea_utente('gestore', is_gestore=True)
+        self.menu = self.crea_menu(gestore)
+        self.utente = self.crea_utente('mario')
+
+    def tearDown(self):
+        client = app.extensions.pop('paypal', None)
+        if client:
+            client.close()
+        app.config['PAYPAL_API_BASE'] = self.api_base
+        self.stub.__exit__()
+        super().tearDown()
+
+    def ordine(self, stato_ordine, minuti_fa, stato_prenotazione='in_attesa'):
+        """Prenotazione con transazione in attesa per un ordine nello stato indicato"""
+        prenotazione = Prenotazione(utente_id=self.utente.id, menu_id=self.menu.id,
+                                    orario_ritiro='12:00', stato=stato_prenotazione)
+        db.session.add(prenotazione)
+        db.session.flush()
+        order_id = f'ORDER-{prenotazione.id}'
+        if stato_ordine:
+            self.stub.ordini[order_id] = stato_ordine
+            self.stub.importi[order_id] = '5.00'
+        db.session.add(Transazione(utente_id=self.utente.id, prenotazione_id=prenotazione.id,
+                                   tipo='pagamento_pasto', importo=5.0, metodo_pagamento='PayPal',
+                                   stato='in_attesa', paypal_order_id=order_id,
+                                   created_at=datetime.now() - timedelta(minutes=minuti_fa)))
+        db.session.commit()
+        return prenotazione.id, order_id
+
+    def stati(self, prenotazione_id, order_id):
+        db.session.expire_all()
+        transazione = db.session.scalar(sa.select(Transazione).where(Transazione.paypal_order_id == order_id))
+        return db.session.get(Prenotazione, prenotazione_id).stato, transazione.stato
+
+    def test_riconcilia(self):
+        catturato = self.ordine('COMPLETED', 60)
+        db.session.add(ChiaveIdempotenza(chiave=catturato[1], prenotazione_id=catturato[0],
+                                         utente_id=self.utente.id))
+        db.session.commit()
+        approvato = self.ordine('APPROVED', 60)
+        # Chiave rimasta in corso dopo un timeout della cattura
+        db.session.add(ChiaveIdempotenza(chiave=approvato[1], prenotazione_id=approvato[0],
+                                         utente_id=self.utente.id))
+        db.session.commit()
+        sottopagato = self.ordine('COMPLETED', 60)
+        self.stub.importi[sottopagato[1]] = '0.50'
+        abbandonato = self.ordine('APPROVED', 600)
+        sconosciuto = self.ordine(None, 60)
+        cancellato = self.ordine('COMPLETED', 60, stato_prenotazione='cancellata')
+        recente = self.ordine('COMPLETED', 1)
+
+        esito = app.test_cli_runner().invoke(
+            args=['pagamenti', 'riconcilia', '--blocco', '2', '--concorrenza', '4'])
+        self.assertIn('Transazioni verificate: 6', esito.output)
+        self.assertEqual(self.stub.contatori['consultazioni'], 5)
+        self.assertEqual(self.stati(*catturato), ('pagata', 'completata'))
+        self.assertEqual(self.stati(*approvato), ('in_attesa', 'in_attesa'))
+        self.assertIsNone(db.session.get(ChiaveIdempotenza, approvato[1]))
+        self.assertEqual(self.stati(*sottopagato), ('in_attesa', 'completata'))
+        self.assertEqual(self.stati(*abbandonato), ('in_attesa', 'fallita'))
+        self.assertEqual(self.stati(*sconosciuto), ('in_attesa', 'fallita'))
+        self.assertEqual(self.stati(*cancellato), ('cancellata', 'completata'))
+        self.assertEqual(self.stati(*recente), ('in_attesa', 'in_attesa'))
+        self.assertEqual(db.session.get(ChiaveIdempotenza, catturato[1]).stato, 'completata')
+        self.assertEqual(verifica(), [])
+
+        # Una seconda esecuzione verifica solo l'ordine ancora aperto
+        esito = app.test_cli_runner().invoke(args=['pagamenti', 'riconcilia'])
+        self.assertIn('Transazioni verificate: 1', esito.output)
+
+
+def porta_libera():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class SinkSMTP:
+    """Server SMTP locale che conserva i messaggi ricevuti"""
+
+    def __init__(self):
+        self.messaggi = []
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messaggi.append(envelope)
+        return '250 OK'
+
+
+class EmailWorkerPoolCase(SpeedMensaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.stato_mail = app.extensions['mail']
+        self.originale = vars(self.stato_mail).copy()
+        self.stato_mail.server = '127.0.0.1'
+        self.stato_mail.port = porta_libera()
+        self.stato_mail.use_tls = False
+        self.stato_mail.username = None
+        self.stato_mail.suppress = False
+
+    def tearDown(self):
+        vars(self.stato_mail).update(self.originale)
+        super().tearDown()
+
+    def messaggio(self, i):
+        msg = Message(f'Test {i}', sender='mensa@example.com', recipients=['studente@example.com'])
+        msg.body = 'Buon appetito'
+        return msg
+
+    def test_connessione_riusata_dai_worker(self):
+        sink = SinkSMTP()
+        controller = Controller(sink, hostname='127.0.0.1', port=self.stato_mail.port)
+        controller.start()
+        try:
+            pool = EmailWorkerPool(app, workers=2, maxsize=100)
+            for i in range(40):
+                pool.submit(self.messaggio(i))
+            pool.shutdown()
+        finally:
+            controller.stop()
+        metriche = pool.metriche()
+        self.assertEqual(len(sink.messaggi), 40)
+        self.assertEqual(metriche['inviate'], 40)
+        self.assertEqual(metriche['in_coda'], 0)
+        self.assertLessEqual(metriche['connessioni'], 2)
+
+    def test_ritenta_e_poi_scarta(self):
+        pool = EmailWorkerPool(app, workers=1, tentativi=3, backoff=0.01)
+        pool.submit(self.messaggio(0))
+        pool.shutdown()
+        metriche = pool.metriche()
+        self.assertEqual((metriche['inviate'], metriche['fallite'], metriche['ritentativi']), (0, 1, 2))
+
+    def test_errore_della_callback_non_ferma_il_worker(self):
+        esiti = []
+
+        def al_termine(msg, inviato):
+            esiti.append(inviato)
+            raise RuntimeError('callback guasta')
+
+        pool = EmailWorkerPool(app, workers=1, tentativi=1)
+        for i in range(3):
+            pool.submit(self.messaggio(i), al_termine=al_termine)
+        pool.shutdown(timeout=5)
+        self.assertEqual(esiti, [False, False, False])
+        self.assertEqual(pool.metriche()['in_coda'], 0)
+
+    def test_shutdown_con_coda_piena_rispetta_il_timeout(self):
+        pool = EmailWorkerPool(app, workers=1, maxsize=1, tentativi=2, backoff=1.0)
+        # Il worker è fermo nel backoff del primo messaggio, il secondo riempie la coda
+        pool.submit(self.messaggio(0))
+        pool.submit(self.messaggio(1))
+        self.addCleanup(pool.coda.put, None)
+        inizio = time.monotonic()
+        pool.shutdown(timeout=0.2)
+        self.assertLess(time.monotonic() - inizio, 0.9)
+
+
+class LogCase(SpeedMensaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.logger = logging.getLogger('speedmensa.test')
+        self.logger.propagate = False
+
+    def tearDown(self):
+        self.logger.handlers.clear()
+        super().tearDown()
+
+    def test_record_json_dalla_coda(self):
+        uscita = io.StringIO()
+        destinazione = logging.StreamHandler(uscita)
+        destinazione.setFormatter(FormatterJSON())
+        coda = CodaLog(queue.Queue())
+        listener = QueueListener(coda.queue, destinazione)
+        self.logger.addHandler(coda)
+        listener.start()
+        with app.test_request_context('/prenota/3', method='POST'):
+            try:
+                1 / 0
+            except ZeroDivisionError:
+                self.logger.exception('Prenotazione %s non riuscita', 3)
+        listener.stop()
+        record = json.loads(uscita.getvalue())
+        self.assertEqual(record['livello'], 'ERROR')
+        self.assertEqual(record['messaggio'], 'Prenotazione 3 non riuscita')
+        self.assertEqual(record['richiesta']['percorso'], '/prenota/3')
+        self.assertIn('ZeroDivisionError', record['eccezione'])
+
+    def test_email_digest(self):
+        sink = SinkSMTP()
+        controller = Controller(sink, hostname='127.0.0.1', port=porta_libera())
+        controller.start()
+        try:
+            handler = EmailDigest(('127.0.0.1', controller.port), 'mensa@example.com', ['admin@example.com'],
+                                  'Errore Gestione Mensa', intervallo=0.3)
+            self.logger.addHandler(handler)
+            self.logger.error('Primo errore')
+            for i in range(4):
+                self.logger.error('Errore PayPal %d', i)
+            self.logger.error('Altro errore')
+            self.assertEqual(len(sink.messaggi), 1)
+            time.sleep(0.6)
+            handler.close()
+        finally:
+            controller.stop()
+        oggetti = [message_from_bytes(m.content)['Subject'] for m in sink.messaggi]
+        self.assertEqual(oggetti, ['Errore Gestione Mensa', 'Errore Gestione Mensa: 5 errori (2 distinti)'])
+        self.assertIn('4 × ERROR', message_from_bytes(sink.messaggi[1].content).get_payload())
+
+
+class PromemoriaCase(SpeedMensaTestCase):
+    def test_promemoria_inviati_una_volta(self):
+        gestore = self.crea_utente('gestore', is_gestore=True)
+        menu = self.crea_menu(gestore, giorni=0)
+        for i in range(5):
+            studente = self.crea_utente(f'studente{i}')
+            db.session.add(Prenotazione(utente_id=studente.id, menu_id=menu.id, orario_ritiro='12:30',
+                                        stato='pagata' if i < 4 else 'in_attesa'))
+        db.session.commit()
+        runner = app.test_cli_runner()
+        with mail.record_messages() as outbox:
+            with self.budget_query(4) as statements:
+                esito = runner.invoke(args=['promemoria', '--orario', '12:30', '--blocco', '3'])
+            self.assertIn('Promemoria inviati: 4', esito.output)
+            self.assertEqual(len([s for s in statements if s.startswith('SELECT')]), 1)
+            esito = runner.invoke(args=['promemoria', '--orario', '12:30'])
+            self.assertIn('Nessun promemoria', esito.output)
+        self.assertEqual(sorted(m.recipients[0] for m in outbox),
+                         [f'studente{i}@studenti.uniparthenope.it' for i in range(4)])
+        self.assertIn('12:30', outbox[0].body)
+
+
+class ImportazioneUtentiCase(SpeedMensaTestCase):
+    CSV = ('matricola;nome;cognome;email\n'
+           'N0001;Anna;Bianchi;Anna.Bianchi@studenti.uniparthenope.it\n'
+           'N0002;Luca;Verdi;luca.verdi@studenti.uniparthenope.it\n'
+           'N0001;Anna;Bianchi;altra@studenti.uniparthenope.it\n'
+           'STUDENTE;Mario;Rossi;nuova@studenti.uniparthenope.it\n'
+           'N0003;;Neri;neri@studenti.uniparthenope.it\n'
+           'N0004;Sara;Gialli;sara.gialli@studenti.uniparthenope.it\n')
+
+    def importa(self, *opzioni):
+        self.crea_utente('studente')
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as file:
+            file.write(self.CSV)
+        self.addCleanup(os.remove, file.name)
+        return app.test_cli_runner().invoke(
+            args=['utenti', 'importa', file.name, '--delimitatore', ';', '--blocco', '2', *opzioni])
+
+    def test_duplicati_e_righe_non_valide_saltati(self):
+        # Creato da un'importazione interrotta prima degli inviti: senza password, va invitato
+        db.session.add(User(username='N0002', matricola='N0002', nome='Luca', cognome='Verdi',
+                            email='luca.verdi@studenti.uniparthenope.it'))
+        db.session.commit()
+        with mail.record_messages() as outbox:
+            esito = self.importa('--inviti', '--url', 'https://mensa.example.com')
+        self.assertIn('Utenti creati: 2 su 6 righe', esito.output)
+        self.assertIn('già presenti 3, non valide 1', esito.output)
+        self.assertIn('riga 4: già presente: matricola', esito.stderr)
+        nuovo = db.session.scalar(sa.select(User).where(User.matricola == 'N0001'))
+        self.assertEqual((nuovo.username, nuovo.email), ('N0001', 'anna.bianchi@studenti.uniparthenope.it'))
+        self.assertIsNone(nuovo.password_hash)
+        self.assertEqual(sorted(m.recipients[0] for m in outbox),
+                         ['anna.bianchi@studenti.uniparthenope.it', 'luca.verdi@studenti.uniparthenope.it',
+                          'sara.gialli@studenti.uniparthenope.it'])
+        token = re.search(r'reset_password/(\S+)', outbox[0].body).group(1)
+        self.assertEqual(User.verify_reset_password_token(token).email, outbox[0].recipients[0])
+        self.assertIn('https://mensa.example.com/', outbox[0].body)
+
+    def test_modalita_obbligatoria(self):
+        esito = self.importa()
+        self.assertEqual(esito.exit_code, 2)
+        self.assertIn('--inviti oppure --credenziali', esito.output)
+        self.assertEqual(db.session.scalar(sa.select(sa.func.count(User.id))), 1)
+
+    def test_credenziali_generate(self):
+        app.config['PASSWORD_PROFILO'] = 'pbkdf2:sha256:1'
+        self.addCleanup(app.config.__setitem__, 'PASSWORD_PROFILO', 'standard')
+        with tempfile.TemporaryDirectory() as cartella:
+            percorso = os.path.join(cartella, 'credenziali.csv')
+            esito = self.importa('--credenziali', percorso, '--processi', '1')
+            self.assertEqual(esito.exit_code, 0, esito.output)
+            with open(percorso, encoding='utf-8') as file:
+                credenziali = list(csv.DictReader(file))
+        self.assertEqual([riga['matricola'] for riga in credenziali], ['N0001', 'N0002', 'N0004'])
+        with app.test_client() as client:
+            risposta = client.post('/login', data={'username': 'N0002', 'password': credenziali[1]['password']})
+        self.assertEqual(risposta.status_code, 302)
+
+
+class PianificazioneMenuCase(SpeedMensaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.gestore = self.crea_utente('gestore', is_gestore=True)
+
+    def settimana(self, dal=1):
+        return [{'data': (date.today() + timedelta(days=dal + i)).isoformat(), 'primo': f'Primo {i}',
+                 'secondo': 'Pollo', 'contorno': 'Insalata', 'prezzo': 5.5} for i in range(7)]
+
+    def date_menu(self):
+        return db.session.scalars(sa.select(MenuGiornaliero.data).order_by(MenuGiornaliero.data)).all()
+
+    def test_api_una_query_per_i_conflitti(self):
+        with app.test_client() as client:
+            self.login(client, 'gestore')
+            client.get('/index')
+            with self.budget_query(3) as statements:
+                risposta = client.post('/api/gestore/menu', json={'menu': self.settimana()})
+            self.assertEqual(risposta.status_code, 201)
+            self.assertEqual(risposta.get_json(), {'creati': 7})
+            self.assertEqual(len([s for s in statements if s.startswith('INSERT')]), 1)
+            risposta = client.post('/api/gestore/menu', json=self.settimana(dal=7))
+        self.assertEqual(risposta.status_code, 400)
+        self.assertEqual(risposta.get_json()['errori'],
+                         [f'esiste già un menu per il {date.today() + timedelta(days=7)}'])
+        self.assertEqual(len(self.date_menu()), 7)
+
+    def test_api_portata_non_testuale(self):
+        settimana = self.settimana()
+        settimana[2]['primo'] = 5
+        with app.test_client() as client:
+            self.login(client, 'gestore')
+            risposta = client.post('/api/gestore/menu', json=settimana)
+        self.assertEqual(risposta.status_code, 400)
+        self.assertEqual(risposta.get_json()['errori'],
+                         [f'menu 3: {date.today() + timedelta(days=3)}: primo deve essere un testo'])
+        self.assertEqual(self.date_menu(), [])
+
+    def test_griglia(self):
+        domani = date.today() + timedelta(days=1)
+        with app.test_client() as client:
+            self.login(client, 'gestore')
+            self.assertIn(b'righe-6-giorno', client.get('/gestore/menu/pianifica').data)
+            risposta = client.post('/gestore/menu/pianifica', data={
+                'righe-0-giorno': domani.isoformat(), 'righe-0-primo': 'Risotto', 'righe-0-secondo': 'Pesce',
+                'righe-0-contorno': 'Patate', 'righe-0-prezzo': '6', 'righe-0-disponibile': 'y',
+                'righe-1-giorno': (domani + timedelta(days=1)).isoformat(), 'righe-1-primo': '',
+                'righe-2-giorno': (domani + timedelta(days=2)).isoformat(), 'righe-2-primo': 'Lasagne',
+                'righe-2-secondo': 'Arrosto', 'righe-2-contorno': 'Spinaci', 'righe-2-prezzo': ''})
+        self.assertEqual(risposta.status_code, 302)
+        self.assertEqual(self.date_menu(), [domani, domani + timedelta(days=2)])
+        lasagne = db.session.scalar(sa.select(MenuGiornaliero).where(MenuGiornaliero.primo == 'Lasagne'))
+        self.assertEqual((lasagne.prezzo, lasagne.disponibile), (5.0, False))
+
+    def test_clona_periodo(self):
+        with app.test_client() as client:
+            self.login(client, 'gestore')
+            client.post('/api/gestore/menu', json=self.settimana())
+            dati = {'clona-dal': (date.today() + timedelta(days=1)).isoformat(),
+                    'clona-al': (date.today() + timedelta(days=3)).isoformat(),
+                    'clona-inizio': (date.today() + timedelta(days=15)).isoformat()}
+            with self.budget_query(3) as statements:
+                client.post('/gestore/menu/clona', data=dati)
+            self.assertEqual(len([s for s in statements if s.startswith('INSERT INTO menu_giornaliero')]), 1)
+            # Il periodo di arrivo è ora occupato: la seconda copia non crea nulla
+            client.post('/gestore/menu/clona', data=dati)
+        copie = db.session.scalars(sa.select(MenuGiornaliero).where(
+            MenuGiornaliero.data >= date.today() + timedelta(days=15)).order_by(MenuGiornaliero.data)).all()
+        self.assertEqual([(menu.data, menu.primo, menu.prezzo) for menu in copie],
+                         [(date.today() + timedelta(days=15 + i), f'Primo {i}', 5.5) for i in range(3)])
+        self.assertEqual(copie[0].gestore_id, self.gestore.id)
+
+    def test_cli_tutto_o_niente(self):
+        menu = self.settimana()
+        menu[3]['data'] = menu[2]['data']
+        with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as file:
+            json.dump(menu, file)
+        self.addCleanup(os.remove, file.name)
+        esito = app.test_cli_runner().invoke(args=['menu', 'pianifica', file.name, '--gestore', 'gestore'])
+        self.assertEqual(esito.exit_code, 1)
+        self.assertIn(f'{menu[2]["data"]} compare più volte', esito.stderr)
+        self.assertEqual(self.date_menu(), [])
+
+
+class EsportazioneCase(SpeedMensaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.gestore = self.crea_utente('gestore', is_gestore=True)
+        altro = self.crea_utente('altro', is_gestore=True)
+        self.studente = self.crea_utente('studente')
+        self.menu = [self.crea_menu(self.gestore, giorni=i) for i in (1, 2)] + [self.crea_menu(altro, giorni=3)]
+        for i, menu in enumerate(self.menu):
+            prenotazione = Prenotazione(utente_id=self.studente.id, menu_id=menu.id, orario_ritiro='12:30',
+                                        stato='pagata', note='=HYPERLINK("x")' if i == 0 else None)
+            db.session.add(prenotazione)
+            db.session.flush()
+            db.session.add(Transazione(utente_id=self.studente.id, prenotazione_id=prenotazione.id,
+                                       tipo='pagamento_pasto', importo=5.0, metodo_pagamento='paypal',
+                                       created_at=datetime(2026, 3 + i, 15, 12, 0)))
+        db.session.commit()
+
+    def scarica(self, url):
+        with app.test_client() as client:
+            self.login(client, 'gestore')
+            risposta = client.get(url)
+            self.assertTrue(risposta.is_streamed)
+            testo = risposta.get_data(as_text=True)
+        self.assertTrue(testo.startswith('\ufeff'))
+        return list(csv.DictReader(io.StringIO(testo[1:])))
+
+    def test_prenotazioni_del_gestore(self):
+        righe = self.scarica('/gestore/esporta/prenotazioni.csv')
+        self.assertEqual([int(riga['menu_id']) for riga in righe], [self.menu[0].id, self.menu[1].id])
+        self.assertEqual(righe[0]['matricola'], 'STUDENTE')
+        self.assertEqual(righe[0]['note'], '\'=HYPERLINK("x")')
+        dal = (date.today() + timedelta(days=2)).isoformat()
+        righe = self.scarica(f'/gestore/esporta/prenotazioni.csv?dal={dal}')
+        self.assertEqual([riga['data'] for riga in righe], [dal])
+
+    def test_transazioni_del_mese(self):
+        righe = self.scarica('/gestore/esporta/transazioni.csv?mese=2026-04')
+        self.assertEqual([(riga['data_ora'], riga['importo']) for riga in righe], [('2026-04-15 12:00:00', '5.0')])
+        with app.test_client() as client:
+            self.login(client, 'gestore')
+            self.assertEqual(client.get('/gestore/esporta/transazioni.csv?mese=aprile').status_code, 400)
+
+    def test_csv_a_blocchi(self):
+        pezzi = list(csv_a_blocchi(['n'], ([i] for i in range(25)), blocco=10))
+        self.assertEqual(len(pezzi), 3)
+        self.assertEqual(b''.join(pezzi).decode('utf-8-sig').split(), ['n'] + [str(i) for i in range(25)])
+
+
+class MenuCacheCase(SpeedMensaTestCase):
+    def test_index_letto_dalla_cache_e_invalidato(self):
+        gestore = self.crea_utente('gestore', is_gestore=True)
+        self.crea_menu(gestore, giorni=1)
+        hits, misses = menu_cache.hits, menu_cache.misses
+        with app.test_client() as client:
+            self.login(client, 'gestore')
+            client.get('/index')
+            with self.budget_query(1):
+                client.get('/index')
+            client.post('/gestore/menu/nuovo', data={
+                'data': (date.today() + timedelta(days=2)).isoformat(), 'primo': 'Risotto',
+                'secondo': 'Pesce', 'contorno': 'Patate', 'prezzo': '6', 'disponibile': 'y'})
+            risposta = client.get('/index')
+        self.assertIn(b'Risotto', risposta.data)
+        self.assertEqual((menu_cache.hits - hits, menu_cache.misses - misses), (1, 2))
+
+    def test_scadenza_e_lru(self):
+        cache = CacheMemoria(ttl=60, maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual((cache.get('a'), cache.get('c')), (1, 3))
+        self.assertIsNot(cache.get('b'), 2)
+        cache.ttl = 0
+        cache.set('d', 4)
+        self.assertIsNot(cache.get('d'), 4)
+
+    def test_utente_in_cache_e_invalidato(self):
+        user = self.crea_utente('mario')
+        snapshot = load_user(str(user.id))
+        self.assertIsInstance(snapshot, UtenteSnapshot)
+        self.assertEqual(snapshot, user)
+        with self.budget_query(0):
+            self.assertEqual(load_user(str(user.id)).nome, 'Mario')
+        with app.test_client() as client:
+            self.login(client, 'mario')
+            # Le richieste del test condividono `g`: si forza il current_user dalla cache
+            g.pop('_login_user', None)
+            client.post('/edit_profilo', data={'username': 'mario', 'email': 'mario@studenti.uniparthenope.it',
+                                               'nome': 'Marco', 'cognome': 'Rossi', 'matricola': 'MARIO'})
+        self.assertEqual(load_user(str(user.id)).nome, 'Marco')
+
+    def test_backend_file(self):
+        with tempfile.TemporaryDirectory() as cartella:
+            cache = ReadThroughCache(CacheFile(60, cartella))
+            self.assertEqual(cache.get_or_load('menu:1', lambda: [1, 2]), [1, 2])
+            altra = ReadThroughCache(CacheFile(60, cartella))
+            self.assertEqual(altra.get_or_load('menu:1', lambda: []), [1, 2])
+            altra.invalida()
+            self.assertEqual(cache.get_or_load('menu:1', lambda: []), [])
+
+
+class StreamPrenotazioniCase(SpeedMensaTestCase):
+    def test_snapshot_e_variazioni(self):
+        gestore = self.crea_utente('gestore', is_gestore=True)
+        studente = self.crea_utente('mario')
+        menu = self.crea_menu(gestore, prezzo=4.5)
+        db.session.add(Prenotazione(utente_id=studente.id, menu_id=menu.id,
+                                    orario_ritiro='12:00', stato='pagata'))
+        db.session.commit()
+        with app.test_client() as client:
+            self.login(client, 'gestore')
+            risposta = client.get(f'/gestore/menu/{menu.id}/prenotazioni/stream')
+            eventi = iter(risposta.response)
+            self.assertIn('"totale": 1', next(eventi).decode())
+            self.assertEqual(broker.iscritti(menu.id), 1)
+
+            prenotazione = Prenotazione(utente_id=studente.id, menu_id=menu.id,
+                                        orario_ritiro='13:00', stato='in_attesa')
+            db.session.add(prenotazione)
+            db.session.commit()
+            prenotazione.conferma_pagamento()
+            db.session.commit()
+            evento = next(eventi).decode()
+            self.assertTrue(evento.startswith('event: delta'))
+            self.assertIn('"orario": "13:00", "delta": 1, "incasso": 4.5', evento)
+            risposta.close()
+        self.assertEqual(broker.iscritti(menu.id), 0)
+
+    def test_eventi_gia_nello_snapshot_e_cambio_prezzo(self):
+        gestore = self.crea_utente('gestore', is_gestore=True)
+        studente = self.crea_utente('mario')
+        menu = self.crea_menu(gestore, prezzo=4.5)
+        db.session.add(Prenotazione(utente_id=studente.id, menu_id=menu.id,
+                                    orario_ritiro='12:00', stato='pagata'))
+        db.session.commit()
+        with app.test_client() as client:
+            self.login(client, 'gestore')
+            risposta = client.get(f'/gestore/menu/{menu.id}/prenotazioni/stream')
+            eventi = iter(risposta.response)
+            snapshot = json.loads(next(eventi).decode().split('data: ', 1)[1])
+            # Pagamento arrivato tra l'iscrizione e la lettura dello stato: già contato
+            broker.pubblica(menu.id, {'orario': '12:00', 'da': 'in_attesa', 'a': 'pagata',
+                                      'versione': snapshot['versione'], 'prezzo': 4.5})
+
+            client.post(f'/gestore/menu/{menu.id}/modifica', data={
+                'data': menu.data.isoformat(), 'primo': 'Pasta', 'secondo': 'Pollo',
+                'contorno': 'Insalata', 'prezzo': '6', 'disponibile': 'y'})
+            evento = next(eventi).decode()
+            self.assertTrue(evento.startswith('event: snapshot'), evento)
+            self.assertIn('"incasso": 6.0', evento)
+
+            db.session.add(Prenotazione(utente_id=studente.id, menu_id=menu.id,
+                                        orario_ritiro='13:00', stato='pagata'))
+            db.session.commit()
+            evento = next(eventi).decode()
+            self.assertIn('"orario": "13:00", "delta": 1, "incasso": 6.0', evento)
+            risposta.close()
+
+
+class StatisticheCase(SpeedMensaTestCase):
+    def test_aggregati_aggiornati_e_ricostruiti(self):
+        gestore = self.crea_utente('gestore', is_gestore=True)
+        menu = self.crea_menu(gestore, prezzo=5.0)
+        studenti = [self.crea_utente(f'studente{i}') for i in range(3)]
+        prenotazioni = [Prenotazione(utente_id=s.id, menu_id=menu.id, orario_ritiro='12:00')
+                        for s in studenti]
+        db.session.add_all(prenotazioni)
+        db.session.commit()
+        prenotazioni[0].conferma_pagamento()
+        prenotazioni[1].conferma_pagamento()
+        prenotazioni[2].cancella()
+        db.session.commit()
+        versione = db.session.scalar(sa.select(MenuGiornaliero.versione_prenotazioni)
+                                     .where(MenuGiornaliero.id == menu.id))
+        self.assertEqual(statistiche_menu(menu.id, ['pagata']),
+                         {'slot': {'12:00': 2}, 'totale': 2, 'incasso': 10.0, 'versione': versione})
+        self.assertEqual(statistiche_menu(menu.id, ['cancellata'])['totale'], 1)
+        self.assertEqual(verifica(), [])
+
+        db.session.execute(sa.update(StatisticheGiornaliere).values(prenotazioni=7))
+        db.session.commit()
+        esito = app.test_cli_runner().invoke(args=['statistiche', 'verifica'])
+        self.assertEqual(esito.exit_code, 1)
+        ricostruisci()
+        db.session.commit()
+        self.assertEqual(verifica(), [])
+
+    def test_modifica_menu_riallinea_gli_aggregati(self):
+        gestore = self.crea_utente('gestore', is_gestore=True)
+        menu = self.crea_menu(gestore, prezzo=5.0)
+        studente = self.crea_utente('mario')
+        db.session.add(Prenotazione(utente_id=studente.id, menu_id=menu.id,
+                                    orario_ritiro='12:00', stato='pagata'))
+        db.session.commit()
+        nuova_data = date.today() + timedelta(days=3)
+        with app.test_client() as client:
+            self.login(client, 'gestore')
+            client.post(f'/gestore/menu/{menu.id}/modifica', data={
+                'data': nuova_data.isoformat(), 'primo': 'Pasta', 'secondo': 'Pollo',
+                'contorno': 'Insalata', 'prezzo': '7.5', 'disponibile': 'y'})
+        self.assertEqual(db.session.get(MenuGiornaliero, menu.id).prezzo, 7.5)
+        self.assertEqual(verifica(), [])
+        self.assertEqual(statistiche_menu(menu.id, ['pagata'])['incasso'], 7.5)
+        self.assertEqual(db.session.scalar(sa.select(StatisticheGiornaliere.data)), nuova_data)
+
+    def test_dashboard_usa_gli_aggregati(self):
+        gestore = self.crea_utente('gestore', is_gestore=True)
+        menu = self.crea_menu(gestore, prezzo=4.0)
+        studente = self.crea_utente('mario')
+        db.session.add(Prenotazione(utente_id=studente.id, menu_id=menu.id,
+                                    orario_ritiro='12:30', stato='pagata'))
+        db.session.commit()
+        with app.test_client() as client:
+            self.login(client, 'gestore')
+            risposta = client.get(f'/gestore/menu/{menu.id}/prenotazioni')
+            self.assertIn(b'<span id="totale-prenotazioni">1</span>', risposta.data)
+            self.assertIn(b'4.00', client.get('/gestore/menu').data)
+
+
+
+class MetricheCase(SpeedMensaTestCase):
+    def setUp(self):
+        super().setUp()
+        registro_metriche.azzera()
+        app.config['METRICHE_ABILITATE'] = True
+        app.config['METRICHE_TOKEN'] = 'segreto'
+
+    def tearDown(self):
+        app.config.update(METRICHE_ABILITATE=False, METRICHE_TOKEN=None, METRICHE_PROFILO_CAMPIONE=0)
+        super().tearDown()
+
+    def test_metriche_per_endpoint(self):
+        gestore = self.crea_utente('gestore', is_gestore=True)
+        self.crea_menu(gestore)
+        self.crea_utente('mario')
+        with app.test_client() as client:
+            self.login(client, 'mario')
+            client.get('/index')
+            self.assertEqual(client.get('/gestore/metrics').status_code, 403)
+        with app.test_client() as client:
+            testo = client.get('/gestore/metrics', headers={'Authorization': 'Bearer segreto'}).get_data(True)
+        self.assertIn('# TYPE speedmensa_request_duration_seconds histogram', testo)
+        self.assertIn('speedmensa_requests_total{endpoint="index",method="GET",status="200"} 1', testo)
+        self.assertIn('speedmensa_requests_total{endpoint="metriche",method="GET",status="403"} 1', testo)
+        self.assertIn('speedmensa_request_duration_seconds_count{endpoint="login"} 1', testo)
+        query = int(re.search(r'speedmensa_sql_statements_sum\{endpoint="index"\} (\d+)', testo).group(1))
+        self.assertGreater(query, 0)
+        template = float(re.search(r'speedmensa_template_duration_seconds_sum\{endpoint="index"\} (\S+)',
+                                   testo).group(1))
+        self.assertGreater(template, 0)
+
+    def test_profilo_richieste_lente(self):
+        with tempfile.TemporaryDirectory() as cartella:
+            app.config.update(METRICHE_PROFILO_CAMPIONE=1, METRICHE_PROFILO_SOGLIA=0,
+                              METRICHE_PROFILO_DIR=cartella)
+            with app.test_client() as client:
+                client.get('/login')
+            profili = os.listdir(cartella)
+            self.assertEqual(len(profili), 1)
+            self.assertTrue(profili[0].startswith('login-'))
+            self.assertGreater(pstats.Stats(os.path.join(cartella, profili[0])).total_calls, 0)
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)